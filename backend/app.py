@@ -4,7 +4,7 @@
 流转卡系统 - Python Flask后端
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, make_response, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
 import pymysql
@@ -12,7 +12,30 @@ import bcrypt
 import os
 from datetime import datetime, timedelta
 import json
+from collections import OrderedDict
+from functools import wraps
 from dotenv import load_dotenv
+import db_pool
+from user_context import get_current_user_info, invalidate_user, invalidate_department, get_user_cache_stats, build_user_claims
+from card_data_writer import save_rows, upsert_rows, parse_row_number, CardDataConflict, CARD_SAVE_ISOLATION
+from card_values import CARD_VALUE_STORAGE
+from permission_cache import load_writable_fields, load_field_types, invalidate_template_permissions, invalidate_field_types, get_permission_cache_stats
+from card_list import parse_card_list_args, build_card_filters, build_visibility_filter, build_limit_clause, paginate
+from audit_log import enqueue_operation_log, get_audit_log_stats
+from log_pagination import (parse_log_page_args, build_window_clause, build_keyset_clause, build_page_clause,
+                            created_at_nullable, count_logs, paginate_logs, get_log_pagination_cache_stats)
+from card_counters import refresh_card_counters
+from card_factory import (load_template_setup, validate_bulk_cards, create_cards, expand_bulk_request,
+                          normalize_card_number, is_duplicate_entry, CARD_NUMBER_MAX_LENGTH)
+from flow_cache import load_card_flows, load_snapshot_flows, load_template_flows, invalidate_template_flows, get_flow_cache_stats
+from field_schema import load_card_field_schema, build_row_projection, invalidate_template_field_schemas, invalidate_card_field_schemas, get_field_schema_cache_stats
+from card_data_stream import wants_columnar, row_formatter, columnar_header, stream_card_data
+from dashboard_stats import load_dashboard_stats, invalidate_dashboard_stats, get_dashboard_cache_stats
+from compression import init_compression, get_compression_stats
+from card_delta import (decode_sync_token, encode_sync_token, get_db_now, is_token_expired,
+                        load_changed_rows, load_deleted_rows, sync_watermark)
+from change_tokens import conditional_get, bump_version, get_change_token_stats
+from event_hub import get_hub, publish_card_event, stream_events, get_event_hub_stats, TooManySubscribers
 # from conflict_resolution import get_conflict_resolver  # 已删除
 # from realtime_sync import get_sync_manager  # 已删除
 # 锁定机制已移除，将重新设计
@@ -41,6 +64,12 @@ CORS(app, resources={
 }, supports_credentials=False)
 jwt = JWTManager(app)
 
+# 响应压缩（gzip/brotli，按 Accept-Encoding 协商）
+init_compression(app)
+
+# 创建流转卡和状态变化时清除工作台统计缓存
+get_hub().add_listener(invalidate_dashboard_stats)
+
 # 数据库配置 - 从配置文件读取
 def load_config():
     try:
@@ -84,42 +113,54 @@ def load_config():
 
 DB_CONFIG = load_config()
 
-# 数据库连接函数
+# 初始化进程级连接池（flow_api、FlowManager 共用同一个连接池）
+db_pool.init_pool(DB_CONFIG)
+
+# 数据库连接函数（从连接池借出，close() 即归还）
 def get_db_connection():
     try:
-        connection = pymysql.connect(**DB_CONFIG)
+        connection = db_pool.get_connection()
         return connection
     except Exception as e:
         print(f"数据库连接失败: {e}")
         return None
 
-# 获取当前用户完整信息
-def get_current_user_info():
-    """获取当前用户的完整信息"""
-    try:
-        user_id = get_jwt_identity()
-        if not user_id:
-            return None
-            
-        connection = get_db_connection()
-        if not connection:
-            return None
-        
-        with connection.cursor() as cursor:
-            sql = """
-            SELECT u.*, d.name as department_name 
-            FROM users u 
-            LEFT JOIN departments d ON u.department_id = d.id 
-            WHERE u.id = %s AND u.is_active = 1
-            """
-            cursor.execute(sql, (user_id,))
-            return cursor.fetchone()
-    except Exception as e:
-        print(f"获取用户信息失败: {e}")
-        return None
-    finally:
-        if 'connection' in locals():
-            connection.close()
+# 记录操作日志的装饰器（放在 jwt_required 之后）
+def log_operation(action, target_type="未知", target_id=None, description=""):
+    """
+    记录操作日志的装饰器
+
+    处理函数成功返回（状态码小于 400）后把日志放入异步队列，由后台线程批量写入（见 audit_log）；
+    target_id 未指定时取 URL 中的第一个 ID 参数（如 card_id）
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            response = make_response(func(*args, **kwargs))
+            if response.status_code >= 400:
+                return response
+            try:
+                # 获取当前用户信息
+                current_user = get_current_user_info()
+                if current_user:
+                    # 获取客户端IP
+                    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR',
+                                                    request.environ.get('REMOTE_ADDR', '127.0.0.1'))
+                    enqueue_operation_log(
+                        user_id=current_user['id'],
+                        user_name=current_user['username'],
+                        operation_type=action,
+                        target_type=target_type,
+                        target_id=target_id if target_id is not None else next(iter(kwargs.values()), None),
+                        description=description,
+                        ip_address=client_ip,
+                        user_agent=request.environ.get('HTTP_USER_AGENT', ''),
+                    )
+            except Exception as e:
+                print(f"操作日志装饰器错误: {e}")
+            return response
+        return wrapper
+    return decorator
 
 # 用户认证路由
 @app.route('/api/auth/login', methods=['POST'])
@@ -169,7 +210,8 @@ def login():
                 return jsonify({'success': False, 'message': '选择的部门与用户归属部门不匹配'}), 403
             
             # 生成访问令牌
-            access_token = create_access_token(identity=str(user['id']))
+            access_token = create_access_token(identity=str(user['id']),
+                                               additional_claims=build_user_claims(user))
             
             return jsonify({
                 'success': True,
@@ -217,7 +259,8 @@ def refresh():
                 return jsonify({'success': False, 'message': '用户不存在或已被禁用'}), 401
             
             # 生成新的访问令牌
-            new_token = create_access_token(identity=str(user['id']))
+            new_token = create_access_token(identity=str(user['id']),
+                                            additional_claims=build_user_claims(user))
             
             return jsonify({
                 'success': True,
@@ -359,6 +402,7 @@ def get_available_placeholders():
 # 创建字段（修改为将预留字段转换为业务字段）
 @app.route('/api/fields', methods=['POST'])
 @jwt_required()
+@log_operation('create_field', '字段', description='创建字段')
 def create_field():
     """创建新字段（将预留字段转换为业务字段）"""
     try:
@@ -429,6 +473,8 @@ def create_field():
                 
                 # 提交事务
                 connection.commit()
+                invalidate_field_types()
+                invalidate_template_field_schemas()
                 
                 return jsonify({
                     'success': True,
@@ -448,6 +494,7 @@ def create_field():
 # 更新字段
 @app.route('/api/fields/<int:field_id>', methods=['PUT'])
 @jwt_required()
+@log_operation('update_field', '字段', description='修改字段')
 def update_field(field_id):
     """更新字段信息"""
     try:
@@ -537,6 +584,8 @@ def update_field(field_id):
                 
                 # 提交事务
                 connection.commit()
+                invalidate_field_types()
+                invalidate_template_field_schemas()
                 
                 return jsonify({
                     'success': True,
@@ -556,6 +605,7 @@ def update_field(field_id):
 # 删除字段（修改为还原为预留字段）
 @app.route('/api/fields/<int:field_id>', methods=['DELETE'])
 @jwt_required()
+@log_operation('delete_field', '字段', description='删除字段')
 def delete_field(field_id):
     """删除字段（还原为预留字段）"""
     try:
@@ -598,6 +648,8 @@ def delete_field(field_id):
                 
                 # 提交事务
                 connection.commit()
+                invalidate_field_types()
+                invalidate_template_field_schemas()
                 
                 return jsonify({
                     'success': True,
@@ -645,7 +697,7 @@ def get_public_departments():
 def get_profile():
     """获取当前用户信息"""
     try:
-        current_user = get_current_user_info()
+        current_user = get_current_user_info(require_full=True)
         if not current_user:
             return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
         
@@ -730,6 +782,7 @@ def get_users():
 # 创建用户
 @app.route('/api/users', methods=['POST'])
 @jwt_required()
+@log_operation('create_user', '用户', description='创建用户')
 def create_user():
     """创建新用户"""
     try:
@@ -785,6 +838,7 @@ def create_user():
 # 更新用户
 @app.route('/api/users/<int:user_id>', methods=['PUT'])
 @jwt_required()
+@log_operation('update_user', '用户', description='修改用户')
 def update_user(user_id):
     """更新用户信息"""
     try:
@@ -838,6 +892,7 @@ def update_user(user_id):
                 update_sql = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
                 cursor.execute(update_sql, update_params)
                 connection.commit()
+                invalidate_user(user_id)
             
             return jsonify({
                 'success': True,
@@ -853,6 +908,7 @@ def update_user(user_id):
 # 删除用户
 @app.route('/api/users/<int:user_id>', methods=['DELETE'])
 @jwt_required()
+@log_operation('delete_user', '用户', description='删除用户')
 def delete_user(user_id):
     """删除用户"""
     try:
@@ -869,6 +925,7 @@ def delete_user(user_id):
         with connection.cursor() as cursor:
             cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
             connection.commit()
+            invalidate_user(user_id)
             
             return jsonify({
                 'success': True,
@@ -916,6 +973,7 @@ def get_departments():
 # 创建部门
 @app.route('/api/departments', methods=['POST'])
 @jwt_required()
+@log_operation('create_department', '部门', description='创建部门')
 def create_department():
     """创建新部门"""
     try:
@@ -964,6 +1022,7 @@ def create_department():
 # 更新部门
 @app.route('/api/departments/<int:dept_id>', methods=['PUT'])
 @jwt_required()
+@log_operation('update_department', '部门', description='修改部门')
 def update_department(dept_id):
     """更新部门信息"""
     try:
@@ -1001,6 +1060,8 @@ def update_department(dept_id):
                 update_sql = f"UPDATE departments SET {', '.join(update_fields)} WHERE id = %s"
                 cursor.execute(update_sql, update_params)
                 connection.commit()
+                invalidate_department(dept_id)
+                invalidate_template_flows()
             
             return jsonify({
                 'success': True,
@@ -1016,6 +1077,7 @@ def update_department(dept_id):
 # 删除部门
 @app.route('/api/departments/<int:dept_id>', methods=['DELETE'])
 @jwt_required()
+@log_operation('delete_department', '部门', description='删除部门')
 def delete_department(dept_id):
     """删除部门"""
     try:
@@ -1032,6 +1094,8 @@ def delete_department(dept_id):
         with connection.cursor() as cursor:
             cursor.execute("DELETE FROM departments WHERE id = %s", (dept_id,))
             connection.commit()
+            invalidate_department(dept_id)
+            invalidate_template_flows()
             
             return jsonify({
                 'success': True,
@@ -1049,55 +1113,56 @@ def delete_department(dept_id):
 # 获取流转卡列表
 @app.route('/api/cards', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_cards():
-    """获取流转卡列表"""
+    """获取流转卡列表（支持 limit/cursor 分页、状态/部门筛选和搜索）"""
     try:
         current_user = get_current_user_info()
         if not current_user:
             return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
         
+        try:
+            list_params = parse_card_list_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
         connection = get_db_connection()
         if not connection:
             return jsonify({'success': False, 'message': '数据库连接失败'}), 500
         
         with connection.cursor() as cursor:
-            if current_user['role'] == 'admin':
-                # 管理员可以看到所有流转卡（使用快照信息，不依赖templates表）
-                sql = """
-                SELECT tc.*, 
-                       COALESCE(ts.template_name, t.template_name, '未知模板') as template_name,
-                       u.username as creator_name,
-                       (SELECT COUNT(*) FROM card_data cdr WHERE cdr.card_id = tc.id) as row_count
-                FROM transfer_cards tc
-                LEFT JOIN template_snapshots ts ON tc.snapshot_id = ts.snapshot_id
-                LEFT JOIN templates t ON tc.template_id = t.id
-                LEFT JOIN users u ON tc.created_by = u.id
-                ORDER BY tc.created_at DESC
-                """
-                cursor.execute(sql)
-            else:
-                # 普通用户只能看到有权限访问的流转卡，且不能看到草稿和取消状态（使用快照信息）
-                sql = """
-                SELECT DISTINCT tc.*, 
-                       COALESCE(ts.template_name, t.template_name, '未知模板') as template_name,
-                       u.username as creator_name,
-                       (SELECT COUNT(*) FROM card_data cdr WHERE cdr.card_id = tc.id) as row_count
-                FROM transfer_cards tc
-                LEFT JOIN template_snapshots ts ON tc.snapshot_id = ts.snapshot_id
-                LEFT JOIN templates t ON tc.template_id = t.id
-                LEFT JOIN users u ON tc.created_by = u.id
-                LEFT JOIN template_field_permissions tfp ON COALESCE(ts.template_id, t.id) = tfp.template_id
-                WHERE (tfp.department_id = %s OR tc.created_by = %s OR tfp.template_id IS NULL)
-                AND tc.status NOT IN ('draft', 'cancelled')
-                ORDER BY tc.created_at DESC
-                """
-                cursor.execute(sql, (current_user['department_id'], current_user['id']))
+            where_clauses, where_values = build_card_filters(list_params)
+            # 普通用户只能看到有权限访问的流转卡，且不能看到草稿和取消状态
+            visibility_clauses, visibility_values = build_visibility_filter(current_user)
+            where_clauses = visibility_clauses + where_clauses
+            where_values = visibility_values + where_values
             
-            cards = cursor.fetchall()
+            where_sql = ('WHERE ' + ' AND '.join(where_clauses)) if where_clauses else ''
+            limit_sql, limit_values = build_limit_clause(list_params)
+            
+            # 按 (created_at, id) 索引顺序取一页，数据行数直接读取流转卡上的计数
+            # （使用快照信息，不依赖templates表）
+            sql = f"""
+            SELECT tc.*, 
+                   COALESCE(ts.template_name, t.template_name, '未知模板') as template_name,
+                   u.username as creator_name,
+                   tc.data_row_count as row_count
+            FROM transfer_cards tc
+            LEFT JOIN template_snapshots ts ON tc.snapshot_id = ts.snapshot_id
+            LEFT JOIN templates t ON tc.template_id = t.id
+            LEFT JOIN users u ON tc.created_by = u.id
+            {where_sql}
+            ORDER BY tc.created_at DESC, tc.id DESC
+            {limit_sql}
+            """
+            cursor.execute(sql, where_values + limit_values)
+            
+            cards, pagination = paginate(cursor.fetchall(), list_params)
             
             return jsonify({
                 'success': True,
-                'data': cards
+                'data': cards,
+                'pagination': pagination
             })
     
     except Exception as e:
@@ -1109,6 +1174,7 @@ def get_cards():
 # 创建流转卡（仅管理员）
 @app.route('/api/cards', methods=['POST'])
 @jwt_required()
+@log_operation('create_card', '流转卡', description='创建流转卡')
 def create_card():
     """创建流转卡（仅管理员）"""
     try:
@@ -1153,8 +1219,12 @@ def create_card():
                 # 不再创建card_data_rows记录，新的设计中只有card_data表
                 # 每条记录代表一行有数据的数据，不需要预先创建空行
                 
+                # 初始化流转卡计数（总流转步骤数取模板步骤数）
+                refresh_card_counters(cursor, [card_id])
+                
                 # 提交事务
                 connection.commit()
+                publish_card_event(connection, 'card-created', card_id)
                 
                 return jsonify({
                     'success': True,
@@ -1180,12 +1250,33 @@ def create_card():
 @app.route('/api/cards/<int:card_id>/data', methods=['GET'])
 @jwt_required()
 def get_card_data(card_id):
-    """获取流转卡数据（表格格式）"""
+    """
+    获取流转卡数据（表格格式）
+
+    - since: 上次返回的 sync_token，只返回增量
+    - stream=1: 用服务端游标边读边输出（适合数据行很多的流转卡）
+    - flat=0: 行数据只保留 values，不重复输出平铺的字段值
+    - format=columnar（或 Accept 列式类型）: 列名只输出一次，行为数组
+    """
+    streaming = False
     try:
         current_user = get_current_user_info()
         if not current_user:
             return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
         
+        # 增量同步：since 为上次返回的 sync_token
+        since_seq = synced_at = None
+        since = request.args.get('since')
+        if since:
+            try:
+                since_seq, synced_at = decode_sync_token(since)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+        
+        stream = request.args.get('stream', '').lower() in ('1', 'true')
+        flat = request.args.get('flat', '1').lower() not in ('0', 'false')
+        columnar = wants_columnar(request)
+        
         connection = get_db_connection()
         if not connection:
             return jsonify({'success': False, 'message': '数据库连接失败'}), 500
@@ -1204,172 +1295,75 @@ def get_card_data(card_id):
             if not card_info:
                 return jsonify({'success': False, 'message': '流转卡不存在'}), 404
             
-            # 获取流转卡快照的字段配置（优先使用快照，如果快照为空则回退到模板）
-            if current_user['role'] == 'admin':
-                # 管理员可以看到快照的所有字段
-                field_sql = """
-                SELECT ctf.*,
-                       GROUP_CONCAT(DISTINCT cfp.can_read) as can_read,
-                       GROUP_CONCAT(DISTINCT cfp.can_write) as can_write,
-                       GROUP_CONCAT(DISTINCT cfp.department_id) as perm_dept_id
-                FROM card_template_fields ctf
-                LEFT JOIN card_field_permissions cfp ON ctf.field_name = cfp.field_name 
-                                                      AND cfp.card_id = %s
-                WHERE ctf.card_id = %s
-                GROUP BY ctf.id
-                ORDER BY ctf.field_order
-                """
-                cursor.execute(field_sql, (card_id, card_id))
-                
-                fields = cursor.fetchall()
-                
-                # 如果快照为空，回退到模板（兼容旧数据）
-                if not fields and card_info.get('template_id'):
-                    fallback_field_sql = """
-                    SELECT tf.*, f.department_name, f.department_id as field_dept_id,
-                           GROUP_CONCAT(DISTINCT tfp.can_read) as can_read,
-                           GROUP_CONCAT(DISTINCT tfp.can_write) as can_write,
-                           GROUP_CONCAT(DISTINCT tfp.department_id) as perm_dept_id
-                    FROM template_fields tf
-                    LEFT JOIN fields f ON tf.field_id = f.id
-                    LEFT JOIN template_field_permissions tfp ON tf.field_name = tfp.field_name 
-                                                              AND tfp.template_id = %s
-                    WHERE tf.template_id = %s
-                    GROUP BY tf.id
-                    ORDER BY tf.field_order
-                    """
-                    cursor.execute(fallback_field_sql, (card_info['template_id'], card_info['template_id']))
-                    fields = cursor.fetchall()
-            else:
-                # 普通用户只能看到快照配置且有权限的字段
-                field_sql = """
-                SELECT ctf.*,
-                       GROUP_CONCAT(DISTINCT cfp.can_read) as can_read,
-                       GROUP_CONCAT(DISTINCT cfp.can_write) as can_write,
-                       GROUP_CONCAT(DISTINCT cfp.department_id) as perm_dept_id
-                FROM card_template_fields ctf
-                LEFT JOIN card_field_permissions cfp ON ctf.field_name = cfp.field_name 
-                                                      AND cfp.card_id = %s
-                                                      AND cfp.department_id = %s
-                WHERE ctf.card_id = %s
-                GROUP BY ctf.id
-                ORDER BY ctf.field_order
-                """
-                cursor.execute(field_sql, (card_id, current_user['department_id'], card_id))
-                
-                fields = cursor.fetchall()
-                
-                # 如果快照为空，回退到模板（兼容旧数据）
-                if not fields and card_info.get('template_id'):
-                    fallback_field_sql = """
-                    SELECT tf.*, f.department_name, f.department_id as field_dept_id,
-                           GROUP_CONCAT(DISTINCT tfp.can_read) as can_read,
-                           GROUP_CONCAT(DISTINCT tfp.can_write) as can_write,
-                           GROUP_CONCAT(DISTINCT tfp.department_id) as perm_dept_id
-                    FROM template_fields tf
-                    LEFT JOIN fields f ON tf.field_id = f.id
-                    LEFT JOIN template_field_permissions tfp ON tf.field_name = tfp.field_name 
-                                                              AND tfp.template_id = %s
-                                                              AND tfp.department_id = %s
-                    WHERE tf.template_id = %s
-                    GROUP BY tf.id
-                    ORDER BY tf.field_order
-                    """
-                    cursor.execute(fallback_field_sql, (card_info['template_id'], current_user['department_id'], card_info['template_id']))
-                    fields = cursor.fetchall()
-            
-            # 处理GROUP_CONCAT结果，转换为布尔值，并重命名字段以匹配前端期望
-            for field in fields:
-                # 重命名字段以匹配前端期望的格式
-                if 'field_name' in field and 'name' not in field:
-                    field['name'] = field['field_name']
-                if 'field_display_name' in field and 'display_name' not in field:
-                    field['display_name'] = field['field_display_name']
-                
-                if field.get('can_read'):
-                    # 将逗号分隔的值转换为布尔值
-                    can_read_values = str(field['can_read']).split(',')
-                    field['can_read'] = any(value.strip() == '1' for value in can_read_values)
-                else:
-                    field['can_read'] = False
-                    
-                if field.get('can_write'):
-                    # 将逗号分隔的值转换为布尔值
-                    can_write_values = str(field['can_write']).split(',')
-                    field['can_write'] = any(value.strip() == '1' for value in can_write_values)
-                else:
-                    field['can_write'] = False
-                    
-                # 处理部门ID
-                if field.get('perm_dept_id'):
-                    dept_ids = str(field['perm_dept_id']).split(',')
-                    field['perm_dept_id'] = [int(id.strip()) for id in dept_ids if id.strip().isdigit()]
-                else:
-                    field['perm_dept_id'] = None
+            # 字段结构按（快照或流转卡，部门）编译缓存：优先使用快照，快照为空则回退到模板
+            schema = load_card_field_schema(cursor, card_id, card_info.get('template_id'), current_user,
+                                            card_info.get('snapshot_id'))
+            # 只读取用户可读的字段列，其余字段按空值返回
+            select_list = build_row_projection(cursor, schema.readable_columns(current_user))
+            
+            # 新的同步令牌取读取数据行之前的同步水位（不超过未提交的写入）
+            db_now = get_db_now(cursor)
+            if since_seq is not None and is_token_expired(synced_at, db_now):
+                since_seq = None
+            
+            sync_token = encode_sync_token(sync_watermark(cursor, card_id), db_now)
+            formatter, rows_key = row_formatter(schema, columnar, flat)
+            
+            if since_seq is not None:
+                # 增量：只取令牌之后写入过的行和删除的行号
+                rows = load_changed_rows(cursor, card_id, since_seq, select_list)
+                data = columnar_header(schema) if columnar else {}
+                data.update({
+                    'delta': True,
+                    rows_key: [formatter(row) for row in rows],
+                    'deleted_rows': load_deleted_rows(cursor, card_id, since_seq),
+                    'sync_token': sync_token
+                })
+                response = jsonify({'success': True, 'data': data})
+                response.vary.add('Accept')
+                return response
             
-            # 获取数据行（新的card_data表）
-            cursor.execute("""
-                SELECT cd.*, d.name as department_name
+            # 获取数据行（新的card_data表，每条记录代表一行有数据的数据）
+            rows_sql = f"""
+                SELECT {select_list}, d.name as department_name
                 FROM card_data cd
                 LEFT JOIN departments d ON cd.department_id = d.id
                 WHERE cd.card_id = %s
                 ORDER BY cd.row_number
-            """, (card_id,))
-            rows = cursor.fetchall()
-            
-            # 不再有单独的card_data记录，数据直接在rows中
-            card_data = None
-            
-            # 构建表格数据 - 新的数据结构（每条记录代表一行有数据的数据）
-            table_data = []
-            
-            # 处理每一行数据
-            for row in rows:
-                row_data = {
-                    'row_number': row['row_number'],
-                    'department_id': row['department_id'],
-                    'department_name': row['department_name'],
-                    'status': row['status'],
-                    'submitted_by': row['submitted_by'],
-                    'submitted_at': row['submitted_at'].isoformat() if row['submitted_at'] else None,
-                    'values': {}
-                }
-                
-                # 为每个字段添加值（从当前行记录中获取）
-                for field in fields:
-                    field_name = field['field_name']
-                    field_value = row.get(field_name, '')
-                    
-                    # 处理日期格式
-                    if field_value and hasattr(field_value, 'isoformat'):
-                        field_value = field_value.isoformat()
-                    elif field_value is None:
-                        field_value = ''
-                    
-                    row_data['values'][field_name] = field_value
-                    # 同时将字段值直接添加到行数据中（兼容前端处理）
-                    row_data[field_name] = field_value
-                
-                table_data.append(row_data)
-            
-            return jsonify({
-                'success': True,
-                'data': {
-                    'card_info': card_info,
-                    'fields': fields,
-                    'table_data': table_data
-                }
+            """
+            head = columnar_header(schema) if columnar else {}
+            head.update({
+                'card_info': card_info,
+                'fields': schema.field_list(),
+                'sync_token': sync_token
             })
+            
+            if stream:
+                # 流式输出：连接交给生成器，读完数据行后归还
+                body = stream_card_data(connection, head, rows_sql, (card_id,), formatter, rows_key)
+                streaming = True
+                response = Response(stream_with_context(body), mimetype='application/json')
+                response.vary.add('Accept')
+                # 生成器尚未开始时客户端就断开，也要归还连接
+                response.call_on_close(connection.close)
+                return response
+            
+            cursor.execute(rows_sql, (card_id,))
+            head[rows_key] = [formatter(row) for row in cursor.fetchall()]
+            response = jsonify({'success': True, 'data': head})
+            response.vary.add('Accept')
+            return response
     
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取流转卡数据失败: {str(e)}'}), 500
     finally:
-        if 'connection' in locals():
+        if 'connection' in locals() and not streaming:
             connection.close()
 
 # 批量保存流转卡数据（带冲突检测和解决）
 @app.route('/api/cards/<int:card_id>/data', methods=['POST'])
 @jwt_required()
+@log_operation('save_card_data', '流转卡', description='保存流转卡数据')
 def save_card_data(card_id):
     """批量保存流转卡数据（支持冲突检测和解决）"""
     try:
@@ -1390,176 +1384,59 @@ def save_card_data(card_id):
         if not connection:
             return jsonify({'success': False, 'message': '数据库连接失败'}), 500
         
-        with connection.cursor() as cursor:
-            # 开始事务，使用SERIALIZABLE隔离级别防止并发问题
-            connection.begin()
+        def save_transaction(cursor):
+            # 检查流转卡是否存在（不锁定流转卡行，由目标数据行的行锁和版本号保证一致性）
+            cursor.execute("SELECT id, template_id, updated_at, status FROM transfer_cards WHERE id = %s", (card_id,))
+            card_result = cursor.fetchone()
+            if not card_result:
+                return {'success': False, 'message': '流转卡不存在'}, 404
             
-            try:
-                # 设置事务隔离级别为SERIALIZABLE，防止并发修改
-                cursor.execute("SET TRANSACTION ISOLATION LEVEL SERIALIZABLE")
-                
-                # 检查流转卡是否存在并锁定
-                cursor.execute("SELECT id, template_id, updated_at, status FROM transfer_cards WHERE id = %s FOR UPDATE", (card_id,))
-                card_result = cursor.fetchone()
-                if not card_result:
-                    return jsonify({'success': False, 'message': '流转卡不存在'}), 404
-                
-                # 检查流转卡是否已完成（管理员除外）
-                if card_result['status'] == 'completed' and current_user['role'] != 'admin':
-                    return jsonify({'success': False, 'message': '该流转卡已完成整个流转流程，无法再修改数据'}), 403
-                
-                template_id = card_result['template_id']
-                card_updated_at = card_result['updated_at']
-                
-                # 处理每行数据 - 新的数据库结构（每条记录代表一行有数据的数据）
+            # 检查流转卡是否已完成（管理员除外）
+            if card_result['status'] == 'completed' and current_user['role'] != 'admin':
+                return {'success': False, 'message': '该流转卡已完成整个流转流程，无法再修改数据'}, 403
+            
+            template_id = card_result['template_id']
+            
+            # 删除数据行只允许管理员操作
+            if current_user['role'] != 'admin' and any(row_data.get('delete') for row_data in row_data_list):
+                return {'success': False, 'message': '只有管理员可以删除数据行'}, 403
+            
+            # 检查用户是否有权限修改这些字段（权限集合一次加载，内存校验）
+            if current_user['role'] != 'admin':
+                writable_fields = load_writable_fields(cursor, template_id, current_user['department_id'])
                 for row_data in row_data_list:
-                    row_number = row_data.get('row_number')
-                    values = row_data.get('values', {})
-                    client_updated_at = data.get('client_updated_at')  # 客户端数据最后更新时间
-                    
-                    if not row_number:
+                    if not row_data.get('row_number'):
                         continue
-                    
-                    # 检查用户是否有权限修改这些字段
-                    for field_name, field_value in values.items():
-                        if current_user['role'] != 'admin':
-                            # 检查字段权限
-                            cursor.execute("""
-                                SELECT can_write FROM template_field_permissions 
-                                WHERE template_id = %s AND field_name = %s AND department_id = %s
-                            """, (template_id, field_name, current_user['department_id']))
-                            perm_result = cursor.fetchone()
-                            
-                            if not perm_result or not perm_result['can_write']:
-                                return jsonify({
-                                    'success': False, 
-                                    'message': f'您没有权限修改字段 {field_name}'
-                                }), 403
-                    
-                    # 锁定目标行防止并发修改
-                    cursor.execute("""
-                        SELECT id, updated_at, submitted_by, submitted_at 
-                        FROM card_data 
-                        WHERE card_id = %s AND `row_number` = %s 
-                        FOR UPDATE
-                    """, (card_id, row_number))
-                    existing_row = cursor.fetchone()
-                    
-                    # 检查数据冲突：如果该行已被其他用户提交
-                    if existing_row and existing_row['submitted_at']:
-                        submitted_by_other = existing_row['submitted_by']
-                        if submitted_by_other and str(submitted_by_other) != str(current_user['id']):
-                            # 该行已被其他用户提交，禁止修改
-                            cursor.execute("SELECT username FROM users WHERE id = %s", (submitted_by_other,))
-                            submitter_result = cursor.fetchone()
-                            submitter_name = submitter_result['username'] if submitter_result else '未知用户'
-                            
-                            return jsonify({
-                                'success': False,
-                                'message': f'第{row_number}行已被用户 {submitter_name} 提交，无法修改',
-                                'error_type': 'DATA_CONFLICT',
-                                'conflict_info': {
-                                    'row_number': row_number,
-                                    'submitted_by': submitter_name,
-                                    'submitted_at': existing_row['submitted_at'].isoformat() if existing_row['submitted_at'] else None
-                                }
-                            }), 409
-                    
-                    # 检查版本冲突（基于更新时间）
-                    if existing_row and client_updated_at:
-                        server_updated_at = existing_row['updated_at']
-                        if server_updated_at and client_updated_at:
-                            try:
-                                from datetime import datetime
-                                client_time = datetime.fromisoformat(client_updated_at.replace('Z', '+00:00'))
-                                server_time = server_updated_at.replace(tzinfo=None)
-                                
-                                # 如果服务器时间比客户端时间新，说明有冲突
-                                if server_time > client_time:
-                                    return jsonify({
-                                        'success': False,
-                                        'message': f'第{row_number}行数据已被其他用户修改，请刷新后重试',
-                                        'error_type': 'VERSION_CONFLICT',
-                                        'conflict_info': {
-                                            'row_number': row_number,
-                                            'server_updated_at': server_time.isoformat(),
-                                            'client_updated_at': client_updated_at
-                                        }
-                                    }), 409
-                            except Exception as version_error:
-                                print(f"版本检查错误: {version_error}")
-                                # 版本检查失败时继续执行，但记录警告
-                    
-                    if existing_row:
-                        # 更新现有行
-                        update_fields = []
-                        update_params = []
-                        
-                        for field_name, field_value in values.items():
-                            update_fields.append(f"{field_name} = %s")
-                            update_params.append(field_value)
-                        
-                        if update_fields:
-                            update_fields.append("updated_at = NOW()")
-                            update_params.append(card_id)
-                            update_params.append(row_number)
-                            
-                            update_sql = f"""
-                            UPDATE card_data 
-                            SET {', '.join(update_fields)} 
-                            WHERE card_id = %s AND `row_number` = %s
-                            """
-                            cursor.execute(update_sql, update_params)
-                            print(f" 更新行 {row_number}: {update_sql}")
-                    else:
-                        # 插入新行（只有有数据时才插入）
-                        if any(values.values()):  # 只有当至少有一个字段有值时才插入
-                            insert_fields = ['card_id', 'row_number'] + list(values.keys())
-                            insert_values = [card_id, row_number] + list(values.values())
-                            placeholders = ', '.join(['%s'] * len(insert_fields))
-                            
-                            insert_sql = f"""
-                            INSERT INTO card_data ({', '.join([f'`{f}`' if f == 'row_number' else f for f in insert_fields])}, created_at, updated_at)
-                            VALUES ({placeholders}, NOW(), NOW())
-                            """
-                            cursor.execute(insert_sql, insert_values)
-                            print(f" 插入新行 {row_number}: {insert_sql}")
-                    
-                    # 更新行状态（如果用户提交）
-                    if row_data.get('submit', False):
-                        if existing_row and existing_row['submitted_at']:
-                            # 检查是否已经提交
-                            if existing_row['submitted_by'] == current_user['id']:
-                                # 已经是同一用户提交，允许更新
-                                pass
-                            else:
-                                # 其他用户已提交，禁止重复提交
-                                return jsonify({
-                                    'success': False,
-                                    'message': f'第{row_number}行已被其他用户提交，无法重复提交',
-                                    'error_type': 'ALREADY_SUBMITTED'
-                                }), 409
-                        
-                        cursor.execute("""
-                            UPDATE card_data 
-                            SET status = 'submitted', submitted_by = %s, submitted_at = NOW()
-                            WHERE card_id = %s AND `row_number` = %s
-                        """, (current_user['id'], card_id, row_number))
-                
-                # 提交事务
-                connection.commit()
-                
-                # 实时同步通知功能已移除
-                print(f" 数据保存完成，流转卡ID: {card_id}")
-                
-                return jsonify({
-                    'success': True,
-                    'message': '数据保存成功'
-                })
-            
-            except Exception as e:
-                connection.rollback()
-                raise e
+                    for field_name in row_data.get('values', {}):
+                        if field_name not in writable_fields:
+                            return {
+                                'success': False, 
+                                'message': f'您没有权限修改字段 {field_name}'
+                            }, 403
+            
+            # 批量锁定目标行、检查冲突并写入（每条记录代表一行有数据的数据）
+            save_stats = save_rows(cursor, card_id, row_data_list, current_user['id'],
+                                   client_updated_at=data.get('client_updated_at'))
+            print(f" 数据保存完成，流转卡ID: {card_id}, 写入 {save_stats['written']} 行")
+            
+            return {'success': True, 'message': '数据保存成功'}, 200
+        
+        # 死锁或锁等待超时时自动重试整个事务
+        try:
+            (result, status_code), retries = db_pool.run_in_transaction(
+                connection, save_transaction, isolation_level=CARD_SAVE_ISOLATION)
+        except CardDataConflict as conflict:
+            return jsonify(conflict.to_response()), 409
+        except ValueError as e:
+            # 行号或字段名不合法
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        if status_code == 200:
+            result['retries'] = retries
+            publish_card_event(connection, 'row-saved', card_id,
+                               rows=[row.get('row_number') for row in row_data_list if row.get('row_number')],
+                               user_id=current_user['id'])
+        return jsonify(result), status_code
     
     except Exception as e:
         return jsonify({'success': False, 'message': f'保存数据失败: {str(e)}'}), 500
@@ -1571,6 +1448,7 @@ def save_card_data(card_id):
 # 更新流转卡数据
 @app.route('/api/cards/<int:card_id>/data', methods=['PUT'])
 @jwt_required()
+@log_operation('update_card_data', '流转卡', description='更新流转卡数据')
 def update_card_data(card_id):
     """更新流转卡数据"""
     try:
@@ -1628,8 +1506,15 @@ def update_card_data(card_id):
                 template_id = card_result['template_id']
                 old_status = card_result.get('status')
                 
+                # 权限集合和字段类型一次加载，逐字段只做内存查找
+                writable_fields = None
+                if current_user['role'] != 'admin':
+                    writable_fields = load_writable_fields(cursor, template_id, current_user['department_id'])
+                field_types = load_field_types(cursor) if table_data else {}
+                
                 # 处理数据更新 - 新的数据库结构（每条记录代表一行有数据的数据）
                 if table_data:
+                    pending_rows = OrderedDict()
                     for row_data in table_data:
                         if not isinstance(row_data, dict):
                             continue
@@ -1637,6 +1522,9 @@ def update_card_data(card_id):
                         row_number = row_data.get('row_number')
                         if not row_number:
                             continue
+                        parsed_row_number = parse_row_number(row_number)
+                        if parsed_row_number is None:
+                            return jsonify({'success': False, 'message': f'行号无效: {row_number}'}), 400
                         
                         # 收集字段更新
                         field_updates = {}
@@ -1647,29 +1535,17 @@ def update_card_data(card_id):
                                 continue
                                 
                             # 检查用户是否有权限修改这个字段
-                            if current_user['role'] != 'admin':
-                                cursor.execute("""
-                                    SELECT can_write FROM template_field_permissions 
-                                    WHERE template_id = %s AND field_name = %s AND department_id = %s
-                                """, (template_id, field_name, current_user['department_id']))
-                                perm_result = cursor.fetchone()
-                                
-                                if not perm_result or not perm_result['can_write']:
-                                    print(f" 跳过无权限字段: {field_name}")
-                                    continue  # 跳过无权限的字段
+                            if writable_fields is not None and field_name not in writable_fields:
+                                print(f" 跳过无权限字段: {field_name}")
+                                continue  # 跳过无权限的字段
                             
                             # 处理特殊字段类型的值
                             processed_value = field_value
                             if field_value == '' or field_value is None:
                                 # 获取字段类型信息
-                                cursor.execute("""
-                                    SELECT field_type FROM fields 
-                                    WHERE name = %s
-                                """, (field_name,))
-                                field_type_result = cursor.fetchone()
+                                field_type = field_types.get(field_name)
                                 
-                                if field_type_result:
-                                    field_type = field_type_result['field_type']
+                                if field_type is not None:
                                     # 对于日期类型，将空字符串转换为NULL
                                     if field_type == 'date':
                                         processed_value = None
@@ -1687,53 +1563,22 @@ def update_card_data(card_id):
                             field_updates[field_name] = processed_value
                             print(f" 收集字段更新: {field_name} = {processed_value} (原始值: {field_value})")
                         
-                        # 检查该行是否已存在
-                        cursor.execute("SELECT id FROM card_data WHERE card_id = %s AND `row_number` = %s", (card_id, row_number))
-                        existing_row = cursor.fetchone()
-                        
-                        if existing_row and field_updates:
-                            # 更新现有行
-                            update_fields = []
-                            update_params = []
-                            
-                            for field_name, field_value in field_updates.items():
-                                update_fields.append(f"{field_name} = %s")
-                                update_params.append(field_value)
-                            
-                            if update_fields:
-                                update_fields.append("updated_at = NOW()")
-                                update_params.append(card_id)
-                                update_params.append(row_number)
-                                
-                                update_sql = f"""
-                                UPDATE card_data 
-                                SET {', '.join(update_fields)} 
-                                WHERE card_id = %s AND `row_number` = %s
-                                """
-                                cursor.execute(update_sql, update_params)
-                                print(f" 更新行 {row_number}: {update_sql}")
-                        
-                        elif not existing_row and field_updates:
-                            # 插入新行（只有有数据时才插入）
-                            insert_fields = ['card_id', 'row_number'] + list(field_updates.keys())
-                            insert_values = [card_id, row_number] + list(field_updates.values())
-                            placeholders = ', '.join(['%s'] * len(insert_fields))
-                            
-                            insert_sql = f"""
-                            INSERT INTO card_data ({', '.join([f'`{f}`' if f == 'row_number' else f for f in insert_fields])}, created_at, updated_at)
-                            VALUES ({placeholders}, NOW(), NOW())
-                            """
-                            cursor.execute(insert_sql, insert_values)
-                            print(f" 插入新行 {row_number}: {insert_sql}")
-                
-                # 更新流转卡状态
+                        if field_updates:
+                            pending_rows.setdefault(parsed_row_number, {'values': {}})['values'].update(field_updates)
+                    
+                    # 已存在的行更新、不存在的行插入，按列集合批量写入
+                    written, _ = upsert_rows(cursor, card_id, pending_rows)
+                    print(f" 批量写入 {len(written)} 行")
+                
+                # 更新流转卡状态（变为取消时记录取消时间，供每日统计按取消日期汇总）
                 if status:
                     old_status = card_result.get('status')
                     cursor.execute("""
                         UPDATE transfer_cards 
-                        SET status = %s, updated_at = NOW()
+                        SET cancelled_at = IF(%s = 'cancelled' AND NOT status <=> 'cancelled', NOW(), cancelled_at),
+                            status = %s, updated_at = NOW()
                         WHERE id = %s
-                    """, (status, card_id))
+                    """, (status, status, card_id))
                     
                     # 如果状态从draft变为in_progress，自动启动流转
                     if old_status == 'draft' and status == 'in_progress':
@@ -1824,8 +1669,12 @@ def update_card_data(card_id):
                                 
                                 print(f" 自动启动流转卡 {card_id} 的流转，当前流转至: {flow_steps[0]['department_name']}")
                 
+                # 批量写入和自动启动流转后重新计算流转卡计数
+                refresh_card_counters(cursor, [card_id])
+                
                 # 提交事务
                 connection.commit()
+                publish_card_event(connection, 'card-updated', card_id, status=status)
                 
                 return jsonify({
                     'success': True,
@@ -1882,6 +1731,7 @@ def get_templates():
 # 创建模板
 @app.route('/api/templates', methods=['POST'])
 @jwt_required()
+@log_operation('create_template', '模板', description='创建模板')
 def create_template():
     """创建新模板"""
     try:
@@ -1923,6 +1773,7 @@ def create_template():
 # 更新模板
 @app.route('/api/templates/<int:template_id>', methods=['PUT'])
 @jwt_required()
+@log_operation('update_template', '模板', description='修改模板')
 def update_template(template_id):
     """更新模板信息"""
     try:
@@ -1963,6 +1814,8 @@ def update_template(template_id):
                 update_sql = f"UPDATE templates SET {', '.join(update_fields)} WHERE id = %s"
                 cursor.execute(update_sql, update_params)
                 connection.commit()
+                # 列表中显示模板名称
+                bump_version(connection)
             
             return jsonify({
                 'success': True,
@@ -1978,6 +1831,7 @@ def update_template(template_id):
 # 删除模板
 @app.route('/api/templates/<int:template_id>', methods=['DELETE'])
 @jwt_required()
+@log_operation('delete_template', '模板', description='删除模板')
 def delete_template(template_id):
     """删除模板"""
     try:
@@ -1992,6 +1846,10 @@ def delete_template(template_id):
         with connection.cursor() as cursor:
             cursor.execute("DELETE FROM templates WHERE id = %s", (template_id,))
             connection.commit()
+            bump_version(connection)
+            invalidate_template_permissions(template_id)
+            invalidate_template_flows(template_id)
+            invalidate_template_field_schemas(template_id)
             
             return jsonify({
                 'success': True,
@@ -2009,110 +1867,107 @@ def delete_template(template_id):
 # 获取模板流转卡列表（使用现有的transfer_cards表）
 @app.route('/api/template-cards', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_template_cards():
-    """获取基于模板的流转卡列表（包含流转顺序）"""
+    """获取基于模板的流转卡列表（包含流转顺序，支持 limit/cursor 分页、筛选和搜索）"""
     try:
         current_user = get_current_user_info()
         if not current_user:
             return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
         
+        try:
+            list_params = parse_card_list_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
         connection = get_db_connection()
         if not connection:
             return jsonify({'success': False, 'message': '数据库连接失败'}), 500
         
         with connection.cursor() as cursor:
-            if current_user['role'] == 'admin':
-                # 管理员可以看到所有基于模板的流转卡（使用快照，不依赖templates表）
-                sql = """
-                SELECT tc.*, 
-                       COALESCE(ts.template_name, t.template_name, '未知模板') as template_name, 
-                       u.username as creator_name,
-                       (SELECT COUNT(*) FROM card_data cdr WHERE cdr.card_id = tc.id) as row_count,
-                       d.name as current_department_name,
-                       cfs.flow_order as current_step,
-                       tdf.total_steps,
-                       CASE 
-                           WHEN cfs.flow_order = tdf.total_steps THEN 1 
-                           ELSE 0 
-                       END as is_last_department
-                FROM transfer_cards tc
-                LEFT JOIN template_snapshots ts ON tc.snapshot_id = ts.snapshot_id
-                LEFT JOIN templates t ON tc.template_id = t.id
-                LEFT JOIN users u ON tc.created_by = u.id
-                LEFT JOIN departments d ON tc.current_department_id = d.id
-                LEFT JOIN card_flow_status cfs ON tc.id = cfs.card_id AND cfs.status = 'processing'
-                LEFT JOIN (
-                    SELECT 
-                        template_id,
-                        COUNT(*) as total_steps
-                    FROM template_department_flow
-                    GROUP BY template_id
-                ) tdf ON tc.template_id = tdf.template_id
-                ORDER BY tc.created_at DESC
-                """
-                cursor.execute(sql)
-            else:
+            where_clauses, where_values = build_card_filters(list_params)
+            select_values = []
+            permission_sql = ''
+            if current_user['role'] != 'admin':
                 # 普通用户可以看到：
                 # 1. 当前流转到他们部门的流转卡（processing状态）
                 # 2. 已经流转到过他们部门的流转卡（completed状态）
                 # 3. 自己创建的流转卡
-                # 使用快照确保模板被删除后仍能显示流转卡
-                sql = """
-                SELECT DISTINCT tc.*, 
-                       COALESCE(ts.template_name, t.template_name, '未知模板') as template_name, 
-                       u.username as creator_name,
-                       (SELECT COUNT(*) FROM card_data cdr WHERE cdr.card_id = tc.id) as row_count,
-                       d.name as current_department_name,
-                       cfs.flow_order as current_step,
-                       tdf.total_steps,
-                       CASE 
-                           WHEN cfs.flow_order = tdf.total_steps THEN 1 
-                           ELSE 0 
-                       END as is_last_department,
-                       CASE 
-                           WHEN tc.current_department_id = %s THEN 'can_submit'
-                           WHEN EXISTS (
-                               SELECT 1 FROM card_flow_status cfs2 
-                               WHERE cfs2.card_id = tc.id 
-                               AND cfs2.department_id = %s 
-                               AND cfs2.status = 'completed'
-                           ) THEN 'view_only'
-                           WHEN tc.created_by = %s THEN 'owner'
-                           ELSE 'none'
-                       END as permission_level
-                FROM transfer_cards tc
-                LEFT JOIN template_snapshots ts ON tc.snapshot_id = ts.snapshot_id
-                LEFT JOIN templates t ON tc.template_id = t.id
-                LEFT JOIN users u ON tc.created_by = u.id
-                LEFT JOIN departments d ON tc.current_department_id = d.id
-                LEFT JOIN card_flow_status cfs ON tc.id = cfs.card_id AND cfs.status = 'processing'
-                LEFT JOIN (
-                    SELECT 
-                        template_id,
-                        COUNT(*) as total_steps
-                    FROM template_department_flow
-                    GROUP BY template_id
-                ) tdf ON tc.template_id = tdf.template_id
-                WHERE (tc.template_id IS NOT NULL OR tc.snapshot_id IS NOT NULL)
-                AND (
-                    tc.current_department_id = %s 
-                    OR EXISTS (
-                        SELECT 1 FROM card_flow_status cfs3 
-                        WHERE cfs3.card_id = tc.id 
-                        AND cfs3.department_id = %s 
-                        AND cfs3.status = 'completed'
-                    )
-                    OR tc.created_by = %s
-                )
-                AND tc.status NOT IN ('draft', 'cancelled')
-                ORDER BY tc.created_at DESC
-                """
-                cursor.execute(sql, (current_user['department_id'], current_user['department_id'], current_user['id'], 
-                                  current_user['department_id'], current_user['department_id'], current_user['id']))
-            
-            template_cards = cursor.fetchall()
+                where_clauses = [
+                    "(tc.template_id IS NOT NULL OR tc.snapshot_id IS NOT NULL)",
+                    """(
+                        tc.current_department_id = %s 
+                        OR EXISTS (
+                            SELECT 1 FROM card_flow_status cfs3 
+                            WHERE cfs3.card_id = tc.id 
+                            AND cfs3.department_id = %s 
+                            AND cfs3.status = 'completed'
+                        )
+                        OR tc.created_by = %s
+                    )""",
+                    "tc.status NOT IN ('draft', 'cancelled')",
+                ] + where_clauses
+                where_values = [current_user['department_id'], current_user['department_id'],
+                                current_user['id']] + where_values
+                
+                permission_sql = """,
+                   CASE 
+                       WHEN tc.current_department_id = %s THEN 'can_submit'
+                       WHEN EXISTS (
+                           SELECT 1 FROM card_flow_status cfs2 
+                           WHERE cfs2.card_id = tc.id 
+                           AND cfs2.department_id = %s 
+                           AND cfs2.status = 'completed'
+                       ) THEN 'view_only'
+                       WHEN tc.created_by = %s THEN 'owner'
+                       ELSE 'none'
+                   END as permission_level"""
+                select_values = [current_user['department_id'], current_user['department_id'], current_user['id']]
+            
+            where_sql = ('WHERE ' + ' AND '.join(where_clauses)) if where_clauses else ''
+            limit_sql, limit_values = build_limit_clause(list_params)
+            
+            # 按 (created_at, id) 索引顺序取一页，数据行数和流转步骤数直接读取流转卡上的计数
+            # 使用快照确保模板被删除后仍能显示流转卡
+            sql = f"""
+            SELECT tc.*, 
+                   COALESCE(ts.template_name, t.template_name, '未知模板') as template_name, 
+                   u.username as creator_name,
+                   tc.data_row_count as row_count,
+                   d.name as current_department_name,
+                   cfs.flow_order as current_step,
+                   tc.total_flow_steps as total_steps,
+                   CASE 
+                       WHEN cfs.flow_order = tc.total_flow_steps THEN 1 
+                       ELSE 0 
+                   END as is_last_department{permission_sql}
+            FROM transfer_cards tc
+            LEFT JOIN template_snapshots ts ON tc.snapshot_id = ts.snapshot_id
+            LEFT JOIN templates t ON tc.template_id = t.id
+            LEFT JOIN users u ON tc.created_by = u.id
+            LEFT JOIN departments d ON tc.current_department_id = d.id
+            LEFT JOIN card_flow_status cfs ON tc.id = cfs.card_id AND cfs.status = 'processing'
+            {where_sql}
+            ORDER BY tc.created_at DESC, tc.id DESC
+            {limit_sql}
+            """
+            cursor.execute(sql, select_values + where_values + limit_values)
+            
+            template_cards, pagination = paginate(cursor.fetchall(), list_params)
+            
+            # 批量获取整页流转卡的流转顺序（优先读取逐卡流转顺序 card_department_flow，
+            # 其次是共享模板快照，都为空时回退到模板表以兼容旧数据；快照和模板流转顺序缓存共享）
+            card_flows = load_card_flows(cursor, [card['id'] for card in template_cards])
+            snapshot_flows = load_snapshot_flows(cursor, [
+                card['snapshot_id'] for card in template_cards
+                if card['id'] not in card_flows and card.get('snapshot_id')
+            ])
+            template_flows = load_template_flows(cursor, [
+                card['template_id'] for card in template_cards
+                if card['id'] not in card_flows and not snapshot_flows.get(card.get('snapshot_id'))
+                and card.get('template_id')
+            ])
             
-            # 为每个流转卡获取完整的流转顺序（从流转卡快照表读取，而不是模板表）
             for card in template_cards:
                 # 格式化时间
                 if card.get('created_at'):
@@ -2120,27 +1975,11 @@ def get_template_cards():
                 if card.get('updated_at'):
                     card['updated_at'] = card['updated_at'].isoformat()
                 
-                # 优先从流转卡快照表读取流转顺序（card_department_flow）
-                # 如果快照为空，则回退到模板表（兼容旧数据）
-                cursor.execute("""
-                    SELECT cdf.*, d.name as department_name
-                    FROM card_department_flow cdf
-                    LEFT JOIN departments d ON cdf.department_id = d.id
-                    WHERE cdf.card_id = %s
-                    ORDER BY cdf.flow_order
-                """, (card['id'],))
-                flow_departments = cursor.fetchall()
-                
-                # 如果快照为空，回退到模板表（兼容旧数据）
-                if not flow_departments and card.get('template_id'):
-                    cursor.execute("""
-                        SELECT tdf.*, d.name as department_name
-                        FROM template_department_flow tdf
-                        LEFT JOIN departments d ON tdf.department_id = d.id
-                        WHERE tdf.template_id = %s
-                        ORDER BY tdf.flow_order
-                    """, (card['template_id'],))
-                    flow_departments = cursor.fetchall()
+                flow_departments = card_flows.get(card['id'])
+                if not flow_departments:
+                    shared_steps = snapshot_flows.get(card.get('snapshot_id')) \
+                        or template_flows.get(card.get('template_id'), ())
+                    flow_departments = [dict(step) for step in shared_steps]
                 
                 # 标记当前流转部门
                 for dept in flow_departments:
@@ -2150,7 +1989,8 @@ def get_template_cards():
             
             return jsonify({
                 'success': True,
-                'data': template_cards
+                'data': template_cards,
+                'pagination': pagination
             })
     
     except Exception as e:
@@ -2162,6 +2002,7 @@ def get_template_cards():
 # 删除模板流转卡
 @app.route('/api/template-cards/<int:card_id>', methods=['DELETE'])
 @jwt_required()
+@log_operation('delete_card', '流转卡', description='删除流转卡')
 def delete_template_card(card_id):
     """删除模板流转卡"""
     try:
@@ -2186,12 +2027,17 @@ def delete_template_card(card_id):
                 
                 # 删除相关的card_data记录
                 cursor.execute("DELETE FROM card_data WHERE card_id = %s", (card_id,))
+                cursor.execute("DELETE FROM card_data_tombstones WHERE card_id = %s", (card_id,))
+                # 日志表按月分区后没有外键级联，流转日志需要显式删除
+                cursor.execute("DELETE FROM flow_operation_logs WHERE card_id = %s", (card_id,))
                 
                 # 删除流转卡主记录
                 cursor.execute("DELETE FROM transfer_cards WHERE id = %s", (card_id,))
                 
                 # 提交事务
                 connection.commit()
+                invalidate_card_field_schemas(card_id)
+                bump_version(connection)
                 
                 return jsonify({
                     'success': True,
@@ -2211,6 +2057,7 @@ def delete_template_card(card_id):
 # 基于模板创建流转卡（表格格式，使用现有的transfer_cards表）
 @app.route('/api/template-cards/table-format', methods=['POST'])
 @jwt_required()
+@log_operation('create_card', '流转卡', description='基于模板创建流转卡')
 def create_template_card_with_table_data():
     """基于模板创建流转卡（表格格式）"""
     try:
@@ -2220,7 +2067,7 @@ def create_template_card_with_table_data():
         
         data = request.get_json()
         template_id = data.get('template_id')
-        card_number = data.get('card_number')
+        card_number = normalize_card_number(data.get('card_number'))
         title = data.get('title', '')
         description = data.get('description', '')
         row_count = data.get('row_count', 10)
@@ -2231,6 +2078,8 @@ def create_template_card_with_table_data():
         
         if not all([template_id, card_number]):
             return jsonify({'success': False, 'message': '模板ID和流转卡号不能为空'}), 400
+        if len(card_number) > CARD_NUMBER_MAX_LENGTH:
+            return jsonify({'success': False, 'message': f'流转卡号不能超过 {CARD_NUMBER_MAX_LENGTH} 个字符'}), 400
         
         connection = get_db_connection()
         if not connection:
@@ -2241,167 +2090,37 @@ def create_template_card_with_table_data():
             connection.begin()
             
             try:
-                # 检查模板是否存在
-                cursor.execute("SELECT id, template_name FROM templates WHERE id = %s", (template_id,))
-                template_result = cursor.fetchone()
-                if not template_result:
+                # 检查模板是否存在，读取字段配置和默认值
+                setup = load_template_setup(cursor, template_id, selected_fields)
+                if not setup:
                     return jsonify({'success': False, 'message': '模板不存在'}), 404
-                
-                # 获取模板关联的字段配置
-                cursor.execute("""
-                    SELECT tf.*, f.name as field_name, f.field_position
-                    FROM template_fields tf
-                    LEFT JOIN fields f ON tf.field_id = f.id
-                    WHERE tf.template_id = %s
-                    ORDER BY tf.field_order
-                """, (template_id,))
-                template_fields = cursor.fetchall()
-                
-                # 如果模板没有配置字段，使用selected_fields作为备选
-                if not template_fields and selected_fields:
-                    # 从selected_fields创建临时字段配置
-                    template_fields = []
-                    for i, field_data in enumerate(selected_fields, 1):
-                        template_fields.append({
-                            'field_name': field_data.get('field_name'),
-                            'field_order': i,
-                            'is_required': field_data.get('is_required', False),
-                            'default_value': field_data.get('default_value', ''),
-                            'field_position': field_data.get('field_position', i)
-                        })
-                elif not template_fields and not selected_fields:
-                    # 如果模板和selected_fields都没有，使用所有非预留字段
-                    cursor.execute("""
-                        SELECT name as field_name, field_position 
-                        FROM fields 
-                        WHERE is_placeholder = 0 
-                        ORDER BY field_position
-                    """)
-                    all_fields = cursor.fetchall()
-                    template_fields = [{'field_name': f['field_name'], 'field_order': i+1, 'field_position': f['field_position']} 
-                                     for i, f in enumerate(all_fields)]
+                template_result = setup['template']
+                template_fields = setup['fields']
                 
                 # 检查流转卡号是否已存在
                 cursor.execute("SELECT id FROM transfer_cards WHERE card_number = %s", (card_number,))
                 if cursor.fetchone():
                     return jsonify({'success': False, 'message': '流转卡号已存在'}), 400
                 
-                # 创建流转卡主记录，使用现有的transfer_cards表
-                sql = """
-                INSERT INTO transfer_cards (card_number, template_id, title, description, 
-                                          status, created_by, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, NOW())
-            """
-                cursor.execute(sql, (card_number, template_id, title, description, 
-                                     status, current_user['id']))
-                card_id = cursor.lastrowid
-                
-                # 创建数据记录，使用现有的card_data表
-                for i in range(1, row_count + 1):
-                    cursor.execute("""
-                        INSERT INTO card_data (card_id, `row_number`, created_at, updated_at)
-                        VALUES (%s, %s, NOW(), NOW())
-                    """, (card_id, i))
-                
-                # 创建模板快照：快照字段配置
-                if template_fields:
-                    for field in template_fields:
-                        cursor.execute("""
-                            INSERT INTO card_template_fields 
-                            (card_id, field_name, field_display_name, field_type, field_order,
-                             is_required, default_value, options, department_id, department_name)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (
-                            card_id,
-                            field.get('field_name'),
-                            field.get('field_name'),  # display_name
-                            field.get('field_type', 'text'),
-                            field.get('field_order', 1),
-                            1 if field.get('is_required') else 0,
-                            field.get('default_value', ''),
-                            field.get('options', ''),
-                            field.get('department_id'),
-                            field.get('department_name')
-                        ))
-                
-                # 创建模板快照：快照部门流转顺序
-                cursor.execute("""
-                    SELECT tdf.*, d.name as department_name
-                    FROM template_department_flow tdf
-                    LEFT JOIN departments d ON tdf.department_id = d.id
-                    WHERE tdf.template_id = %s
-                    ORDER BY tdf.flow_order
-                """, (template_id,))
-                template_flow = cursor.fetchall()
-                
-                for flow_step in template_flow:
-                    cursor.execute("""
-                        INSERT INTO card_department_flow 
-                        (card_id, department_id, flow_order, is_required, auto_skip, timeout_hours)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (
-                        card_id,
-                        flow_step['department_id'],
-                        flow_step['flow_order'],
-                        flow_step['is_required'],
-                        flow_step['auto_skip'],
-                        flow_step['timeout_hours']
-                    ))
-                
-                # 创建模板快照：快照字段权限
-                cursor.execute("""
-                    SELECT tfp.*
-                    FROM template_field_permissions tfp
-                    WHERE tfp.template_id = %s
-                """, (template_id,))
-                template_perms = cursor.fetchall()
-                
-                for perm in template_perms:
-                    cursor.execute("""
-                        INSERT INTO card_field_permissions 
-                        (card_id, field_name, department_id, can_read, can_write)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (
-                        card_id,
-                        perm['field_name'],
-                        perm['department_id'],
-                        perm['can_read'],
-                        perm['can_write']
-                    ))
-                
-                # 根据模板字段设置默认值
-                if template_fields:
-                    update_fields = []
-                    update_params = []
-                    
-                    for field in template_fields:
-                        field_name = field.get('field_name')
-                        default_value = field.get('default_value', '')
-                        
-                        # 优先使用模板配置的默认值，其次使用selected_fields的默认值
-                        if not default_value and selected_fields:
-                            for selected_field in selected_fields:
-                                if selected_field.get('field_name') == field_name:
-                                    default_value = selected_field.get('default_value', '')
-                                    break
-                        
-                        if field_name and default_value:
-                            update_fields.append(f"{field_name} = %s")
-                            update_params.append(default_value)
-                    
-                    if update_fields:
-                        update_fields.append("updated_at = NOW()")
-                        update_params.append(card_id)
-                        
-                        update_sql = f"""
-                        UPDATE card_data 
-                        SET {', '.join(update_fields)} 
-                        WHERE card_id = %s
-                        """
-                        cursor.execute(update_sql, update_params)
+                # 创建流转卡、数据行（带默认值）和模板快照
+                try:
+                    card_id, = create_cards(cursor, template_id, setup, [{
+                        'card_number': card_number,
+                        'title': title,
+                        'description': description,
+                        'status': status,
+                        'row_count': row_count,
+                    }], current_user['id'])
+                except pymysql.err.IntegrityError as e:
+                    # 检查之后被并发请求创建了相同卡号
+                    if not is_duplicate_entry(e):
+                        raise
+                    connection.rollback()
+                    return jsonify({'success': False, 'message': '流转卡号已存在'}), 400
                 
                 # 提交事务
                 connection.commit()
+                publish_card_event(connection, 'card-created', card_id)
                 
                 return jsonify({
                     'success': True,
@@ -2430,6 +2149,101 @@ def create_template_card_with_table_data():
         if 'connection' in locals():
             connection.close()
 
+# 基于模板批量创建流转卡
+@app.route('/api/template-cards/bulk', methods=['POST'])
+@jwt_required()
+@log_operation('bulk_create_cards', '流转卡', description='批量创建流转卡')
+def create_template_cards_bulk():
+    """基于同一模板在一个事务中批量创建流转卡"""
+    try:
+        current_user = get_current_user_info()
+        if not current_user:
+            return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
+        
+        data = request.get_json() or {}
+        template_id = data.get('template_id')
+        if not template_id:
+            return jsonify({'success': False, 'message': '模板ID不能为空'}), 400
+        try:
+            cards = expand_bulk_request(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({'success': False, 'message': '数据库连接失败'}), 500
+        
+        with connection.cursor() as cursor:
+            connection.begin()
+            
+            try:
+                setup = load_template_setup(cursor, template_id, data.get('selected_fields', []))
+                if not setup:
+                    return jsonify({'success': False, 'message': '模板不存在'}), 404
+                
+                def invalid_response(errors):
+                    return jsonify({
+                        'success': False,
+                        'message': f'{sum(1 for e in errors if e)} 张流转卡无法创建',
+                        'data': {
+                            'results': [{
+                                'index': i,
+                                'card_number': card.get('card_number'),
+                                'success': error is None,
+                                'message': error or '未创建（同批次中有其他流转卡不合法）'
+                            } for i, (card, error) in enumerate(zip(cards, errors))]
+                        }
+                    }), 400
+                
+                # 任何一张卡不合法时都不创建，返回每张卡的检查结果
+                errors = validate_bulk_cards(cursor, cards)
+                if any(errors):
+                    connection.rollback()
+                    return invalid_response(errors)
+                
+                try:
+                    card_ids = create_cards(cursor, template_id, setup, cards, current_user['id'])
+                except pymysql.err.IntegrityError as e:
+                    # 检查之后被并发请求创建了相同卡号：回滚后重新检查，按卡返回“已存在”
+                    if not is_duplicate_entry(e):
+                        raise
+                    connection.rollback()
+                    errors = validate_bulk_cards(cursor, cards)
+                    if not any(errors):
+                        errors = ['流转卡号与同时创建的流转卡冲突，请重试'] * len(cards)
+                    return invalid_response(errors)
+                connection.commit()
+            
+            except Exception as e:
+                connection.rollback()
+                raise e
+            
+            for card_id in card_ids:
+                publish_card_event(connection, 'card-created', card_id)
+            
+            return jsonify({
+                'success': True,
+                'message': f'成功创建 {len(card_ids)} 张流转卡',
+                'data': {
+                    'template_name': setup['template']['template_name'],
+                    'template_fields_count': len(setup['fields']),
+                    'results': [{
+                        'index': i,
+                        'card_number': card['card_number'],
+                        'success': True,
+                        'card_id': card_id,
+                        'row_count': card['row_count']
+                    } for i, (card, card_id) in enumerate(zip(cards, card_ids))]
+                }
+            })
+    
+    except Exception as e:
+        print(f" 批量创建流转卡失败: {str(e)}")
+        return jsonify({'success': False, 'message': f'批量创建流转卡失败: {str(e)}'}), 500
+    finally:
+        if 'connection' in locals():
+            connection.close()
+
 # 获取模板关联字段列表
 @app.route('/api/templates/<int:template_id>/fields', methods=['GET'])
 @jwt_required()
@@ -2501,6 +2315,7 @@ def get_template_fields(template_id):
 # 添加模板字段关联
 @app.route('/api/templates/<int:template_id>/fields', methods=['POST'])
 @jwt_required()
+@log_operation('add_template_field', '模板', description='添加模板字段')
 def add_template_field(template_id):
     """为模板添加字段关联"""
     try:
@@ -2561,6 +2376,7 @@ def add_template_field(template_id):
                 
                 # 提交事务
                 connection.commit()
+                invalidate_template_field_schemas(template_id)
                 
                 return jsonify({
                     'success': True,
@@ -2580,6 +2396,7 @@ def add_template_field(template_id):
 # 批量更新模板字段关联
 @app.route('/api/templates/<int:template_id>/fields', methods=['PUT'])
 @jwt_required()
+@log_operation('update_template_fields', '模板', description='修改模板字段')
 def update_template_fields(template_id):
     """批量更新模板字段关联"""
     try:
@@ -2637,6 +2454,8 @@ def update_template_fields(template_id):
                 
                 # 提交事务
                 connection.commit()
+                invalidate_template_permissions(template_id)
+                invalidate_template_field_schemas(template_id)
                 
                 return jsonify({
                     'success': True,
@@ -2656,6 +2475,7 @@ def update_template_fields(template_id):
 # 删除模板字段关联
 @app.route('/api/templates/<int:template_id>/fields/<int:field_id>', methods=['DELETE'])
 @jwt_required()
+@log_operation('remove_template_field', '模板', description='删除模板字段')
 def remove_template_field(template_id, field_id):
     """删除模板字段关联"""
     try:
@@ -2674,6 +2494,7 @@ def remove_template_field(template_id, field_id):
                 (template_id, field_id)
             )
             connection.commit()
+            invalidate_template_field_schemas(template_id)
             
             return jsonify({
                 'success': True,
@@ -2704,12 +2525,12 @@ def get_card_flow(card_id):
         
         with connection.cursor() as cursor:
             # 检查流转卡是否存在
-            cursor.execute("SELECT id, card_number, template_id FROM transfer_cards WHERE id = %s", (card_id,))
+            cursor.execute("SELECT id, card_number, template_id, snapshot_id FROM transfer_cards WHERE id = %s", (card_id,))
             card = cursor.fetchone()
             if not card:
                 return jsonify({'success': False, 'message': '流转卡不存在'}), 404
             
-            # 获取流转卡的流转顺序（从快照表card_department_flow读取）
+            # 获取流转卡的流转顺序（单卡修改过的流转顺序和旧数据在card_department_flow中）
             cursor.execute("""
                 SELECT cdf.*, d.name as department_name
                 FROM card_department_flow cdf
@@ -2719,6 +2540,11 @@ def get_card_flow(card_id):
             """, (card_id,))
             flow_departments = cursor.fetchall()
             
+            # 其次读取共享模板快照
+            if not flow_departments and card.get('snapshot_id'):
+                steps = load_snapshot_flows(cursor, [card['snapshot_id']])[card['snapshot_id']]
+                flow_departments = [dict(step) for step in steps]
+            
             # 如果快照为空，回退到模板表（兼容旧数据）
             if not flow_departments and card.get('template_id'):
                 cursor.execute("""
@@ -2748,6 +2574,7 @@ def get_card_flow(card_id):
 # 设置流转卡的流转顺序
 @app.route('/api/cards/<int:card_id>/flow', methods=['POST'])
 @jwt_required()
+@log_operation('set_card_flow', '流转卡', description='设置流转顺序')
 def set_card_flow(card_id):
     """设置流转卡的流转顺序（只影响当前流转卡，不影响模板和其他流转卡）"""
     try:
@@ -2808,11 +2635,13 @@ def set_card_flow(card_id):
                 # 更新流转卡总流转步骤数
                 cursor.execute("""
                     UPDATE transfer_cards 
-                    SET total_flow_steps = %s, updated_at = NOW()
+                    SET updated_at = NOW()
                     WHERE id = %s
-                """, (len(departments), card_id))
+                """, (card_id,))
+                refresh_card_counters(cursor, [card_id])
                 
                 connection.commit()
+                bump_version(connection)
                 
                 return jsonify({
                     'success': True,
@@ -2832,6 +2661,7 @@ def set_card_flow(card_id):
 # 快速创建流转卡
 @app.route('/api/cards/quick-create', methods=['POST'])
 @jwt_required()
+@log_operation('create_card', '流转卡', description='快速创建流转卡')
 def quick_create_card():
     """快速创建流转卡"""
     try:
@@ -2872,22 +2702,17 @@ def quick_create_card():
                 cursor.execute(sql, (card_number, template_id, title, f"快速创建: {batch_number}", current_user['id']))
                 card_id = cursor.lastrowid
                 
-                # 创建第一行数据并设置字段值
+                # 创建第一行数据并设置字段值（按字段值存储布局写入）
                 if card_data:
-                    # 构建插入字段
-                    insert_fields = ['card_id', 'row_number'] + list(card_data.keys())
-                    insert_values = [card_id, 1] + list(card_data.values())
-                    placeholders = ', '.join(['%s'] * len(insert_fields))
-                    
-                    insert_sql = f"""
-                    INSERT INTO card_data ({', '.join([f'`{f}`' if f == 'row_number' else f for f in insert_fields])}, created_at, updated_at)
-                    VALUES ({placeholders}, NOW(), NOW())
-                    """
-                    cursor.execute(insert_sql, insert_values)
-                    print(f" 快速创建数据行: {insert_sql}")
+                    upsert_rows(cursor, card_id, {1: {'values': card_data}})
+                    print(f" 快速创建数据行: {list(card_data.keys())}")
+                
+                # 初始化流转卡计数
+                refresh_card_counters(cursor, [card_id])
                 
                 # 提交事务
                 connection.commit()
+                publish_card_event(connection, 'card-created', card_id)
                 
                 return jsonify({
                     'success': True,
@@ -2916,60 +2741,10 @@ def quick_create_card():
 
 # ========== 工作台相关接口 ==========
 
-# 记录操作日志的装饰器
-def log_operation(action, target_type="未知", target_id=None, description=""):
-    """记录操作日志的装饰器"""
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            try:
-                # 获取当前用户信息
-                current_user = get_current_user_info()
-                if not current_user:
-                    return func(*args, **kwargs)
-                
-                # 获取客户端IP
-                client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', 
-                                         request.environ.get('REMOTE_ADDR', '127.0.0.1'))
-                
-                # 记录操作日志
-                connection = get_db_connection()
-                if connection:
-                    try:
-                        with connection.cursor() as cursor:
-                            sql = """
-                            INSERT INTO operation_logs 
-                            (user_id, user_name, action, target_type, target_id, description, 
-                             ip_address, user_agent, created_at)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                            """
-                            cursor.execute(sql, (
-                                current_user['id'],
-                                current_user['username'],
-                                action,
-                                target_type,
-                                target_id,
-                                description,
-                                client_ip,
-                                request.environ.get('HTTP_USER_AGENT', ''),
-                            ))
-                            connection.commit()
-                    except Exception as e:
-                        print(f"记录操作日志失败: {e}")
-                        connection.rollback()
-                    finally:
-                        connection.close()
-                
-                # 执行原函数
-                return func(*args, **kwargs)
-            except Exception as e:
-                print(f"操作日志装饰器错误: {e}")
-                return func(*args, **kwargs)
-        return wrapper
-    return decorator
-
 # 获取工作台统计数据
 @app.route('/api/dashboard/stats', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_dashboard_stats():
     """获取工作台统计数据"""
     try:
@@ -2982,101 +2757,8 @@ def get_dashboard_stats():
             return jsonify({'success': False, 'message': '数据库连接失败'}), 500
         
         with connection.cursor() as cursor:
-            # 第一个统计：状态为进行中的流转卡个数
-            if current_user['role'] == 'admin':
-                # 管理员可以看到所有进行中的流转卡
-                cursor.execute("""
-                    SELECT COUNT(*) as in_progress_count 
-                    FROM transfer_cards 
-                    WHERE status = 'in_progress'
-                """)
-            else:
-                # 普通用户只能看到有权限访问的进行中流转卡
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT tc.id) as in_progress_count
-                    FROM transfer_cards tc
-                    LEFT JOIN template_field_permissions tfp ON tc.template_id = tfp.template_id
-                    WHERE tc.status = 'in_progress'
-                    AND (tfp.department_id = %s OR tc.created_by = %s)
-                """, (current_user['department_id'], current_user['id']))
-            
-            in_progress_result = cursor.fetchone()
-            in_progress_cards = in_progress_result['in_progress_count'] if in_progress_result else 0
-            
-            # 第二个统计：今日创建的流转卡数量（改为从transfer_cards表统计）
-            if current_user['role'] == 'admin':
-                cursor.execute("""
-                    SELECT COUNT(*) as today_create_count
-                    FROM transfer_cards
-                    WHERE DATE(created_at) = CURDATE()
-                """)
-            else:
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT tc.id) as today_create_count
-                    FROM transfer_cards tc
-                    LEFT JOIN template_field_permissions tfp ON tc.template_id = tfp.template_id
-                    WHERE DATE(tc.created_at) = CURDATE()
-                    AND (tfp.department_id = %s OR tc.created_by = %s)
-                """, (current_user['department_id'], current_user['id']))
-            
-            today_create_result = cursor.fetchone()
-            today_create_count = today_create_result['today_create_count'] if today_create_result else 0
-            
-            # 第三个统计：本周创建的流转卡数量（改为从transfer_cards表统计）
-            if current_user['role'] == 'admin':
-                cursor.execute("""
-                    SELECT COUNT(*) as weekly_create_count
-                    FROM transfer_cards
-                    WHERE YEARWEEK(created_at, 1) = YEARWEEK(CURDATE(), 1)
-                """)
-            else:
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT tc.id) as weekly_create_count
-                    FROM transfer_cards tc
-                    LEFT JOIN template_field_permissions tfp ON tc.template_id = tfp.template_id
-                    WHERE YEARWEEK(tc.created_at, 1) = YEARWEEK(CURDATE(), 1)
-                    AND (tfp.department_id = %s OR tc.created_by = %s)
-                """, (current_user['department_id'], current_user['id']))
-            
-            weekly_create_result = cursor.fetchone()
-            weekly_create_count = weekly_create_result['weekly_create_count'] if weekly_create_result else 0
-            
-            # 第四个统计：流转卡总数（包括所有状态，除了cancelled）
-            if current_user['role'] == 'admin':
-                # 管理员可以看到所有非取消状态的流转卡
-                cursor.execute("""
-                    SELECT COUNT(*) as total_count 
-                    FROM transfer_cards 
-                    WHERE status != 'cancelled'
-                """)
-            else:
-                # 普通用户只能看到有权限访问的非取消状态流转卡
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT tc.id) as total_count
-                    FROM transfer_cards tc
-                    LEFT JOIN template_field_permissions tfp ON tc.template_id = tfp.template_id
-                    WHERE tc.status != 'cancelled'
-                    AND (tfp.department_id = %s OR tc.created_by = %s)
-                """, (current_user['department_id'], current_user['id']))
-            
-            total_result = cursor.fetchone()
-            total_cards = total_result['total_count'] if total_result else 0
-            
-            # 计算趋势（简化版本，实际应该与历史数据比较）
-            stats = {
-                'pendingCards': in_progress_cards,  # 改为进行中的流转卡个数
-                'completedToday': today_create_count,  # 改为今日创建数量
-                'weeklyTotal': weekly_create_count,   # 改为本周创建数量
-                'totalCards': total_cards,            # 改为非取消状态的流转卡总数
-                'pendingTrend': 'up' if in_progress_cards > 0 else 'down',
-                'pendingChange': 15,  # 模拟数据
-                'completedTrend': 'up' if today_create_count > 0 else 'down',
-                'completedChange': 8,   # 模拟数据
-                'weeklyTrend': 'up' if weekly_create_count > 0 else 'down',
-                'weeklyChange': 12,     # 模拟数据
-                'totalTrend': 'up',
-                'totalChange': 5        # 模拟数据
-            }
+            # 四个计数一次查询得到，趋势读取每日统计汇总表，按用户可见范围短时间缓存
+            stats = load_dashboard_stats(cursor, current_user)
             
             return jsonify({
                 'success': True,
@@ -3099,9 +2781,13 @@ def get_recent_operations():
         if not current_user:
             return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
         
-        # 获取分页参数
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 20))
+        # 获取分页参数（游标分页，兼容旧的 page 参数）
+        try:
+            page_params = parse_log_page_args(request.args)
+            user_filter = request.args.get('user_id')
+            user_filter = int(user_filter) if user_filter else None
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         action_filter = request.args.get('action', '')
         
         connection = get_db_connection()
@@ -3113,37 +2799,42 @@ def get_recent_operations():
             where_conditions = []
             params = []
             
+            if user_filter is not None:
+                # 按用户筛选时走 idx_operation_logs_user_created
+                where_conditions.append("ol.user_id = %s")
+                params.append(user_filter)
+            
             if action_filter:
-                where_conditions.append("ol.action = %s")
+                # 前端的 action 参数对应 operation_type 列（operation_logs 没有 action 列）
+                where_conditions.append("ol.operation_type = %s")
                 params.append(action_filter)
             
-            where_clause = f"WHERE {' AND '.join(where_conditions)}" if where_conditions else ""
+            window_conditions, window_params = build_window_clause(page_params, 'ol')
+            where_conditions.extend(window_conditions)
+            params.extend(window_params)
             
-            # 获取总记录数
-            count_sql = f"""
-                SELECT COUNT(*) as total_count 
-                FROM operation_logs ol
-                LEFT JOIN users u ON ol.user_id = u.id
-                LEFT JOIN departments d ON u.department_id = d.id
-                {where_clause}
-            """
-            cursor.execute(count_sql, params)
-            total_result = cursor.fetchone()
-            total_count = total_result['total_count'] if total_result else 0
+            # 总数只在第一页返回（无筛选时为估算值，有筛选时缓存）
+            total = None
+            if page_params['with_total']:
+                total = count_logs(cursor, 'operation_logs', 'ol', where_conditions, params)
+            
+            keyset_conditions, keyset_params = build_keyset_clause(
+                page_params, 'ol', created_at_nullable(cursor, 'operation_logs'))
+            conditions = where_conditions + keyset_conditions
+            where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            page_sql, page_sql_params = build_page_clause(page_params, 'ol')
             
             # 获取分页数据
-            offset = (page - 1) * page_size
             sql = f"""
                 SELECT ol.*, u.real_name, u.username, d.name as department_name
                 FROM operation_logs ol
                 LEFT JOIN users u ON ol.user_id = u.id
                 LEFT JOIN departments d ON u.department_id = d.id
                 {where_clause}
-                ORDER BY ol.created_at DESC
-                LIMIT %s OFFSET %s
+                {page_sql}
             """
-            cursor.execute(sql, params + [page_size, offset])
-            operations = cursor.fetchall()
+            cursor.execute(sql, params + keyset_params + page_sql_params)
+            operations, pagination = paginate_logs(cursor.fetchall(), page_params, total)
             
             # 格式化数据
             for op in operations:
@@ -3155,21 +2846,11 @@ def get_recent_operations():
                 op['user_name'] = op['real_name'] or op['username'] or '未知用户'
                 op['department_name'] = op['department_name'] or '未分配部门'
             
-            # 计算分页信息
-            total_pages = (total_count + page_size - 1) // page_size
-            has_more = page < total_pages
-            
             return jsonify({
                 'success': True,
                 'data': {
                     'operations': operations,
-                    'pagination': {
-                        'current_page': page,
-                        'page_size': page_size,
-                        'total_count': total_count,
-                        'total_pages': total_pages,
-                        'has_more': has_more
-                    }
+                    'pagination': pagination
                 }
             })
     
@@ -3245,9 +2926,16 @@ def get_card_data_with_versions(card_id):
             
             fields = list(unique_fields.values())
             
+            # 只读取用户可读的字段列（管理员读取全部字段）
+            if current_user['role'] == 'admin':
+                readable_columns = [field['name'] for field in fields]
+            else:
+                readable_columns = [field['name'] for field in fields if field.get('can_read')]
+            select_list = build_row_projection(cursor, readable_columns)
+            
             # 获取带版本信息的数据行
-            cursor.execute("""
-                SELECT cd.*, d.name as department_name,
+            cursor.execute(f"""
+                SELECT {select_list}, d.name as department_name,
                        u1.username as submitted_by_name,
                        u2.username as updated_by_name
                 FROM card_data cd
@@ -3375,6 +3063,7 @@ def resolve_conflicts(card_id):
 # 带版本检查的保存数据
 @app.route('/api/cards/<int:card_id>/save-with-version', methods=['POST'])
 @jwt_required()
+@log_operation('save_card_data', '流转卡', description='保存流转卡数据（带版本控制）')
 def save_card_data_with_version(card_id):
     """带版本检查的保存流转卡数据"""
     try:
@@ -3392,158 +3081,57 @@ def save_card_data_with_version(card_id):
         if not connection:
             return jsonify({'success': False, 'message': '数据库连接失败'}), 500
         
-        with connection.cursor() as cursor:
-            # 开始事务，使用SERIALIZABLE隔离级别
-            connection.begin()
+        def save_transaction(cursor):
+            # 检查流转卡是否存在（不锁定流转卡行，由目标数据行的行锁和版本号保证一致性）
+            cursor.execute("SELECT id, template_id, status FROM transfer_cards WHERE id = %s", (card_id,))
+            card_result = cursor.fetchone()
+            if not card_result:
+                return {'success': False, 'message': '流转卡不存在'}, 404
             
-            try:
-                # 设置事务隔离级别
-                cursor.execute("SET TRANSACTION ISOLATION LEVEL SERIALIZABLE")
-                
-                # 检查流转卡是否存在并锁定
-                cursor.execute("SELECT id, template_id, status FROM transfer_cards WHERE id = %s FOR UPDATE", (card_id,))
-                card_result = cursor.fetchone()
-                if not card_result:
-                    return jsonify({'success': False, 'message': '流转卡不存在'}), 404
-                
-                # 检查流转卡是否已完成（管理员除外）
-                if card_result['status'] == 'completed' and current_user['role'] != 'admin':
-                    return jsonify({'success': False, 'message': '该流转卡已完成整个流转流程，无法再修改数据'}), 403
-                
-                template_id = card_result['template_id']
-                
-                # 处理每行数据
+            # 检查流转卡是否已完成（管理员除外）
+            if card_result['status'] == 'completed' and current_user['role'] != 'admin':
+                return {'success': False, 'message': '该流转卡已完成整个流转流程，无法再修改数据'}, 403
+            
+            template_id = card_result['template_id']
+            
+            # 删除数据行只允许管理员操作
+            if current_user['role'] != 'admin' and any(row_data.get('delete') for row_data in row_data_list):
+                return {'success': False, 'message': '只有管理员可以删除数据行'}, 403
+            
+            # 检查用户权限（权限集合一次加载，内存校验）
+            if current_user['role'] != 'admin':
+                writable_fields = load_writable_fields(cursor, template_id, current_user['department_id'])
                 for row_data in row_data_list:
-                    row_number = row_data.get('row_number')
-                    values = row_data.get('values', {})
-                    expected_version = row_data.get('version')  # 客户端期望的版本号
-                    
-                    if not row_number:
+                    if not row_data.get('row_number'):
                         continue
-                    
-                    # 检查用户权限
-                    for field_name, field_value in values.items():
-                        if current_user['role'] != 'admin':
-                            cursor.execute("""
-                                SELECT can_write FROM template_field_permissions 
-                                WHERE template_id = %s AND field_name = %s AND department_id = %s
-                            """, (template_id, field_name, current_user['department_id']))
-                            perm_result = cursor.fetchone()
-                            
-                            if not perm_result or not perm_result['can_write']:
-                                return jsonify({
-                                    'success': False, 
-                                    'message': f'您没有权限修改字段 {field_name}'
-                                }), 403
-                    
-                    # 锁定目标行
-                    cursor.execute("""
-                        SELECT id, version, submitted_by, submitted_at 
-                        FROM card_data 
-                        WHERE card_id = %s AND `row_number` = %s 
-                        FOR UPDATE
-                    """, (card_id, row_number))
-                    existing_row = cursor.fetchone()
-                    
-                    # 检查数据冲突
-                    if existing_row and existing_row['submitted_at']:
-                        submitted_by_other = existing_row['submitted_by']
-                        if submitted_by_other and str(submitted_by_other) != str(current_user['id']):
-                            cursor.execute("SELECT username FROM users WHERE id = %s", (submitted_by_other,))
-                            submitter_result = cursor.fetchone()
-                            submitter_name = submitter_result['username'] if submitter_result else '未知用户'
-                            
-                            return jsonify({
-                                'success': False,
-                                'message': f'第{row_number}行已被用户 {submitter_name} 提交，无法修改',
-                                'error_type': 'DATA_CONFLICT',
-                                'conflict_info': {
-                                    'row_number': row_number,
-                                    'submitted_by': submitter_name,
-                                    'submitted_at': existing_row['submitted_at'].isoformat() if existing_row['submitted_at'] else None
-                                }
-                            }), 409
-                    
-                    # 版本检查（乐观锁）
-                    if existing_row and expected_version is not None:
-                        current_version = existing_row.get('version', 1)
-                        if current_version != expected_version:
-                            return jsonify({
-                                'success': False,
-                                'message': f'第{row_number}行数据已被其他用户修改，请刷新后重试',
-                                'error_type': 'VERSION_CONFLICT',
-                                'conflict_info': {
-                                    'row_number': row_number,
-                                    'expected_version': expected_version,
-                                    'current_version': current_version
-                                }
-                            }), 409
-                    
-                    if existing_row:
-                        # 更新现有行，版本号递增
-                        update_fields = []
-                        update_params = []
-                        
-                        for field_name, field_value in values.items():
-                            update_fields.append(f"{field_name} = %s")
-                            update_params.append(field_value)
-                        
-                        if update_fields:
-                            update_fields.extend([
-                                "version = version + 1",
-                                "last_updated_by = %s",
-                                "updated_at = NOW()"
-                            ])
-                            update_params.extend([current_user['id'], card_id, row_number])
-                            
-                            update_sql = f"""
-                            UPDATE card_data 
-                            SET {', '.join(update_fields)} 
-                            WHERE card_id = %s AND `row_number` = %s
-                            """
-                            cursor.execute(update_sql, update_params)
-                    else:
-                        # 插入新行，版本号为1
-                        if any(values.values()):
-                            insert_fields = ['card_id', 'row_number', 'version', 'last_updated_by'] + list(values.keys())
-                            insert_values = [card_id, row_number, 1, current_user['id']] + list(values.values())
-                            placeholders = ', '.join(['%s'] * len(insert_fields))
-                            
-                            insert_sql = f"""
-                            INSERT INTO card_data ({', '.join([f'`{f}`' if f == 'row_number' else f for f in insert_fields])}, created_at, updated_at)
-                            VALUES ({placeholders}, NOW(), NOW())
-                            """
-                            cursor.execute(insert_sql, insert_values)
-                    
-                    # 更新行状态（如果用户提交）
-                    if row_data.get('submit', False):
-                        if existing_row and existing_row['submitted_at']:
-                            if existing_row['submitted_by'] == current_user['id']:
-                                pass
-                            else:
-                                return jsonify({
-                                    'success': False,
-                                    'message': f'第{row_number}行已被其他用户提交，无法重复提交',
-                                    'error_type': 'ALREADY_SUBMITTED'
-                                }), 409
-                        
-                        cursor.execute("""
-                            UPDATE card_data 
-                            SET status = 'submitted', submitted_by = %s, submitted_at = NOW()
-                            WHERE card_id = %s AND `row_number` = %s
-                        """, (current_user['id'], card_id, row_number))
-                
-                # 提交事务
-                connection.commit()
-                
-                return jsonify({
-                    'success': True,
-                    'message': '数据保存成功（带版本控制）'
-                })
-            
-            except Exception as e:
-                connection.rollback()
-                raise e
+                    for field_name in row_data.get('values', {}):
+                        if field_name not in writable_fields:
+                            return {
+                                'success': False, 
+                                'message': f'您没有权限修改字段 {field_name}'
+                            }, 403
+            
+            # 批量锁定目标行、检查冲突（含版本号）并写入
+            save_rows(cursor, card_id, row_data_list, current_user['id'], versioned=True)
+            
+            return {'success': True, 'message': '数据保存成功（带版本控制）'}, 200
+        
+        # 死锁或锁等待超时时自动重试整个事务
+        try:
+            (result, status_code), retries = db_pool.run_in_transaction(
+                connection, save_transaction, isolation_level=CARD_SAVE_ISOLATION)
+        except CardDataConflict as conflict:
+            return jsonify(conflict.to_response()), 409
+        except ValueError as e:
+            # 行号或字段名不合法
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        if status_code == 200:
+            result['retries'] = retries
+            publish_card_event(connection, 'row-saved', card_id,
+                               rows=[row.get('row_number') for row in row_data_list if row.get('row_number')],
+                               user_id=current_user['id'])
+        return jsonify(result), status_code
     
     except Exception as e:
         return jsonify({'success': False, 'message': f'保存数据失败: {str(e)}'}), 500
@@ -3560,6 +3148,73 @@ register_flow_blueprint(app)
 def health_check():
     return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat()})
 
+# 实时推送（SSE），替代前端定时轮询
+@app.route('/api/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def event_stream():
+    """推送流转卡变更事件（EventSource 无法设置请求头，令牌可通过 ?jwt= 传递）"""
+    current_user = get_current_user_info()
+    if not current_user:
+        return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
+    
+    # 断线重连时浏览器会带上最后收到的事件ID，补发之后的事件
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    subscriber = {
+        'id': current_user['id'],
+        'role': current_user['role'],
+        'department_id': current_user.get('department_id')
+    }
+    try:
+        subscription = get_hub().subscribe(subscriber, last_event_id)
+    except TooManySubscribers as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    
+    response = Response(stream_with_context(stream_events(subscription)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # 数据流尚未开始时客户端就断开，也要取消订阅
+    response.call_on_close(subscription.close)
+    return response
+
+# 数据库连接池与缓存统计（用于评估连接池和缓存大小）
+@app.route('/api/system/db-pool', methods=['GET'])
+@jwt_required()
+def get_db_pool_stats():
+    """获取数据库连接池统计信息"""
+    try:
+        current_user = get_current_user_info()
+        if not current_user:
+            return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
+        if current_user['role'] != 'admin':
+            return jsonify({'success': False, 'message': '权限不足'}), 403
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'db_pool': db_pool.get_pool_stats(),
+                'user_cache': get_user_cache_stats(),
+                'permission_cache': get_permission_cache_stats(),
+                'transactions': db_pool.get_transaction_stats(),
+                'flow_cache': get_flow_cache_stats(),
+                'field_schema_cache': get_field_schema_cache_stats(),
+                'change_tokens': get_change_token_stats(),
+                'event_stream': get_event_hub_stats(),
+                'dashboard_cache': get_dashboard_cache_stats(),
+                'log_total_cache': get_log_pagination_cache_stats(),
+                'audit_log': get_audit_log_stats(),
+                'compression': get_compression_stats(),
+                'card_value_storage': CARD_VALUE_STORAGE
+            }
+        })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取连接池统计失败: {str(e)}'}), 500
+
 if __name__ == '__main__':
     print("流转卡系统后端启动中...")
     print("健康检查: http://localhost:5000/health")
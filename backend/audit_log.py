@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+审计日志异步写入（write-behind）
+操作日志先放入进程内的有界队列，由后台线程每 AUDIT_LOG_FLUSH_INTERVAL_MS 毫秒
+或攒够 AUDIT_LOG_BATCH_SIZE 行时用一条多行 INSERT 批量写入，请求不再为每条日志
+单独借连接、插入和提交
+
+- 背压：队列满时 enqueue 最多等待 AUDIT_LOG_ENQUEUE_TIMEOUT 秒
+- 仍然写不进队列、或批量写入数据库失败时，按 AUDIT_LOG_OVERFLOW 处理：
+  spill 写入 AUDIT_LOG_SPILL_DIR 下的 JSON Lines 文件，数据库恢复后由后台线程补写；
+  drop 直接丢弃并计数
+- 进程退出时（atexit）写完队列中剩余的日志
+
+溢出文件按进程分开（<表名>.<pid>.jsonl），追加写入只在本进程内加锁，所以补写时
+只处理本进程的文件和已退出进程留下的文件，不会改名其他存活进程正在追加的文件。
+补写前把文件原子改名为 <文件名>.<补写进程pid>.replaying 认领，补写中途失败或进程崩溃时
+剩余的行留在认领文件中，之后由本进程或（认领进程已退出时）其他进程继续补写
+
+日志的 created_at 在入队时确定，批量写入不改变日志时间
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+import db_pool
+
+# 是否异步写入；关闭时 enqueue 直接同步写入
+AUDIT_LOG_ASYNC = os.getenv('AUDIT_LOG_ASYNC', 'true').lower() not in ('0', 'false', 'no')
+# 队列容量
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv('AUDIT_LOG_QUEUE_SIZE', 10000))
+# 每批最多写入的行数
+AUDIT_LOG_BATCH_SIZE = int(os.getenv('AUDIT_LOG_BATCH_SIZE', 200))
+# 最长写入间隔（毫秒）
+AUDIT_LOG_FLUSH_INTERVAL_MS = int(os.getenv('AUDIT_LOG_FLUSH_INTERVAL_MS', 200))
+# 队列满时最多等待的秒数
+AUDIT_LOG_ENQUEUE_TIMEOUT = float(os.getenv('AUDIT_LOG_ENQUEUE_TIMEOUT', 0.05))
+# 写不进队列或写入数据库失败时的处理方式：spill / drop
+AUDIT_LOG_OVERFLOW = os.getenv('AUDIT_LOG_OVERFLOW', 'spill').lower()
+# 溢出文件目录
+AUDIT_LOG_SPILL_DIR = os.getenv(
+    'AUDIT_LOG_SPILL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit_spill'))
+
+# 写入、溢出和补写失败记录到日志（不只是打印到标准输出）
+logger = logging.getLogger(__name__)
+
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 溢出文件名：<表名>.<pid>.jsonl，认领补写后为 <表名>.<pid>.jsonl.<补写进程pid>.replaying
+_SPILL_NAME_RE = re.compile(r'\.(\d+)\.jsonl(?:\.(\d+)\.replaying)?$')
+
+
+def _pid_alive(pid):
+    """判断进程是否存活（Windows 上 os.kill 会结束进程，改用 OpenProcess 查询）"""
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 无权限等情况按存活处理，不动该文件
+        return True
+    return True
+
+
+class WriteBehindQueue:
+    """单表的批量异步写入队列"""
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = tuple(columns)
+        self._queue = queue.Queue(maxsize=AUDIT_LOG_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._stats = {
+            'enqueued': 0, 'written': 0, 'batches': 0, 'blocked': 0,
+            'dropped': 0, 'spilled': 0, 'replayed': 0, 'failed_batches': 0,
+        }
+
+    def _incr(self, name, count=1):
+        with self._lock:
+            self._stats[name] += count
+
+    def _insert_sql(self):
+        columns = ', '.join(f'`{column}`' for column in self.columns)
+        placeholders = ', '.join(['%s'] * len(self.columns))
+        return f"INSERT INTO {self.table} ({columns}) VALUES ({placeholders})"
+
+    def _ensure_started(self):
+        # 多进程部署时 fork 后的子进程需要重新启动后台线程
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name=f'audit-log-{self.table}', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, row):
+        """放入一行日志（列名到值的字典）；未开启异步时同步写入"""
+        values = tuple(row.get(column) for column in self.columns)
+        if not AUDIT_LOG_ASYNC:
+            self._write_or_overflow([values])
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(values)
+        except queue.Full:
+            # 背压：短暂等待后台线程腾出空间
+            self._incr('blocked')
+            try:
+                self._queue.put(values, timeout=AUDIT_LOG_ENQUEUE_TIMEOUT)
+            except queue.Full:
+                self._overflow([values])
+                return
+        self._incr('enqueued')
+
+    def _take_batch(self, timeout):
+        """等待第一行，然后在间隔内攒够一批"""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + AUDIT_LOG_FLUSH_INTERVAL_MS / 1000
+        while len(batch) < AUDIT_LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping:
+            batch = self._take_batch(timeout=1)
+            if batch:
+                if self._write_or_overflow(batch):
+                    self._replay_spilled()
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, rows):
+        """多行 INSERT 写入一批日志"""
+        connection = db_pool.get_connection()
+        try:
+            with connection.cursor() as cursor:
+                # PyMySQL 的 executemany 会把 INSERT ... VALUES 合并为多行插入
+                cursor.executemany(self._insert_sql(), rows)
+            connection.commit()
+        except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            connection.close()
+
+    def _write_or_overflow(self, rows):
+        try:
+            self._write(rows)
+        except Exception as e:
+            logger.error("批量写入 %s 失败（%d 条）: %s", self.table, len(rows), e)
+            self._incr('failed_batches')
+            self._overflow(rows)
+            return False
+        self._incr('written', len(rows))
+        self._incr('batches')
+        return True
+
+    def _spill_path(self):
+        return os.path.join(AUDIT_LOG_SPILL_DIR, f'{self.table}.{os.getpid()}.jsonl')
+
+    def _overflow(self, rows):
+        if AUDIT_LOG_OVERFLOW != 'spill':
+            self._incr('dropped', len(rows))
+            return
+        try:
+            with self._spill_lock:
+                os.makedirs(AUDIT_LOG_SPILL_DIR, exist_ok=True)
+                with open(self._spill_path(), 'a', encoding='utf-8') as f:
+                    for values in rows:
+                        f.write(json.dumps(values, ensure_ascii=False, default=str) + '\n')
+            self._incr('spilled', len(rows))
+        except Exception as e:
+            logger.exception("写入审计日志溢出文件失败，丢弃 %d 条: %s", len(rows), e)
+            self._incr('dropped', len(rows))
+
+    def _claimable_spill_files(self):
+        """本进程的溢出文件、已退出进程的溢出文件，以及认领进程已退出的补写文件"""
+        pattern = os.path.join(AUDIT_LOG_SPILL_DIR, f'{self.table}.*.jsonl*')
+        paths = []
+        for path in sorted(glob.glob(pattern)):
+            match = _SPILL_NAME_RE.search(path)
+            if not match:
+                continue
+            owner = int(match.group(2) or match.group(1))
+            if owner == os.getpid() or not _pid_alive(owner):
+                paths.append(path)
+        return paths
+
+    def _replay_spilled(self):
+        """数据库可写时补写可认领的溢出文件（见模块说明）"""
+        for path in self._claimable_spill_files():
+            if path.endswith('.replaying'):
+                source = path[:-len('.replaying')].rsplit('.', 1)[0]
+            else:
+                source = path
+            replaying = f'{source}.{os.getpid()}.replaying'
+            try:
+                with self._spill_lock:
+                    # 原子改名认领；其他进程同时认领时只有一个成功，本进程之后的溢出写入新文件
+                    if path != replaying:
+                        os.replace(path, replaying)
+                with open(replaying, encoding='utf-8') as f:
+                    rows = [tuple(json.loads(line)) for line in f if line.strip()]
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.exception("读取审计日志溢出文件 %s 失败: %s", path, e)
+                continue
+
+            written = 0
+            try:
+                while written < len(rows):
+                    batch = rows[written:written + AUDIT_LOG_BATCH_SIZE]
+                    self._write(batch)
+                    written += len(batch)
+                os.remove(replaying)
+                self._incr('replayed', len(rows))
+            except Exception as e:
+                # 只保留尚未写入的行，下次从这里继续
+                logger.error("补写审计日志溢出文件 %s 失败（已写入 %d/%d 条）: %s", path, written, len(rows), e)
+                self._incr('replayed', written)
+                try:
+                    tmp = replaying + '.tmp'
+                    with open(tmp, 'w', encoding='utf-8') as f:
+                        for values in rows[written:]:
+                            f.write(json.dumps(values, ensure_ascii=False, default=str) + '\n')
+                    os.replace(tmp, replaying)
+                except Exception as rewrite_error:
+                    logger.exception("更新审计日志补写文件 %s 失败: %s", replaying, rewrite_error)
+                return
+
+    def flush(self, timeout=5):
+        """同步写完队列中的日志（关闭时调用）"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            batch = []
+            while len(batch) < AUDIT_LOG_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write_or_overflow(batch)
+            for _ in batch:
+                self._queue.task_done()
+        # 超时仍未写完的日志按溢出处理
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if remaining:
+            self._overflow(remaining)
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        self.flush(timeout)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_size'] = AUDIT_LOG_QUEUE_SIZE
+        return stats
+
+
+operation_log_queue = WriteBehindQueue('operation_logs', (
+    'user_id', 'user_name', 'operation_type', 'target_type', 'target_id', 'description',
+    'ip_address', 'user_agent', 'created_at',
+))
+
+flow_log_queue = WriteBehindQueue('flow_operation_logs', (
+    'card_id', 'from_department_id', 'to_department_id', 'operation_type', 'operator_id',
+    'notes', 'created_at',
+))
+
+
+def _now():
+    return datetime.now().strftime(_TIME_FORMAT)
+
+
+def enqueue_operation_log(**row):
+    """异步记录操作日志（operation_logs）"""
+    row.setdefault('created_at', _now())
+    operation_log_queue.enqueue(row)
+
+
+def enqueue_flow_log(row):
+    """异步记录流转操作日志（flow_operation_logs）；row 为 None 时忽略"""
+    if row is None:
+        return
+    row.setdefault('created_at', _now())
+    flow_log_queue.enqueue(row)
+
+
+def flush_audit_logs(timeout=5):
+    """写完所有队列中的日志"""
+    for log_queue in (operation_log_queue, flow_log_queue):
+        log_queue.stop(timeout)
+
+
+def get_audit_log_stats():
+    """审计日志队列统计"""
+    return {
+        'async': AUDIT_LOG_ASYNC,
+        'overflow': AUDIT_LOG_OVERFLOW,
+        'batch_size': AUDIT_LOG_BATCH_SIZE,
+        'flush_interval_ms': AUDIT_LOG_FLUSH_INTERVAL_MS,
+        'operation_logs': operation_log_queue.get_stats(),
+        'flow_operation_logs': flow_log_queue.get_stats(),
+    }
+
+
+atexit.register(flush_audit_logs)
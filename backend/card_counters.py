@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流转卡计数器
+transfer_cards 上物化保存的计数，列表接口直接读取，不再每次聚合：
+
+- data_row_count: card_data 数据行数
+- completed_flow_steps: 已完成的流转步骤数（card_flow_status 中 completed 的记录）
+- total_flow_steps: 总流转步骤数（已启动流转时为 card_flow_status 记录数，
+  否则依次为逐卡流转顺序 card_department_flow、共享模板快照 template_snapshot_flow、
+  模板的步骤数）
+
+保存数据和流转操作在各自的事务中维护计数；本模块同时提供核对/修复命令：
+
+    python card_counters.py            # 核对并列出不一致的流转卡
+    python card_counters.py --repair   # 按实际数据重新计算不一致的计数
+"""
+
+import argparse
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import db_pool
+from change_tokens import bump_change_sequence
+
+COUNTER_COLUMNS = ('data_row_count', 'completed_flow_steps', 'total_flow_steps')
+
+
+def _card_filter(card_ids, column):
+    if card_ids is None:
+        return '', []
+    placeholders = ', '.join(['%s'] * len(card_ids))
+    return f'WHERE {column} IN ({placeholders})', list(card_ids)
+
+
+def _expected_counters_sql(card_ids):
+    """按实际数据计算计数的 FROM/JOIN 部分，返回 (sql, 计数表达式, WHERE 条件, params)"""
+    rc_where, rc_params = _card_filter(card_ids, 'card_id')
+    fs_where, fs_params = _card_filter(card_ids, 'card_id')
+    cdf_where, cdf_params = _card_filter(card_ids, 'card_id')
+    tc_where, tc_params = _card_filter(card_ids, 'tc.id')
+    sql = f"""
+        transfer_cards tc
+        LEFT JOIN (
+            SELECT card_id, COUNT(*) AS row_count
+            FROM card_data {rc_where}
+            GROUP BY card_id
+        ) rc ON rc.card_id = tc.id
+        LEFT JOIN (
+            SELECT card_id, COUNT(*) AS total_steps, SUM(status = 'completed') AS completed_steps
+            FROM card_flow_status {fs_where}
+            GROUP BY card_id
+        ) fs ON fs.card_id = tc.id
+        LEFT JOIN (
+            SELECT card_id, COUNT(*) AS total_steps
+            FROM card_department_flow {cdf_where}
+            GROUP BY card_id
+        ) cdf ON cdf.card_id = tc.id
+        LEFT JOIN (
+            SELECT snapshot_id, COUNT(*) AS total_steps
+            FROM template_snapshot_flow
+            GROUP BY snapshot_id
+        ) sf ON sf.snapshot_id = tc.snapshot_id
+        LEFT JOIN (
+            SELECT template_id, COUNT(*) AS total_steps
+            FROM template_department_flow
+            GROUP BY template_id
+        ) tdf ON tdf.template_id = tc.template_id
+    """
+    expressions = {
+        'data_row_count': 'COALESCE(rc.row_count, 0)',
+        'completed_flow_steps': 'COALESCE(fs.completed_steps, 0)',
+        'total_flow_steps': 'COALESCE(fs.total_steps, cdf.total_steps, sf.total_steps, tdf.total_steps, 0)',
+    }
+    return sql, expressions, tc_where, rc_params + fs_params + cdf_params + tc_params
+
+
+def add_data_rows(cursor, card_id, delta):
+    """新增（或删除）数据行后调整数据行数"""
+    if not delta:
+        return
+    cursor.execute("""
+        UPDATE transfer_cards
+        SET data_row_count = GREATEST(data_row_count + %s, 0)
+        WHERE id = %s
+    """, (delta, card_id))
+
+
+def refresh_card_counters(cursor, card_ids=None):
+    """
+    按实际数据重新计算流转卡计数（card_ids 为 None 时处理全部流转卡）
+
+    用于创建流转卡、批量写入等不便增量维护的路径，以及修复命令。返回受影响的行数
+    """
+    if card_ids is not None and not card_ids:
+        return 0
+    from_sql, expressions, where_sql, params = _expected_counters_sql(card_ids)
+    assignments = ', '.join(f'tc.{column} = {expressions[column]}' for column in COUNTER_COLUMNS)
+    # 计数不是业务修改，保持 updated_at 不变（列表的变更令牌由 change_sequences 感知，见 change_tokens）
+    return cursor.execute(f"""
+        UPDATE {from_sql}
+        SET {assignments}, tc.updated_at = tc.updated_at
+        {where_sql}
+    """, params)
+
+
+def find_counter_mismatches(cursor, card_ids=None):
+    """返回计数与实际数据不一致的流转卡列表"""
+    from_sql, expressions, where_sql, params = _expected_counters_sql(card_ids)
+    selects = ', '.join(
+        f'tc.{column}, {expressions[column]} AS expected_{column}' for column in COUNTER_COLUMNS)
+    mismatch = ' OR '.join(
+        f'NOT (tc.{column} <=> {expressions[column]})' for column in COUNTER_COLUMNS)
+    where_sql = f'{where_sql} AND ({mismatch})' if where_sql else f'WHERE {mismatch}'
+    cursor.execute(f"""
+        SELECT tc.id, tc.card_number, {selects}
+        FROM {from_sql}
+        {where_sql}
+        ORDER BY tc.id
+    """, params)
+    return cursor.fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='核对/修复 transfer_cards 上的计数')
+    parser.add_argument('--repair', action='store_true', help='重新计算并写回计数')
+    parser.add_argument('--card-id', type=int, action='append', dest='card_ids',
+                        help='只处理指定流转卡（可重复）')
+    args = parser.parse_args(argv)
+
+    connection = db_pool.get_connection()
+    try:
+        with connection.cursor() as cursor:
+            mismatches = find_counter_mismatches(cursor, args.card_ids)
+            for card in mismatches:
+                diffs = ', '.join(
+                    f"{column}: {card[column]} -> {card['expected_' + column]}"
+                    for column in COUNTER_COLUMNS
+                    if card[column] != card['expected_' + column])
+                print(f"流转卡 {card['id']} ({card['card_number']}): {diffs}")
+            print(f"共 {len(mismatches)} 张流转卡计数不一致")
+
+            if args.repair and mismatches:
+                repaired = refresh_card_counters(cursor, [card['id'] for card in mismatches])
+                # 计数在列表中可见，通知各进程的变更令牌
+                bump_change_sequence(cursor)
+                connection.commit()
+                print(f"已修复 {repaired} 张流转卡")
+        return 1 if mismatches and not args.repair else 0
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流转卡数据行格式化与流式输出
+GET /api/cards/<id>/data?stream=1 时用服务端游标（SSDictCursor）逐批读取数据行，
+边读边序列化输出 JSON，不在内存中构建完整的 table_data
+
+行数据支持两种格式：
+- 默认：table_data 为对象数组；flat=0 时只保留 values，不再重复输出平铺的字段值
+- 列式（?format=columnar 或 Accept: application/vnd.transfercard.columnar+json）：
+  列名和类型只输出一次（columns / types），每行是按列顺序排列的数组（rows）
+"""
+
+import os
+
+import pymysql
+from flask import json
+
+# 每次从服务端游标读取的行数
+CARD_STREAM_BATCH_SIZE = int(os.getenv('CARD_STREAM_BATCH_SIZE', 200))
+
+# 请求列式格式的 Accept 类型
+COLUMNAR_MIMETYPE = 'application/vnd.transfercard.columnar+json'
+
+# 列式格式中排在字段值之前的行信息列及其类型
+ROW_META_COLUMNS = (
+    ('row_number', 'number'),
+    ('department_id', 'number'),
+    ('department_name', 'text'),
+    ('status', 'text'),
+    ('submitted_by', 'number'),
+    ('submitted_at', 'date'),
+)
+
+
+def wants_columnar(request):
+    """根据查询参数或 Accept 头判断客户端是否请求列式格式"""
+    if request.args.get('format') == 'columnar':
+        return True
+    return request.accept_mimetypes[COLUMNAR_MIMETYPE] > 0
+
+
+def _field_value(row, field_name):
+    field_value = row.get(field_name, '')
+
+    # 处理日期格式
+    if field_value and hasattr(field_value, 'isoformat'):
+        return field_value.isoformat()
+    if field_value is None:
+        return ''
+    return field_value
+
+
+def format_row(row, columns, flat=True):
+    """把 card_data 行转换为接口返回的行数据"""
+    row_data = {
+        'row_number': row['row_number'],
+        'department_id': row['department_id'],
+        'department_name': row['department_name'],
+        'status': row['status'],
+        'submitted_by': row['submitted_by'],
+        'submitted_at': row['submitted_at'].isoformat() if row['submitted_at'] else None,
+        'values': {}
+    }
+
+    # 为每个字段添加值（从当前行记录中获取）
+    for field_name in columns:
+        field_value = _field_value(row, field_name)
+        row_data['values'][field_name] = field_value
+        if flat:
+            # 同时将字段值直接添加到行数据中（兼容前端处理）
+            row_data[field_name] = field_value
+
+    return row_data
+
+
+def format_row_tuple(row, columns):
+    """把 card_data 行转换为列式格式的一行（顺序与 columnar_header 的 columns 一致）"""
+    return [
+        row['row_number'],
+        row['department_id'],
+        row['department_name'],
+        row['status'],
+        row['submitted_by'],
+        row['submitted_at'].isoformat() if row['submitted_at'] else None,
+    ] + [_field_value(row, field_name) for field_name in columns]
+
+
+def columnar_header(schema):
+    """列式格式的列名和类型"""
+    return {
+        'format': 'columnar',
+        # columns 中从该位置开始是字段值列
+        'field_offset': len(ROW_META_COLUMNS),
+        'columns': [name for name, _ in ROW_META_COLUMNS] + list(schema.columns),
+        'types': [field_type for _, field_type in ROW_META_COLUMNS] + list(schema.types),
+    }
+
+
+def row_formatter(schema, columnar=False, flat=True):
+    """返回 (行格式化函数, 行数组在响应中的键名)"""
+    columns = schema.columns
+    if columnar:
+        return (lambda row: format_row_tuple(row, columns)), 'rows'
+    return (lambda row: format_row(row, columns, flat)), 'table_data'
+
+
+def stream_card_data(connection, head, sql, params, formatter, rows_key='table_data',
+                     batch_size=CARD_STREAM_BATCH_SIZE):
+    """
+    生成 {"success": true, "data": {...head, rows_key: [...]}} 的 JSON 片段
+
+    连接由生成器负责归还；输出途中出错时响应会被截断，客户端按解析失败处理
+    """
+    cursor = None
+    try:
+        cursor = connection.cursor(pymysql.cursors.SSDictCursor)
+        cursor.execute(sql, params)
+
+        items = ''.join(f'{json.dumps(key)}:{json.dumps(value)},' for key, value in head.items())
+        yield '{"success":true,"data":{' + items + json.dumps(rows_key) + ':['
+
+        first = True
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            chunk = ','.join(json.dumps(formatter(row)) for row in rows)
+            yield chunk if first else ',' + chunk
+            first = False
+
+        yield ']}}'
+    except Exception as e:
+        print(f"流式输出流转卡数据失败: {e}")
+        raise
+    finally:
+        if cursor is not None:
+            try:
+                # 未读完的结果集需要读完才能归还连接
+                cursor.close()
+            except Exception:
+                pass
+        connection.close()
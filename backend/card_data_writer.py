@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+card_data 批量写入
+一次锁定所有目标行，按列集合分组使用多行 INSERT ... ON DUPLICATE KEY UPDATE，
+并批量更新提交状态，替代逐行 SELECT ... FOR UPDATE + UPDATE/INSERT
+
+并发保存只在目标行（uk_card_row）上竞争，冲突由行锁和版本号检查
+"""
+
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime
+
+from card_counters import add_data_rows
+from card_delta import next_sync_seq, record_tombstones
+from card_values import CARD_VALUE_STORAGE, JSON_COLUMN, row_value_columns, write_values
+from field_schema import load_value_columns
+
+# 保存流转卡数据时使用的事务隔离级别。REPEATABLE READ 下锁定尚不存在的行会加间隙锁，
+# 并发创建同一新行时一方死锁回滚，由 run_in_transaction 重试后按已存在的行检查版本；
+# READ COMMITTED 不加间隙锁，由 save_rows 按影响行数发现并发创建并报告 VERSION_CONFLICT
+CARD_SAVE_ISOLATION = os.getenv('CARD_SAVE_ISOLATION', 'REPEATABLE READ').upper()
+
+# card_data 字段名只允许普通标识符，防止拼接 SQL 时注入
+_COLUMN_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# 字符串形式的行号只允许十进制数字
+_ROW_NUMBER_RE = re.compile(r'^[0-9]+$')
+
+# 系统列不通过字段值写入（请求中出现时忽略）
+_SYSTEM_COLUMNS = {
+    'id', 'card_id', 'row_number', 'status', 'submitted_by', 'submitted_at',
+    'approved_by', 'approved_at', 'created_at', 'updated_at', 'version',
+    'last_updated_by', 'last_updated_at', 'sync_seq', JSON_COLUMN,
+}
+
+
+class CardDataConflict(Exception):
+    """保存数据时检测到冲突（行已被他人提交、版本不一致等）"""
+
+    def __init__(self, message, error_type, conflict_info=None):
+        super().__init__(message)
+        self.message = message
+        self.error_type = error_type
+        self.conflict_info = conflict_info
+
+    def to_response(self):
+        response = {
+            'success': False,
+            'message': self.message,
+            'error_type': self.error_type,
+        }
+        if self.conflict_info is not None:
+            response['conflict_info'] = self.conflict_info
+        return response
+
+
+def _quote_column(name):
+    if not _COLUMN_NAME_RE.match(name):
+        raise ValueError(f'非法字段名: {name}')
+    return f'`{name}`'
+
+
+def parse_row_number(value):
+    """请求中的行号转换为正整数（整数或数字字符串），不合法（如 'abc'、'1.5'、true）时返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and _ROW_NUMBER_RE.match(value.strip()):
+        value = int(value)
+    if isinstance(value, int) and value > 0:
+        return value
+    return None
+
+
+def normalize_rows(row_data_list):
+    """
+    整理请求中的行数据
+
+    返回按请求顺序排列的 OrderedDict:
+    {row_number: {'values': {...}, 'submit': bool, 'delete': bool, 'version': 期望版本号}}
+    同一行号出现多次时按出现顺序合并。行号不合法时抛出 ValueError（调用方返回 400）
+    """
+    rows = OrderedDict()
+    for index, row_data in enumerate(row_data_list):
+        row_number = row_data.get('row_number')
+        if not row_number:
+            continue
+        number = parse_row_number(row_number)
+        if number is None:
+            raise ValueError(f'第{index + 1}条行数据的行号无效: {row_number}')
+        row_number = number
+        values = row_data.get('values', {}) or {}
+
+        row = rows.get(row_number)
+        if row is None:
+            row = rows[row_number] = {'values': {}, 'submit': False, 'delete': False, 'version': None}
+        row['values'].update(values)
+        row['submit'] = row['submit'] or bool(row_data.get('submit', False))
+        row['delete'] = row['delete'] or bool(row_data.get('delete', False))
+        if row_data.get('version') is not None:
+            row['version'] = row_data.get('version')
+    return rows
+
+
+def lock_rows(cursor, card_id, row_numbers):
+    """用一条 IN 查询锁定所有目标行，返回 {row_number: 现有行}"""
+    if not row_numbers:
+        return {}
+    placeholders = ', '.join(['%s'] * len(row_numbers))
+    cursor.execute(f"""
+        SELECT id, `row_number`, updated_at, version, submitted_by, submitted_at
+        FROM card_data
+        WHERE card_id = %s AND `row_number` IN ({placeholders})
+        FOR UPDATE
+    """, [card_id] + list(row_numbers))
+    return {row['row_number']: row for row in cursor.fetchall()}
+
+
+def _submitter_name(cursor, user_id):
+    cursor.execute("SELECT username FROM users WHERE id = %s", (user_id,))
+    result = cursor.fetchone()
+    return result['username'] if result else '未知用户'
+
+
+def check_conflicts(cursor, rows, existing_rows, user_id, versioned=False, client_updated_at=None):
+    """
+    按行顺序检查冲突，发现冲突时抛出 CardDataConflict
+
+    - 该行已被其他用户提交：DATA_CONFLICT
+    - 版本号（versioned=True）或更新时间（client_updated_at）不一致：VERSION_CONFLICT
+    - 提交已被他人提交的行：ALREADY_SUBMITTED
+    """
+    client_time = None
+    if client_updated_at:
+        try:
+            client_time = datetime.fromisoformat(client_updated_at.replace('Z', '+00:00'))
+        except Exception as version_error:
+            print(f"版本检查错误: {version_error}")
+
+    for row_number, row in rows.items():
+        existing_row = existing_rows.get(row_number)
+        if not existing_row:
+            continue
+
+        # 检查数据冲突：如果该行已被其他用户提交
+        if existing_row['submitted_at']:
+            submitted_by_other = existing_row['submitted_by']
+            if submitted_by_other and str(submitted_by_other) != str(user_id):
+                submitter_name = _submitter_name(cursor, submitted_by_other)
+                raise CardDataConflict(
+                    f'第{row_number}行已被用户 {submitter_name} 提交，无法修改',
+                    'DATA_CONFLICT',
+                    {
+                        'row_number': row_number,
+                        'submitted_by': submitter_name,
+                        'submitted_at': existing_row['submitted_at'].isoformat()
+                    })
+
+        # 版本检查（乐观锁）
+        if versioned and row['version'] is not None:
+            current_version = existing_row.get('version', 1)
+            if current_version != row['version']:
+                raise CardDataConflict(
+                    f'第{row_number}行数据已被其他用户修改，请刷新后重试',
+                    'VERSION_CONFLICT',
+                    {
+                        'row_number': row_number,
+                        'expected_version': row['version'],
+                        'current_version': current_version
+                    })
+
+        # 检查版本冲突（基于更新时间）
+        if client_time is not None and existing_row['updated_at']:
+            try:
+                server_time = existing_row['updated_at'].replace(tzinfo=None)
+                # 如果服务器时间比客户端时间新，说明有冲突
+                if server_time > client_time:
+                    raise CardDataConflict(
+                        f'第{row_number}行数据已被其他用户修改，请刷新后重试',
+                        'VERSION_CONFLICT',
+                        {
+                            'row_number': row_number,
+                            'server_updated_at': server_time.isoformat(),
+                            'client_updated_at': client_updated_at
+                        })
+            except CardDataConflict:
+                raise
+            except Exception as version_error:
+                print(f"版本检查错误: {version_error}")
+
+        # 其他用户已提交，禁止重复提交
+        if row['submit'] and existing_row['submitted_at'] and existing_row['submitted_by'] != user_id:
+            raise CardDataConflict(
+                f'第{row_number}行已被其他用户提交，无法重复提交',
+                'ALREADY_SUBMITTED')
+
+
+def upsert_rows(cursor, card_id, rows, existing_rows=None, user_id=None, versioned=False, sync_seq=None):
+    """
+    批量写入字段值
+
+    已存在的行更新字段值；不存在的行在至少有一个非空值时插入
+    （existing_rows 为 None 时不做存在性判断，有字段值即写入）。
+    列集合相同的行合并为一条多行 INSERT ... ON DUPLICATE KEY UPDATE（executemany）。
+    versioned=True 时插入版本号为 1、更新时版本号递增，并记录 last_updated_by。
+    wide 以外的布局中字段值随行写入 field_values（json）或在行写入后写入窄表（eav）。
+    sync_seq 为 None 时在写入前分配同步序号。
+
+    插入的行数按数据库返回的影响行数计算（ON DUPLICATE KEY UPDATE 插入计 1、更新计 2）：
+    每次更新都写入本事务新的 sync_seq，不会出现值未变化计 0 的行，
+    所以每组插入数 = 2 * 行数 - 影响行数，不依赖锁定前读到的行是否存在。
+    返回 (写入的行号列表, 插入的行数)
+    """
+    field_columns = None if CARD_VALUE_STORAGE == 'wide' else load_value_columns(cursor)
+    groups = OrderedDict()
+    field_rows = []
+    stored_clauses = {}
+    for row_number, row in rows.items():
+        if row.get('delete'):
+            continue
+        values = {k: v for k, v in row['values'].items() if k not in _SYSTEM_COLUMNS}
+        if not values:
+            continue
+        if existing_rows is not None and row_number not in existing_rows and not any(values.values()):
+            continue
+        # 字段值按布局写入，其余列（如 department_id）仍写入 card_data
+        field_values = {}
+        if field_columns is not None:
+            field_values = {k: v for k, v in values.items() if k in field_columns}
+            values = {k: v for k, v in values.items() if k not in field_columns}
+            if field_values:
+                field_rows.append((card_id, row_number, field_values))
+        stored = row_value_columns(field_values) if field_values else []
+        stored_clauses.update((column, clause) for column, _, clause in stored)
+        columns = tuple(sorted(values.keys()))
+        groups.setdefault((columns, tuple(column for column, _, _ in stored)), []).append(
+            (row_number, values, [value for _, value, _ in stored]))
+
+    written = []
+    inserted = 0
+    if groups and sync_seq is None:
+        sync_seq = next_sync_seq(cursor, card_id)
+    for (columns, stored_columns), group_rows in groups.items():
+        quoted = [_quote_column(column) for column in columns]
+        insert_columns = ['card_id', '`row_number`', 'sync_seq']
+        if versioned:
+            insert_columns += ['version', 'last_updated_by']
+        insert_columns += quoted + [f'`{column}`' for column in stored_columns]
+
+        update_clauses = [f"{column} = VALUES({column})" for column in quoted]
+        update_clauses += [stored_clauses[column] for column in stored_columns]
+        if versioned:
+            update_clauses += ["version = version + 1", "last_updated_by = VALUES(last_updated_by)"]
+        update_clauses += ["sync_seq = VALUES(sync_seq)", "updated_at = NOW()"]
+
+        # VALUES 中只能出现占位符，pymysql 才会把 executemany 合并为一条多行 INSERT
+        sql = f"""
+            INSERT INTO card_data ({', '.join(insert_columns)})
+            VALUES ({', '.join(['%s'] * len(insert_columns))})
+            ON DUPLICATE KEY UPDATE {', '.join(update_clauses)}
+        """
+        params = []
+        for row_number, values, stored_values in group_rows:
+            row_params = [card_id, row_number, sync_seq]
+            if versioned:
+                row_params += [1, user_id]
+            row_params += [values[column] for column in columns] + stored_values
+            params.append(row_params)
+
+        affected = cursor.executemany(sql, params)
+        inserted += 2 * len(params) - affected
+        written.extend(row_number for row_number, _, _ in group_rows)
+
+    # eav 布局的字段值、json 布局中置空的键在行写入后处理
+    write_values(cursor, field_rows)
+    return written, inserted
+
+
+def mark_submitted(cursor, card_id, row_numbers, user_id, sync_seq):
+    """批量把行状态更新为已提交"""
+    if not row_numbers:
+        return 0
+    placeholders = ', '.join(['%s'] * len(row_numbers))
+    return cursor.execute(f"""
+        UPDATE card_data
+        SET status = 'submitted', submitted_by = %s, submitted_at = NOW(), sync_seq = %s
+        WHERE card_id = %s AND `row_number` IN ({placeholders})
+    """, [user_id, sync_seq, card_id] + list(row_numbers))
+
+
+def delete_rows(cursor, card_id, row_numbers, sync_seq, user_id=None):
+    """删除数据行并记录墓碑（供增量同步通知客户端），返回删除的行数"""
+    if not row_numbers:
+        return 0
+    placeholders = ', '.join(['%s'] * len(row_numbers))
+    deleted = cursor.execute(f"""
+        DELETE FROM card_data
+        WHERE card_id = %s AND `row_number` IN ({placeholders})
+    """, [card_id] + list(row_numbers))
+    record_tombstones(cursor, card_id, row_numbers, sync_seq, user_id)
+    add_data_rows(cursor, card_id, -deleted)
+    return deleted
+
+
+def save_rows(cursor, card_id, row_data_list, user_id, versioned=False, client_updated_at=None):
+    """
+    批量保存行数据（分配同步序号 -> 锁定 -> 冲突检查 -> 删除 -> 批量写入 -> 批量提交 -> 更新数据行数）
+
+    行数据带 delete: true 时删除该行（调用方负责权限检查）
+
+    冲突时抛出 CardDataConflict，调用方负责回滚。返回写入统计
+    """
+    rows = normalize_rows(row_data_list)
+    # 序号在单独的短事务中分配，不锁定流转卡行，并发保存只在各自的数据行上竞争
+    sync_seq = next_sync_seq(cursor, card_id)
+    existing_rows = lock_rows(cursor, card_id, list(rows.keys()))
+    check_conflicts(cursor, rows, existing_rows, user_id,
+                    versioned=versioned, client_updated_at=client_updated_at)
+
+    delete_numbers = [row_number for row_number, row in rows.items()
+                      if row['delete'] and row_number in existing_rows]
+    deleted = delete_rows(cursor, card_id, delete_numbers, sync_seq, user_id)
+
+    written, inserted = upsert_rows(cursor, card_id, rows, existing_rows,
+                                    user_id=user_id, versioned=versioned, sync_seq=sync_seq)
+
+    submit_rows = [row_number for row_number, row in rows.items()
+                   if row['submit'] and not row['delete']]
+    mark_submitted(cursor, card_id, submit_rows, user_id, sync_seq)
+
+    # 锁定时不存在的行都应是插入；少于预期说明其他事务在锁定后创建了这些行（未加间隙锁时）
+    expected_inserts = [row_number for row_number in written if row_number not in existing_rows]
+    if inserted < len(expected_inserts):
+        raise CardDataConflict(
+            '数据行已被其他用户同时创建，请刷新后重试',
+            'VERSION_CONFLICT',
+            {'rows': expected_inserts})
+    add_data_rows(cursor, card_id, inserted)
+
+    return {
+        'rows': len(rows),
+        'written': len(written),
+        'inserted': inserted,
+        'deleted': deleted,
+        'submitted': len(submit_rows),
+    }
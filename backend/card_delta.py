@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流转卡数据增量同步
+GET /api/cards/<id>/data?since=<sync_token> 只返回令牌之后修改过的数据行，
+以及之后删除的行号（墓碑），并返回新的令牌
+
+增量按写入事务分配的序号（sync_seq）而不是 updated_at 判断。序号在单独的短事务中分配，
+分配时留下的租约在写入事务提交时删除；令牌只推进到最小的未提交序号之前（sync_watermark），
+增量查询 sync_seq > 令牌序号的行
+"""
+
+import base64
+import json
+import os
+from datetime import datetime, timedelta
+
+import db_pool
+
+# 墓碑保留天数；令牌早于保留期时要求客户端重新全量加载
+CARD_DATA_TOMBSTONE_RETENTION_DAYS = int(os.getenv('CARD_DATA_TOMBSTONE_RETENTION_DAYS', 7))
+# 序号租约有效期（秒）：超过后视为写入事务已回滚，不再阻挡令牌推进（应大于最长的保存事务）
+CARD_SYNC_LEASE_TIMEOUT = int(os.getenv('CARD_SYNC_LEASE_TIMEOUT', 120))
+
+_TOKEN_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def encode_sync_token(sync_seq, db_now):
+    """根据读取数据行之前的同步水位（sync_watermark）和数据库时间（用于判断墓碑是否已清理）生成同步令牌"""
+    payload = json.dumps([int(sync_seq or 0), db_now.strftime(_TOKEN_TIME_FORMAT)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_sync_token(token):
+    """
+    解析同步令牌，返回 (同步序号, 数据库时间)；格式错误时抛出 ValueError
+
+    只有时间的旧令牌返回的同步序号为 None，调用方按全量返回
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if len(payload) == 1:
+            return None, datetime.strptime(payload[0], _TOKEN_TIME_FORMAT)
+        sync_seq, synced_at = payload
+        return int(sync_seq), datetime.strptime(synced_at, _TOKEN_TIME_FORMAT)
+    except Exception:
+        raise ValueError('无效的同步令牌')
+
+
+def get_db_now(cursor):
+    cursor.execute("SELECT NOW() AS db_now")
+    return cursor.fetchone()['db_now']
+
+
+def _allocate_lease(card_id):
+    """在单独的连接中插入序号租约并立即提交，返回序号；顺便清理回滚事务遗留的过期租约"""
+    connection = db_pool.get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO card_data_sync_leases (card_id) VALUES (%s)", (card_id,))
+            seq = cursor.lastrowid
+            cursor.execute("""
+                SELECT seq FROM card_data_sync_leases
+                WHERE created_at < NOW() - INTERVAL %s SECOND
+                LIMIT 100
+                FOR UPDATE SKIP LOCKED
+            """, (CARD_SYNC_LEASE_TIMEOUT,))
+            expired = [row['seq'] for row in cursor.fetchall()]
+            if expired:
+                cursor.execute(f"""
+                    DELETE FROM card_data_sync_leases
+                    WHERE seq IN ({', '.join(['%s'] * len(expired))})
+                """, expired)
+        connection.commit()
+        return seq
+    finally:
+        connection.close()
+
+
+def next_sync_seq(cursor, card_id):
+    """
+    为当前写入事务分配同步序号
+
+    租约在单独的事务中提交，不锁定流转卡行；本事务删除租约，随数据一起提交或回滚
+    """
+    seq = _allocate_lease(card_id)
+    cursor.execute("DELETE FROM card_data_sync_leases WHERE seq = %s", (seq,))
+    return seq
+
+
+def sync_watermark(cursor, card_id):
+    """
+    返回可以写入令牌的序号：不大于它的写入都已提交（在读取数据行之前调用）
+
+    有未提交的写入（未过期的租约）时停在最小租约序号之前，否则取本卡已写入的最大序号
+    """
+    cursor.execute("""
+        SELECT
+            (SELECT MIN(seq) FROM card_data_sync_leases
+             WHERE card_id = %s AND created_at >= NOW() - INTERVAL %s SECOND) AS pending_seq,
+            GREATEST(
+                COALESCE((SELECT MAX(sync_seq) FROM card_data WHERE card_id = %s), 0),
+                COALESCE((SELECT MAX(sync_seq) FROM card_data_tombstones WHERE card_id = %s), 0)
+            ) AS committed_seq
+    """, (card_id, CARD_SYNC_LEASE_TIMEOUT, card_id, card_id))
+    row = cursor.fetchone()
+    if row['pending_seq'] is not None:
+        return min(row['committed_seq'], row['pending_seq'] - 1)
+    return row['committed_seq']
+
+
+def is_token_expired(synced_at, db_now):
+    """令牌早于墓碑保留期时，删除记录可能已被清理，只能全量加载"""
+    return db_now - synced_at > timedelta(days=CARD_DATA_TOMBSTONE_RETENTION_DAYS)
+
+
+def load_changed_rows(cursor, card_id, since_seq, select_list='cd.*'):
+    """查询令牌之后写入过的数据行（走 idx_card_data_sync_seq，只扫描本卡序号之后的行）"""
+    cursor.execute(f"""
+        SELECT {select_list}, d.name as department_name
+        FROM card_data cd
+        LEFT JOIN departments d ON cd.department_id = d.id
+        WHERE cd.card_id = %s AND cd.sync_seq > %s
+        ORDER BY cd.row_number
+    """, (card_id, since_seq))
+    return cursor.fetchall()
+
+
+def load_deleted_rows(cursor, card_id, since_seq):
+    """查询令牌之后删除且之后没有重新创建的行号"""
+    cursor.execute("""
+        SELECT DISTINCT t.row_number
+        FROM card_data_tombstones t
+        WHERE t.card_id = %s AND t.sync_seq > %s
+          AND NOT EXISTS (
+              SELECT 1 FROM card_data cd
+              WHERE cd.card_id = t.card_id AND cd.row_number = t.row_number
+          )
+        ORDER BY t.row_number
+    """, (card_id, since_seq))
+    return [row['row_number'] for row in cursor.fetchall()]
+
+
+def record_tombstones(cursor, card_id, row_numbers, sync_seq, user_id=None):
+    """记录删除的数据行（sync_seq 为本事务的同步序号），并清理本卡超过保留期的墓碑"""
+    if not row_numbers:
+        return
+    cursor.executemany("""
+        INSERT INTO card_data_tombstones (card_id, `row_number`, sync_seq, deleted_by, deleted_at)
+        VALUES (%s, %s, %s, %s, NOW())
+    """, [(card_id, row_number, sync_seq, user_id) for row_number in row_numbers])
+    cursor.execute("""
+        DELETE FROM card_data_tombstones
+        WHERE card_id = %s AND deleted_at < NOW() - INTERVAL %s DAY
+    """, (card_id, CARD_DATA_TOMBSTONE_RETENTION_DAYS))
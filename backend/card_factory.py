@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于模板创建流转卡
+/api/template-cards/table-format（单张）和 /api/template-cards/bulk（批量）共用：
+
+- 流转卡主记录用一条多行 INSERT 写入，再按卡号取回 ID
+  （innodb_autoinc_lock_mode=2 时多行插入的自增 ID 不保证连续）
+- 空数据行在插入时直接带上默认值，不再插入后整卡 UPDATE
+- 模板的字段配置（可能来自请求中的 selected_fields）、字段权限和部门流转顺序
+  保存为按内容寻址的共享快照（见 template_snapshots），新卡只记录 snapshot_id，
+  不再逐卡复制
+"""
+
+import os
+
+import pymysql
+
+from card_counters import refresh_card_counters
+from card_delta import get_db_now
+from card_list import CARD_STATUSES
+from card_values import row_value_columns, write_values
+from field_schema import load_value_columns
+from template_snapshots import load_template_snapshot, ensure_snapshot
+
+# 批量创建的最大张数
+BULK_CARD_MAX = int(os.getenv('BULK_CARD_MAX', 500))
+# 每张流转卡的最大数据行数
+CARD_MAX_ROWS = int(os.getenv('CARD_MAX_ROWS', 1000))
+# 流转卡号最大长度（transfer_cards.card_number 为 varchar(50)）
+CARD_NUMBER_MAX_LENGTH = 50
+
+# MySQL 唯一键冲突错误码
+_ER_DUP_ENTRY = 1062
+
+
+def normalize_card_number(value):
+    """卡号统一为去掉首尾空白的字符串（请求中可能是数字），空值返回空字符串"""
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def card_number_key(number):
+    """
+    比较卡号时使用的键
+
+    card_number 列的排序规则（utf8mb4_unicode_ci）不区分大小写，唯一键按同样的规则比较
+    """
+    return number.casefold()
+
+
+def is_duplicate_entry(error):
+    """是否为唯一键冲突（并发创建了相同卡号的流转卡）"""
+    return isinstance(error, pymysql.err.IntegrityError) and error.args and error.args[0] == _ER_DUP_ENTRY
+
+
+def load_template_setup(cursor, template_id, selected_fields=None):
+    """
+    读取创建流转卡需要的模板配置，模板不存在时返回 None
+
+    返回 {'template': 模板, 'fields': 字段配置, 'defaults': {列名: 默认值}, 'snapshot': 模板快照}
+    """
+    selected_fields = selected_fields or []
+    cursor.execute("SELECT id, template_name, department_id FROM templates WHERE id = %s", (template_id,))
+    template = cursor.fetchone()
+    if not template:
+        return None
+
+    # 获取模板关联的字段配置
+    cursor.execute("""
+        SELECT tf.*, f.name as field_name, f.field_position
+        FROM template_fields tf
+        LEFT JOIN fields f ON tf.field_id = f.id
+        WHERE tf.template_id = %s
+        ORDER BY tf.field_order
+    """, (template_id,))
+    fields = cursor.fetchall()
+
+    if not fields and selected_fields:
+        # 模板没有配置字段时使用 selected_fields
+        fields = [{
+            'field_name': field_data.get('field_name'),
+            'field_order': i,
+            'is_required': field_data.get('is_required', False),
+            'default_value': field_data.get('default_value', ''),
+            'field_position': field_data.get('field_position', i)
+        } for i, field_data in enumerate(selected_fields, 1)]
+    elif not fields:
+        # 模板和 selected_fields 都没有时使用所有非预留字段
+        cursor.execute("""
+            SELECT name as field_name, field_position
+            FROM fields
+            WHERE is_placeholder = 0
+            ORDER BY field_position
+        """)
+        fields = [{'field_name': f['field_name'], 'field_order': i + 1, 'field_position': f['field_position']}
+                  for i, f in enumerate(cursor.fetchall())]
+
+    # 默认值：优先使用模板配置，其次使用 selected_fields；只保留可以保存字段值的字段
+    selected_defaults = {f.get('field_name'): f.get('default_value', '') for f in selected_fields}
+    existing = load_value_columns(cursor)
+    defaults = {}
+    for field in fields:
+        field_name = field.get('field_name')
+        default_value = field.get('default_value', '') or selected_defaults.get(field_name, '')
+        if field_name and default_value and field_name in existing:
+            defaults[field_name] = default_value
+
+    return {
+        'template': template,
+        'fields': fields,
+        'defaults': defaults,
+        'snapshot': load_template_snapshot(cursor, template, fields),
+    }
+
+
+def validate_bulk_cards(cursor, cards):
+    """
+    检查批量创建的卡号（必填、长度、请求内不重复、数据库中不存在）和行数
+
+    卡号先规范化（见 normalize_card_number）并写回 cards；重复按 card_number_key 判断，
+    与数据库唯一键的比较规则一致。返回每张卡的错误信息列表（没有错误时为 None）
+    """
+    errors = [None] * len(cards)
+    seen = {}
+    for i, card in enumerate(cards):
+        number = card['card_number'] = normalize_card_number(card.get('card_number'))
+        key = card_number_key(number)
+        row_count = card.get('row_count')
+        if not number:
+            errors[i] = '流转卡号不能为空'
+        elif len(number) > CARD_NUMBER_MAX_LENGTH:
+            errors[i] = f'流转卡号不能超过 {CARD_NUMBER_MAX_LENGTH} 个字符'
+        elif key in seen:
+            errors[i] = f'流转卡号与第 {seen[key] + 1} 张重复'
+        elif (not isinstance(row_count, int) or isinstance(row_count, bool)
+              or not 0 <= row_count <= CARD_MAX_ROWS):
+            errors[i] = f'行数必须是 0 到 {CARD_MAX_ROWS} 之间的整数'
+        elif card.get('status') not in CARD_STATUSES:
+            errors[i] = f'无效的状态: {card.get("status")}'
+        if number and len(number) <= CARD_NUMBER_MAX_LENGTH:
+            seen.setdefault(key, i)
+
+    numbers = [cards[i]['card_number'] for i in seen.values()]
+    if numbers:
+        cursor.execute(f"""
+            SELECT card_number FROM transfer_cards
+            WHERE card_number IN ({', '.join(['%s'] * len(numbers))})
+        """, numbers)
+        existing = {card_number_key(row['card_number']) for row in cursor.fetchall()}
+        for i, card in enumerate(cards):
+            if errors[i] is None and card_number_key(card['card_number']) in existing:
+                errors[i] = '流转卡号已存在'
+    return errors
+
+
+def create_cards(cursor, template_id, setup, cards, user_id):
+    """
+    在当前事务中基于同一模板创建多张流转卡
+
+    cards: [{'card_number', 'title', 'description', 'status', 'row_count'}]，卡号已规范化且互不重复
+    返回与 cards 顺序一致的流转卡 ID 列表。卡号已存在（包括并发创建）时抛出 IntegrityError
+    """
+    # executemany 只有在 VALUES 中全部是占位符时才合并为多行插入，时间取一次数据库时间作为参数
+    db_now = get_db_now(cursor)
+    snapshot_id = ensure_snapshot(cursor, setup['snapshot'])
+    cursor.executemany("""
+        INSERT INTO transfer_cards (card_number, template_id, snapshot_id, title, description,
+                                    status, created_by, created_at, cancelled_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, [(card['card_number'], template_id, snapshot_id, card.get('title', ''), card.get('description', ''),
+           card.get('status', 'draft'), user_id, db_now,
+           db_now if card.get('status') == 'cancelled' else None) for card in cards])
+
+    numbers = [card['card_number'] for card in cards]
+    cursor.execute(f"""
+        SELECT id, card_number FROM transfer_cards
+        WHERE card_number IN ({', '.join(['%s'] * len(numbers))})
+    """, numbers)
+    ids_by_number = {card_number_key(row['card_number']): row['id'] for row in cursor.fetchall()}
+    card_ids = [ids_by_number[card_number_key(number)] for number in numbers]
+
+    # 数据行：插入时带上默认值（按字段值存储布局写入 card_data 列，eav 布局另行写入窄表）
+    default_columns = row_value_columns(setup['defaults'])
+    default_values = [value for _, value, _ in default_columns]
+    columns_sql = ''.join(f", `{column.replace('`', '``')}`" for column, _, _ in default_columns)
+    placeholders = ', '.join(['%s'] * (4 + len(default_columns)))
+    rows = [(card_id, row_number, *default_values, db_now, db_now)
+            for card_id, card in zip(card_ids, cards)
+            for row_number in range(1, card['row_count'] + 1)]
+    if rows:
+        cursor.executemany(f"""
+            INSERT INTO card_data (card_id, `row_number`{columns_sql}, created_at, updated_at)
+            VALUES ({placeholders})
+        """, rows)
+        if setup['defaults']:
+            write_values(cursor, [(card_id, row_number, setup['defaults'])
+                                  for card_id, row_number, *_ in rows])
+
+    # 初始化流转卡计数（数据行数、总流转步骤数取自快照）
+    refresh_card_counters(cursor, card_ids)
+    return card_ids
+
+
+def expand_bulk_request(data):
+    """
+    把批量创建请求展开为卡片列表，参数不合法时抛出 ValueError
+
+    - cards: [{'card_number', 'title', 'description', 'row_count', 'status'}]，
+      未填写的项使用请求顶层的 title / description / row_count / status
+    - 或 count + card_number_prefix（可选 number_start、number_width）按序号生成卡号
+    """
+    common = {
+        'title': data.get('title', ''),
+        'description': data.get('description', ''),
+        'row_count': data.get('row_count', 10),
+        'status': data.get('status', 'draft'),
+    }
+    cards = data.get('cards')
+    if cards is None:
+        prefix = data.get('card_number_prefix')
+        try:
+            count = int(data.get('count') or 0)
+            start = int(data.get('number_start', 1))
+            width = int(data.get('number_width', 3))
+        except (TypeError, ValueError):
+            raise ValueError('count、number_start、number_width 必须是整数')
+        if not prefix or count <= 0:
+            raise ValueError('请提供 cards，或 count 和 card_number_prefix')
+        # 生成卡号之前检查数量和格式，避免按超大的 count / number_width 分配内存
+        if count > BULK_CARD_MAX:
+            raise ValueError(f'一次最多创建 {BULK_CARD_MAX} 张流转卡')
+        if start < 0 or not 0 <= width <= CARD_NUMBER_MAX_LENGTH:
+            raise ValueError(f'number_start 不能为负数，number_width 必须在 0 到 {CARD_NUMBER_MAX_LENGTH} 之间')
+        cards = [{'card_number': f'{prefix}{str(start + i).zfill(width)}'} for i in range(count)]
+    if not isinstance(cards, list) or not cards:
+        raise ValueError('cards 不能为空')
+    if not all(isinstance(card, dict) for card in cards):
+        raise ValueError('cards 的每一项必须是对象')
+    if len(cards) > BULK_CARD_MAX:
+        raise ValueError(f'一次最多创建 {BULK_CARD_MAX} 张流转卡')
+    return [{**common, **{k: v for k, v in card.items() if v is not None}} for card in cards]
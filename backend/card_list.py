@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流转卡列表查询参数
+/api/cards 与 /api/template-cards 共用的分页（limit + 游标）、状态/部门筛选和搜索
+
+游标基于排序键 (created_at, id)，按 created_at DESC, id DESC 翻页，
+翻页时不需要 OFFSET 扫描，也不受新增流转卡影响
+"""
+
+import base64
+import json
+from datetime import datetime
+
+# 单页最大条数
+CARD_LIST_MAX_LIMIT = 500
+
+CARD_STATUSES = ('draft', 'in_progress', 'flowing', 'completed', 'cancelled', 'rejected')
+
+_CURSOR_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def encode_cursor(card):
+    """根据一页中最后一张流转卡生成下一页游标"""
+    created_at = card.get('created_at')
+    if isinstance(created_at, datetime):
+        created_at = created_at.strftime(_CURSOR_TIME_FORMAT)
+    elif created_at:
+        # 已格式化为 isoformat 的时间
+        created_at = datetime.fromisoformat(str(created_at)).strftime(_CURSOR_TIME_FORMAT)
+    payload = json.dumps([created_at, card['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """解析游标，返回 (created_at, id)；格式错误时抛出 ValueError"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, card_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if created_at is not None:
+            created_at = datetime.strptime(created_at, _CURSOR_TIME_FORMAT)
+        return created_at, int(card_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+
+def parse_card_list_args(args):
+    """
+    解析列表查询参数，参数不合法时抛出 ValueError
+
+    - limit: 每页条数（不传时返回全部，兼容旧前端）
+    - cursor: 上一页返回的 next_cursor
+    - status: 状态，多个用逗号分隔
+    - department_id: 当前流转部门
+    - search: 按流转卡编号、标题、模板名称模糊搜索
+    """
+    params = {'limit': None, 'cursor': None, 'statuses': [], 'department_id': None, 'search': None}
+
+    limit = args.get('limit')
+    if limit not in (None, ''):
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError('limit 必须是整数')
+        if limit <= 0:
+            raise ValueError('limit 必须大于 0')
+        params['limit'] = min(limit, CARD_LIST_MAX_LIMIT)
+
+    cursor = args.get('cursor')
+    if cursor:
+        params['cursor'] = decode_cursor(cursor)
+
+    status = args.get('status')
+    if status:
+        statuses = [s.strip() for s in status.split(',') if s.strip()]
+        invalid = [s for s in statuses if s not in CARD_STATUSES]
+        if invalid:
+            raise ValueError(f'无效的状态: {", ".join(invalid)}')
+        params['statuses'] = statuses
+
+    department_id = args.get('department_id')
+    if department_id not in (None, ''):
+        try:
+            params['department_id'] = int(department_id)
+        except (TypeError, ValueError):
+            raise ValueError('department_id 必须是整数')
+
+    search = (args.get('search') or '').strip()
+    if search:
+        params['search'] = search
+
+    return params
+
+
+def build_card_filters(params):
+    """
+    根据列表参数生成 WHERE 条件（表别名 tc / ts / t）
+
+    返回 (条件列表, 参数列表)
+    """
+    clauses = []
+    values = []
+
+    if params['statuses']:
+        clauses.append(f"tc.status IN ({', '.join(['%s'] * len(params['statuses']))})")
+        values.extend(params['statuses'])
+
+    if params['department_id'] is not None:
+        clauses.append("tc.current_department_id = %s")
+        values.append(params['department_id'])
+
+    if params['search']:
+        keyword = '%' + params['search'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        clauses.append("""(tc.card_number LIKE %s OR tc.title LIKE %s
+                 OR COALESCE(ts.template_name, t.template_name) LIKE %s)""")
+        values.extend([keyword, keyword, keyword])
+
+    if params['cursor'] is not None:
+        created_at, card_id = params['cursor']
+        # created_at DESC 排序时 NULL 排在最后
+        if created_at is None:
+            clauses.append("(tc.created_at IS NULL AND tc.id < %s)")
+            values.append(card_id)
+        else:
+            clauses.append("""(tc.created_at < %s OR (tc.created_at = %s AND tc.id < %s)
+                 OR tc.created_at IS NULL)""")
+            values.extend([created_at, created_at, card_id])
+
+    return clauses, values
+
+
+def build_visibility_filter(user):
+    """
+    普通用户可见范围的 WHERE 条件（表别名 tc / ts / t），管理员返回空条件
+
+    模板未配置字段权限、本部门有字段权限或自己创建的流转卡可见，且不含草稿和取消状态。
+    实时推送的接收范围（event_hub.card_audience）按同一规则计算
+    """
+    if user['role'] == 'admin':
+        return [], []
+    clauses = [
+        """(tc.created_by = %s
+            OR EXISTS (
+                SELECT 1 FROM template_field_permissions tfp
+                WHERE tfp.template_id = COALESCE(ts.template_id, t.id)
+                AND tfp.department_id = %s
+            )
+            OR NOT EXISTS (
+                SELECT 1 FROM template_field_permissions tfp
+                WHERE tfp.template_id = COALESCE(ts.template_id, t.id)
+            ))""",
+        "tc.status NOT IN ('draft', 'cancelled')",
+    ]
+    return clauses, [user['id'], user['department_id']]
+
+
+def build_limit_clause(params):
+    """多取一条用于判断是否还有下一页"""
+    if params['limit'] is None:
+        return '', []
+    return 'LIMIT %s', [params['limit'] + 1]
+
+
+def paginate(cards, params):
+    """截取一页数据，返回 (cards, pagination)"""
+    limit = params['limit']
+    has_more = limit is not None and len(cards) > limit
+    if has_more:
+        cards = cards[:limit]
+    return cards, {
+        'limit': limit,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(cards[-1]) if has_more and cards else None,
+    }
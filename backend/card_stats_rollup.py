@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流转卡每日统计汇总
+card_daily_stats 按（日期，部门，模板）保存创建、启动、完成、驳回、取消的流转卡数，
+以及完成的流转步骤数和处理总时长（平均处理时长 = 总时长 / 步骤数）。
+工作台的趋势只读取最近两周的汇总行，查询成本与历史数据量无关。
+
+增量汇总按水位线处理：
+- transfer_cards 中 id 大于水位线的新流转卡计入创建数（部门为创建人所在部门）
+- flow_operation_logs 中 id 大于水位线的日志计入启动（start_flow）、完成（complete）、
+  驳回（reject），提交和完成时同时计入该步骤的处理时长：从同一流转卡上一条转入日志
+  （启动、提交、驳回、跳过、重启）到本条日志的时间，只取自日志本身，
+  驳回或重启后 card_flow_status 的时间被覆盖也不影响历史日期的汇总
+- 取消没有日志，按 transfer_cards.cancelled_at（状态变为取消的时间）重新统计最近两天；
+  取消之后再修改流转卡不会改变 cancelled_at，不会在修改当天重复计数
+
+只处理 ROLLUP_SETTLE_SECONDS 秒之前写入的记录，避免漏掉尚未提交的事务。
+水位线保存在 card_stats_rollup_state 中，汇总和水位线在同一事务中更新，
+多个进程同时执行时由行锁串行化，不会重复计数。
+增量汇总在后台线程中每 ROLLUP_INTERVAL 秒执行一次（工作台请求只负责启动线程），
+也可以由定时任务执行：
+
+    python card_stats_rollup.py              # 增量汇总
+    python card_stats_rollup.py --backfill   # 清空后按全部历史数据重新汇总
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import db_pool
+
+# 只汇总该秒数之前写入的记录
+ROLLUP_SETTLE_SECONDS = int(os.getenv('ROLLUP_SETTLE_SECONDS', 30))
+# 后台线程增量汇总的间隔秒数；0 表示不启动后台线程，只由定时任务执行本脚本
+ROLLUP_INTERVAL = float(os.getenv('ROLLUP_INTERVAL', 60))
+
+# 进入某部门的流转日志类型，下一条提交或完成日志与之的时间差为该步骤的处理时长
+_STEP_ENTRY_OPERATIONS = ('start_flow', 'submit_to_next', 'reject', 'skip', 'restart')
+
+_rollup_thread = None
+_rollup_pid = None
+_rollup_lock = threading.Lock()
+
+
+def _upsert_clause(columns):
+    return ', '.join(f'{column} = {column} + VALUES({column})' for column in columns)
+
+
+def _lock_state(cursor):
+    """锁定水位线（不存在时创建）"""
+    cursor.execute("INSERT IGNORE INTO card_stats_rollup_state (id) VALUES (1)")
+    cursor.execute("""
+        SELECT last_card_id, last_flow_log_id
+        FROM card_stats_rollup_state
+        WHERE id = 1
+        FOR UPDATE
+    """)
+    return cursor.fetchone()
+
+
+def _upper_id(cursor, table, last_id):
+    """水位线之后、已超过等待时间的最大 id（只扫描新记录）"""
+    cursor.execute(f"""
+        SELECT MAX(id) AS max_id
+        FROM {table}
+        WHERE id > %s AND created_at < NOW() - INTERVAL %s SECOND
+    """, (last_id, ROLLUP_SETTLE_SECONDS))
+    row = cursor.fetchone()
+    return row['max_id'] if row and row['max_id'] else last_id
+
+
+def _rollup_created(cursor, from_id, to_id):
+    if to_id <= from_id:
+        return 0
+    return cursor.execute(f"""
+        INSERT INTO card_daily_stats (stat_date, department_id, template_id, created_count)
+        SELECT DATE(tc.created_at), COALESCE(u.department_id, 0), COALESCE(tc.template_id, 0), COUNT(*)
+        FROM transfer_cards tc
+        LEFT JOIN users u ON tc.created_by = u.id
+        WHERE tc.id > %s AND tc.id <= %s AND tc.created_at IS NOT NULL
+        GROUP BY DATE(tc.created_at), COALESCE(u.department_id, 0), COALESCE(tc.template_id, 0)
+        ON DUPLICATE KEY UPDATE {_upsert_clause(('created_count',))}
+    """, (from_id, to_id))
+
+
+def _rollup_flow_logs(cursor, from_id, to_id):
+    if to_id <= from_id:
+        return 0
+    columns = ('started_count', 'completed_count', 'rejected_count',
+               'step_completed_count', 'step_duration_seconds')
+    # 启动日志没有目标部门时取第一步的部门，完成日志没有来源部门时取最后一步的部门
+    return cursor.execute(f"""
+        INSERT INTO card_daily_stats
+            (stat_date, department_id, template_id, {', '.join(columns)})
+        SELECT DATE(l.created_at), COALESCE(l.department_id, 0), COALESCE(tc.template_id, 0),
+               SUM(l.operation_type = 'start_flow'),
+               SUM(l.operation_type = 'complete'),
+               SUM(l.operation_type = 'reject'),
+               SUM(l.operation_type IN ('submit_to_next', 'complete') AND l.step_started_at IS NOT NULL),
+               SUM(CASE WHEN l.operation_type IN ('submit_to_next', 'complete') AND l.step_started_at IS NOT NULL
+                        THEN GREATEST(TIMESTAMPDIFF(SECOND, l.step_started_at, l.created_at), 0)
+                        ELSE 0 END)
+        FROM (
+            SELECT fol.card_id, fol.operation_type, fol.created_at,
+                   (SELECT p.created_at FROM flow_operation_logs p
+                    WHERE p.card_id = fol.card_id AND p.id < fol.id
+                      AND p.operation_type IN ({', '.join(['%s'] * len(_STEP_ENTRY_OPERATIONS))})
+                    ORDER BY p.id DESC LIMIT 1) AS step_started_at,
+                   CASE fol.operation_type
+                       WHEN 'start_flow' THEN COALESCE(fol.to_department_id, (
+                           SELECT s.department_id FROM card_flow_status s
+                           WHERE s.card_id = fol.card_id ORDER BY s.flow_order LIMIT 1))
+                       WHEN 'complete' THEN COALESCE(fol.from_department_id, (
+                           SELECT s.department_id FROM card_flow_status s
+                           WHERE s.card_id = fol.card_id ORDER BY s.flow_order DESC LIMIT 1))
+                       ELSE fol.from_department_id
+                   END AS department_id
+            FROM flow_operation_logs fol
+            WHERE fol.id > %s AND fol.id <= %s AND fol.created_at IS NOT NULL
+              AND fol.operation_type IN ('start_flow', 'submit_to_next', 'complete', 'reject')
+        ) l
+        LEFT JOIN transfer_cards tc ON tc.id = l.card_id
+        GROUP BY DATE(l.created_at), COALESCE(l.department_id, 0), COALESCE(tc.template_id, 0)
+        ON DUPLICATE KEY UPDATE {_upsert_clause(columns)}
+    """, (*_STEP_ENTRY_OPERATIONS, from_id, to_id))
+
+
+def _rollup_cancelled(cursor, since_days=None):
+    """
+    重新统计取消数（since_days 为 None 时统计全部历史）
+
+    取消没有日志，按 cancelled_at 的日期计入；清零和重新统计使用同一日期范围。
+    取消后又恢复的流转卡保留 cancelled_at，取消仍计入当天；再次取消时计入新的日期
+    """
+    date_filter = ''
+    card_filter = ''
+    params = []
+    if since_days is not None:
+        date_filter = 'WHERE stat_date >= CURDATE() - INTERVAL %s DAY'
+        card_filter = 'AND tc.cancelled_at >= CURDATE() - INTERVAL %s DAY'
+        params = [since_days]
+    cursor.execute(f"UPDATE card_daily_stats SET cancelled_count = 0 {date_filter}", params)
+    return cursor.execute(f"""
+        INSERT INTO card_daily_stats (stat_date, department_id, template_id, cancelled_count)
+        SELECT DATE(tc.cancelled_at), COALESCE(tc.current_department_id, 0), COALESCE(tc.template_id, 0),
+               COUNT(*)
+        FROM transfer_cards tc
+        WHERE tc.cancelled_at IS NOT NULL {card_filter}
+        GROUP BY DATE(tc.cancelled_at), COALESCE(tc.current_department_id, 0), COALESCE(tc.template_id, 0)
+        ON DUPLICATE KEY UPDATE cancelled_count = VALUES(cancelled_count)
+    """, params)
+
+
+def rollup(connection, backfill=False):
+    """
+    执行一次增量汇总（backfill=True 时清空后按全部历史重新汇总）
+
+    返回本次处理的 {'cards': 新流转卡数, 'flow_logs': 流转日志数}
+    """
+    def work(cursor):
+        state = _lock_state(cursor)
+        last_card_id = 0 if backfill else state['last_card_id']
+        last_flow_log_id = 0 if backfill else state['last_flow_log_id']
+        if backfill:
+            cursor.execute("DELETE FROM card_daily_stats")
+
+        card_upper = _upper_id(cursor, 'transfer_cards', last_card_id)
+        flow_upper = _upper_id(cursor, 'flow_operation_logs', last_flow_log_id)
+        _rollup_created(cursor, last_card_id, card_upper)
+        _rollup_flow_logs(cursor, last_flow_log_id, flow_upper)
+        _rollup_cancelled(cursor, None if backfill else 1)
+
+        cursor.execute("""
+            UPDATE card_stats_rollup_state
+            SET last_card_id = %s, last_flow_log_id = %s, rolled_up_at = NOW()
+            WHERE id = 1
+        """, (card_upper, flow_upper))
+        return {'cards': card_upper - last_card_id, 'flow_logs': flow_upper - last_flow_log_id}
+
+    result, _ = db_pool.run_in_transaction(connection, work)
+    return result
+
+
+def _rollup_loop():
+    while True:
+        try:
+            connection = db_pool.get_connection()
+            try:
+                rollup(connection)
+            finally:
+                connection.close()
+        except Exception as e:
+            print(f"每日统计增量汇总失败: {e}")
+        time.sleep(ROLLUP_INTERVAL)
+
+
+def ensure_rollup_thread():
+    """启动后台增量汇总线程（不阻塞请求；多进程部署时 fork 后的子进程重新启动）"""
+    global _rollup_thread, _rollup_pid
+    if ROLLUP_INTERVAL <= 0:
+        return
+    if _rollup_thread is not None and _rollup_pid == os.getpid() and _rollup_thread.is_alive():
+        return
+    with _rollup_lock:
+        if _rollup_thread is not None and _rollup_pid == os.getpid() and _rollup_thread.is_alive():
+            return
+        _rollup_pid = os.getpid()
+        _rollup_thread = threading.Thread(target=_rollup_loop, name='card-stats-rollup', daemon=True)
+        _rollup_thread.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='汇总流转卡每日统计（card_daily_stats）')
+    parser.add_argument('--backfill', action='store_true', help='清空后按全部历史数据重新汇总')
+    args = parser.parse_args(argv)
+
+    connection = db_pool.get_connection()
+    try:
+        result = rollup(connection, backfill=args.backfill)
+        print(f"汇总完成：新流转卡 {result['cards']} 条，流转日志 {result['flow_logs']} 条")
+        return 0
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流转卡字段值存储布局
+card_data 的每一行始终保存行信息（状态、提交人、版本号等），字段值的存储布局
+由 CARD_VALUE_STORAGE 按部署选择：
+
+- wide（默认）: card_data 上的宽列（field_01_pcs_project ~ field_50），每个字段一列
+- eav: 窄表 card_data_values (card_id, row_number, field_name, value)，只保存非空单元格
+- json: card_data.field_values JSON 列，只保存非空字段
+
+读取时 value_select 生成与宽列同名的 SELECT 表达式（见 field_schema.build_row_projection），
+接口代码和返回格式与布局无关；写入由 card_data_writer 和 card_factory 调用本模块。
+行锁、版本号、增量同步序号（sync_seq）和墓碑都在 card_data 行上，不受布局影响；
+card_data_values 通过外键随 card_data 行级联删除。
+
+切换布局前在维护窗口用迁移工具复制数据：
+
+    python card_values.py status                          # 各布局的行数和表大小
+    python card_values.py migrate --to eav                # 把当前布局（--from）的字段值复制到 eav
+    python card_values.py migrate --to json --clear-source   # 复制后清空源布局
+    python card_values.py bench --cards 50                # 各布局读取样本流转卡的耗时
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from pymysql.converters import escape_string
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import db_pool
+
+VALUE_STORAGES = ('wide', 'eav', 'json')
+# 字段值存储布局
+CARD_VALUE_STORAGE = os.getenv('CARD_VALUE_STORAGE', 'wide').lower()
+if CARD_VALUE_STORAGE not in VALUE_STORAGES:
+    raise ValueError(f'CARD_VALUE_STORAGE 必须是 {", ".join(VALUE_STORAGES)} 之一: {CARD_VALUE_STORAGE}')
+# migrate 每个事务处理的 card_data 行数（按ID范围）
+CARD_VALUE_MIGRATE_BATCH = int(os.getenv('CARD_VALUE_MIGRATE_BATCH', 1000))
+
+# json 布局保存字段值的列
+JSON_COLUMN = 'field_values'
+# json 布局更新已有行时合并字段值（新行直接写入，只含非空值）
+_JSON_MERGE_CLAUSE = (f"`{JSON_COLUMN}` = JSON_MERGE_PATCH("
+                      f"COALESCE(`{JSON_COLUMN}`, JSON_OBJECT()), VALUES(`{JSON_COLUMN}`))")
+
+
+def _quote(name):
+    return f"`{name.replace('`', '``')}`"
+
+
+def _literal(value):
+    return f"'{escape_string(value)}'"
+
+
+def _json_path(name):
+    return '$.' + json.dumps(name, ensure_ascii=False)
+
+
+def value_expression(column, alias='cd', storage=None):
+    """读取一个字段值的 SQL 表达式"""
+    storage = storage or CARD_VALUE_STORAGE
+    if storage == 'eav':
+        # 主键 (card_id, row_number, field_name) 点查
+        return (f"(SELECT v.value FROM card_data_values v"
+                f" WHERE v.card_id = {alias}.card_id AND v.`row_number` = {alias}.`row_number`"
+                f" AND v.field_name = {_literal(column)})")
+    if storage == 'json':
+        return f"JSON_UNQUOTE(JSON_EXTRACT({alias}.`{JSON_COLUMN}`, {_literal(_json_path(column))}))"
+    return f"{alias}.{_quote(column)}"
+
+
+def value_select(column, alias='cd', storage=None):
+    """SELECT 列表中的一个字段值，列名与宽列相同"""
+    storage = storage or CARD_VALUE_STORAGE
+    if storage == 'wide':
+        return value_expression(column, alias, storage)
+    return f"{value_expression(column, alias, storage)} AS {_quote(column)}"
+
+
+def row_value_columns(values, storage=None):
+    """
+    随 card_data 行一起写入的字段值，返回 [(列名, 值, ON DUPLICATE KEY UPDATE 子句)]
+
+    wide 为各字段列；json 为 field_values（只含非空值，置空的键由 write_values 删除）；
+    eav 的字段值不在 card_data 上，返回空列表
+    """
+    storage = storage or CARD_VALUE_STORAGE
+    if storage == 'wide':
+        return [(column, value, f"{_quote(column)} = VALUES({_quote(column)})")
+                for column, value in values.items()]
+    if storage == 'json' and values:
+        patch = {column: value for column, value in values.items() if value is not None}
+        return [(JSON_COLUMN, json.dumps(patch, ensure_ascii=False, default=str), _JSON_MERGE_CLAUSE)]
+    return []
+
+
+def write_values(cursor, rows, storage=None):
+    """
+    card_data 行写入后保存不随行写入的字段值，rows: [(card_id, row_number, {字段名: 值})]
+
+    - eav: 非空值插入或更新，空值删除
+    - json: 删除置空的键（非空值已随 card_data 行写入）
+    - wide: 字段值已随 card_data 行写入
+    """
+    storage = storage or CARD_VALUE_STORAGE
+    if storage == 'eav':
+        upserts = [(card_id, row_number, column, value)
+                   for card_id, row_number, values in rows
+                   for column, value in values.items() if value is not None]
+        if upserts:
+            cursor.executemany("""
+                INSERT INTO card_data_values (card_id, `row_number`, field_name, value)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE value = VALUES(value)
+            """, upserts)
+        clears = [(card_id, row_number, column)
+                  for card_id, row_number, values in rows
+                  for column, value in values.items() if value is None]
+        if clears:
+            cursor.executemany("""
+                DELETE FROM card_data_values
+                WHERE card_id = %s AND `row_number` = %s AND field_name = %s
+            """, clears)
+    elif storage == 'json':
+        # 按置空的键分组，同一组用一条语句
+        groups = {}
+        for card_id, row_number, values in rows:
+            cleared = tuple(sorted(column for column, value in values.items() if value is None))
+            if cleared:
+                groups.setdefault(cleared, []).append((card_id, row_number))
+        for cleared, targets in groups.items():
+            paths = ', '.join(['%s'] * len(cleared))
+            cursor.executemany(f"""
+                UPDATE card_data
+                SET `{JSON_COLUMN}` = JSON_REMOVE(`{JSON_COLUMN}`, {paths})
+                WHERE card_id = %s AND `row_number` = %s
+            """, [[_json_path(column) for column in cleared] + [card_id, row_number]
+                  for card_id, row_number in targets])
+
+
+# ========== 迁移与对比工具 ==========
+
+_ROW_META_SELECT = "cd.`row_number`, cd.department_id, cd.status, cd.submitted_by, cd.submitted_at, cd.version"
+_KEEP_TIMESTAMPS = "cd.updated_at = cd.updated_at, cd.last_updated_at = cd.last_updated_at"
+
+
+def _field_columns(cursor, storages):
+    """字段名列表（fields 表），涉及 wide 布局时只保留 card_data 中实际存在的列"""
+    cursor.execute("SELECT name FROM fields ORDER BY field_position, id")
+    names = [row['name'] for row in cursor.fetchall()]
+    if 'wide' in storages:
+        cursor.execute("SHOW COLUMNS FROM card_data")
+        existing = {row['Field'] for row in cursor.fetchall()}
+        names = [name for name in names if name in existing]
+    return names
+
+
+def _copy_statements(columns, source, target):
+    """把 cd.id 在 (%s, %s] 范围内的字段值从 source 复制到 target，返回 SQL 列表（参数为范围上下界）"""
+    expressions = {column: value_expression(column, 'cd', source) for column in columns}
+    where = "WHERE cd.id > %s AND cd.id <= %s"
+    if target == 'wide':
+        assignments = ', '.join(f"cd.{_quote(column)} = {expressions[column]}" for column in columns)
+        return [f"UPDATE card_data cd SET {assignments}, {_KEEP_TIMESTAMPS} {where}"]
+    if target == 'json':
+        # JSON_MERGE_PATCH 会去掉值为 NULL 的键，只保存非空字段
+        pairs = ', '.join(f"{_literal(column)}, CAST({expressions[column]} AS CHAR)" for column in columns)
+        return [f"UPDATE card_data cd SET cd.`{JSON_COLUMN}` = JSON_MERGE_PATCH(JSON_OBJECT(), JSON_OBJECT({pairs})),"
+                f" {_KEEP_TIMESTAMPS} {where}"]
+    return [f"""
+        INSERT INTO card_data_values (card_id, `row_number`, field_name, value)
+        SELECT cd.card_id, cd.`row_number`, {_literal(column)}, CAST({expressions[column]} AS CHAR)
+        FROM card_data cd
+        {where} AND {expressions[column]} IS NOT NULL
+        ON DUPLICATE KEY UPDATE value = VALUES(value)
+    """ for column in columns]
+
+
+def _clear_statements(columns, storage):
+    """清空 cd.id 在 (%s, %s] 范围内 storage 布局中的字段值"""
+    where = "WHERE cd.id > %s AND cd.id <= %s"
+    if storage == 'wide':
+        assignments = ', '.join(f"cd.{_quote(column)} = NULL" for column in columns)
+        return [f"UPDATE card_data cd SET {assignments}, {_KEEP_TIMESTAMPS} {where}"]
+    if storage == 'json':
+        return [f"UPDATE card_data cd SET cd.`{JSON_COLUMN}` = NULL, {_KEEP_TIMESTAMPS} {where}"]
+    return [f"""
+        DELETE v FROM card_data_values v
+        JOIN card_data cd ON v.card_id = cd.card_id AND v.`row_number` = cd.`row_number`
+        {where}
+    """]
+
+
+def migrate(connection, source, target, clear_source=False):
+    """按 card_data.id 范围分批复制字段值，每批一个事务，返回处理的 card_data 行数"""
+    if source == target:
+        raise ValueError('源布局和目标布局相同')
+    with connection.cursor() as cursor:
+        columns = _field_columns(cursor, (source, target))
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id, COUNT(*) AS total FROM card_data")
+        bounds = cursor.fetchone()
+    if not columns:
+        return 0
+
+    statements = _copy_statements(columns, source, target)
+    if clear_source:
+        statements += _clear_statements(columns, source)
+
+    for start in range(0, bounds['max_id'], CARD_VALUE_MIGRATE_BATCH):
+        end = start + CARD_VALUE_MIGRATE_BATCH
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql, (start, end))
+        connection.commit()
+        print(f"{source} -> {target}: 已处理至 card_data.id {min(end, bounds['max_id'])}")
+    return bounds['total']
+
+
+def bench(connection, card_count):
+    """按各布局读取最近有数据的流转卡的全部字段，返回 {布局: 统计}"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT card_id FROM card_data
+            GROUP BY card_id
+            ORDER BY card_id DESC
+            LIMIT %s
+        """, (card_count,))
+        card_ids = [row['card_id'] for row in cursor.fetchall()]
+
+    results = {}
+    for storage in VALUE_STORAGES:
+        with connection.cursor() as cursor:
+            columns = _field_columns(cursor, (storage,))
+            select_list = ', '.join([_ROW_META_SELECT] + [value_select(column, 'cd', storage) for column in columns])
+            rows = cells = 0
+            started = time.perf_counter()
+            for card_id in card_ids:
+                cursor.execute(f"""
+                    SELECT {select_list}
+                    FROM card_data cd
+                    WHERE cd.card_id = %s
+                    ORDER BY cd.`row_number`
+                """, (card_id,))
+                for row in cursor.fetchall():
+                    rows += 1
+                    cells += sum(1 for column in columns if row.get(column) not in (None, ''))
+            elapsed = time.perf_counter() - started
+        results[storage] = {
+            'cards': len(card_ids),
+            'rows': rows,
+            'non_empty_cells': cells,
+            'total_ms': round(elapsed * 1000, 1),
+            'ms_per_card': round(elapsed * 1000 / len(card_ids), 2) if card_ids else 0,
+        }
+    return results
+
+
+def storage_status(cursor):
+    """各布局的数据量和表大小（information_schema 中的估算值）"""
+    cursor.execute("""
+        SELECT TABLE_NAME AS table_name, TABLE_ROWS AS table_rows,
+               DATA_LENGTH AS data_length, INDEX_LENGTH AS index_length
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ('card_data', 'card_data_values')
+    """)
+    tables = {row['table_name']: row for row in cursor.fetchall()}
+    cursor.execute(f"SELECT COUNT(*) AS total FROM card_data WHERE `{JSON_COLUMN}` IS NOT NULL")
+    json_rows = cursor.fetchone()['total']
+    return {'storage': CARD_VALUE_STORAGE, 'tables': tables, 'json_rows': json_rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='流转卡字段值存储布局迁移与对比')
+    parser.add_argument('command', choices=('status', 'migrate', 'bench'))
+    parser.add_argument('--from', dest='source', choices=VALUE_STORAGES, default=CARD_VALUE_STORAGE,
+                        help='源布局（默认为 CARD_VALUE_STORAGE）')
+    parser.add_argument('--to', dest='target', choices=VALUE_STORAGES, help='目标布局（migrate）')
+    parser.add_argument('--clear-source', action='store_true', help='复制后清空源布局中的字段值')
+    parser.add_argument('--cards', type=int, default=50, help='bench 读取的流转卡数')
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate' and not args.target:
+        parser.error('migrate 需要 --to')
+
+    connection = db_pool.get_connection()
+    try:
+        if args.command == 'status':
+            with connection.cursor() as cursor:
+                status = storage_status(cursor)
+            print(f"当前布局: {status['storage']}")
+            for name, table in status['tables'].items():
+                size_mb = (int(table['data_length'] or 0) + int(table['index_length'] or 0)) / 1024 / 1024
+                print(f"{name}: 约 {int(table['table_rows'] or 0)} 行, {size_mb:.1f} MB（数据+索引）")
+            print(f"card_data 中有 JSON 字段值的行: {status['json_rows']}")
+        elif args.command == 'migrate':
+            total = migrate(connection, args.source, args.target, args.clear_source)
+            print(f"共处理 {total} 行，切换布局请设置 CARD_VALUE_STORAGE={args.target} 并重启服务")
+        else:
+            for storage, result in bench(connection, args.cards).items():
+                print(f"{storage}: {result['cards']} 张流转卡, {result['rows']} 行, "
+                      f"{result['non_empty_cells']} 个非空单元格, {result['total_ms']} ms "
+                      f"（{result['ms_per_card']} ms/张）")
+        return 0
+    except Exception as e:
+        connection.rollback()
+        print(f"字段值存储维护失败: {e}")
+        return 1
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+变更令牌（ETag / If-None-Match）
+为轮询的列表和统计接口生成廉价的变更令牌，数据未变化时直接返回 304，
+不再执行查询和 JSON 序列化
+
+令牌由以下部分组成：
+- 进程内写入版本号：本进程处理的写请求成功后递增
+- 数据库标记：change_sequences 中的变更序号和当前日期，用于感知其他进程的修改，
+  短时间缓存，本进程写入后立即失效
+- 请求路径、查询参数和用户可见范围（角色、部门、用户）
+
+只有修改列表上可见的流转卡状态的处理函数才递增变更序号：发布流转卡事件时
+（event_hub.publish_card_event）以及删除流转卡、设置流转顺序、修改模板之后调用 bump_version，
+用处理函数自己的连接在业务事务提交之后递增。读到新序号的进程一定能读到对应的修改；
+提交之后、递增之前生成的令牌最多让客户端多取一次完整响应。标记只是一次主键查询，不扫描 transfer_cards。
+不经过 HTTP 写请求修改流转卡的工具（如 card_counters --repair）调用 bump_change_sequence
+"""
+
+import hashlib
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import request, current_app, make_response
+
+import db_pool
+from user_context import get_current_user_info
+
+# 数据库标记缓存秒数
+CHANGE_TOKEN_DB_TTL = float(os.getenv('CHANGE_TOKEN_DB_TTL', 2))
+
+# change_sequences 中流转卡相关修改使用的序号名称
+CHANGE_SEQUENCE_NAME = 'cards'
+
+
+def bump_change_sequence(cursor):
+    """在当前事务中递增变更序号（序号行不存在时创建）"""
+    cursor.execute("""
+        INSERT INTO change_sequences (name, seq) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE seq = seq + 1
+    """, (CHANGE_SEQUENCE_NAME,))
+
+
+class ChangeTracker:
+    """进程内写入版本号与数据库标记缓存"""
+
+    def __init__(self, db_ttl=CHANGE_TOKEN_DB_TTL):
+        self.db_ttl = db_ttl
+        self._lock = threading.Lock()
+        self._version = 0
+        self._marker = None
+        self._marker_expires_at = 0
+        self._not_modified = 0
+        self._modified = 0
+
+    def bump(self):
+        """写入成功后递增版本号并丢弃缓存的数据库标记"""
+        with self._lock:
+            self._version += 1
+            self._marker = None
+
+    def _load_marker(self):
+        connection = db_pool.get_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT (SELECT seq FROM change_sequences WHERE name = %s) AS seq,
+                           CURDATE() AS db_date
+                """, (CHANGE_SEQUENCE_NAME,))
+                row = cursor.fetchone()
+        finally:
+            connection.close()
+        # 日期变化时“今日”类统计也会变化
+        return f"{row['seq'] or 0}|{row['db_date']}"
+
+    def current(self):
+        """返回 (写入版本号, 数据库标记)"""
+        now = time.monotonic()
+        with self._lock:
+            version = self._version
+            if self._marker is not None and self._marker_expires_at > now:
+                return version, self._marker
+
+        marker = self._load_marker()
+        with self._lock:
+            # 加载期间有写入时不缓存，下次重新加载
+            if self._version == version:
+                self._marker = marker
+                self._marker_expires_at = now + self.db_ttl
+        return version, marker
+
+    def record(self, not_modified):
+        with self._lock:
+            if not_modified:
+                self._not_modified += 1
+            else:
+                self._modified += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'version': self._version,
+                'db_ttl': self.db_ttl,
+                'not_modified': self._not_modified,
+                'modified': self._modified,
+            }
+
+
+_tracker = ChangeTracker()
+
+
+def bump_version(connection):
+    """
+    标记流转卡数据已修改（在业务事务提交之后调用）
+
+    递增进程内版本号，并用调用方的连接递增数据库变更序号通知其他进程
+    """
+    _tracker.bump()
+    try:
+        with connection.cursor() as cursor:
+            bump_change_sequence(cursor)
+        connection.commit()
+    except Exception as e:
+        print(f"递增变更序号失败: {e}")
+
+
+def compute_etag(user):
+    """根据当前请求和用户可见范围生成 ETag"""
+    version, marker = _tracker.current()
+    if user['role'] == 'admin':
+        scope = 'admin'
+    else:
+        scope = f"{user['role']}:{user.get('department_id')}:{user['id']}"
+    raw = '|'.join([
+        request.path,
+        request.query_string.decode('utf-8', 'replace'),
+        scope,
+        str(version),
+        marker,
+    ])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def conditional_get(view):
+    """
+    为 GET 接口增加 ETag / If-None-Match 支持（放在 jwt_required 之后）
+
+    令牌未变化时返回 304，不执行被装饰的处理函数
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user = get_current_user_info()
+        if not user or request.method != 'GET':
+            return view(*args, **kwargs)
+
+        try:
+            etag = compute_etag(user)
+        except Exception as e:
+            print(f"生成变更令牌失败: {e}")
+            return view(*args, **kwargs)
+
+        # 同一令牌对应未压缩、gzip 和 br 多种编码的响应，使用弱 ETag 和弱比较
+        if request.if_none_match.contains_weak(etag):
+            _tracker.record(not_modified=True)
+            response = current_app.response_class(status=304)
+        else:
+            _tracker.record(not_modified=False)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag, weak=True)
+        # 每次都向服务端校验，不同用户的响应不能互相复用
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Authorization')
+        return response
+
+    return wrapper
+
+
+def get_change_token_stats():
+    """变更令牌统计"""
+    return _tracker.get_stats()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应压缩
+按客户端的 Accept-Encoding 选择 brotli 或 gzip 压缩响应体，通过 init_compression(app)
+注册为 after_request 中间件，对 app.py 和各蓝图的接口统一生效：
+
+- 已缓冲的响应小于 COMPRESS_MIN_SIZE 字节时不压缩
+- 流式响应（如 ?stream=1 的流转卡数据）逐块压缩并立即刷新
+- SSE（text/event-stream）、文件下载、已编码和 no-transform 的响应不压缩
+- 压缩后的响应带强 ETag 时改为弱 ETag（强校验器必须随 Content-Encoding 不同），
+  304 响应同样带 Vary: Accept-Encoding
+- 按接口统计压缩前后的字节数和节省的字节数
+
+brotli 为可选依赖（pip install brotli），未安装时只使用 gzip
+"""
+
+import gzip
+import os
+import threading
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+# gzip 压缩级别（1-9）
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+# brotli 压缩质量（0-11）
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+# 关闭压缩（例如由反向代理负责压缩时）
+COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+
+# 需要压缩的内容类型
+COMPRESS_MIMETYPES = frozenset(
+    os.getenv('COMPRESS_MIMETYPES',
+              'application/json,text/html,text/css,text/plain,application/javascript,text/javascript')
+    .split(','))
+
+# 优先使用的编码顺序
+_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(request):
+    """从 Accept-Encoding 中选择服务端支持且客户端接受的编码，没有时返回 None"""
+    accepted = request.accept_encodings
+    best = None
+    best_quality = 0
+    for encoding in _ENCODINGS:
+        quality = accepted[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_bytes(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+
+
+class _StreamCompressor:
+    """流式压缩：每块数据压缩后立即刷新，保证客户端能及时收到"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            # wbits=31 输出 gzip 格式
+            self._compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class CompressionStats:
+    """按接口统计压缩效果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, original, compressed):
+        with self._lock:
+            item = self._endpoints.get(endpoint)
+            if item is None:
+                item = self._endpoints[endpoint] = {
+                    'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'bytes_saved': 0}
+            item['responses'] += 1
+            item['bytes_in'] += original
+            item['bytes_out'] += compressed
+            item['bytes_saved'] += original - compressed
+
+    def get_stats(self):
+        with self._lock:
+            endpoints = {name: dict(item) for name, item in self._endpoints.items()}
+        return {
+            'enabled': COMPRESS_ENABLED,
+            'encodings': list(_ENCODINGS),
+            'min_size': COMPRESS_MIN_SIZE,
+            'level': COMPRESS_LEVEL,
+            'brotli_quality': COMPRESS_BROTLI_QUALITY if brotli is not None else None,
+            'bytes_saved': sum(item['bytes_saved'] for item in endpoints.values()),
+            'endpoints': endpoints,
+        }
+
+
+_stats = CompressionStats()
+
+
+def _compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    if 'no-transform' in response.headers.get('Cache-Control', ''):
+        return False
+    return response.mimetype in COMPRESS_MIMETYPES
+
+
+def _compress_stream(iterable, encoding, endpoint):
+    compressor = _StreamCompressor(encoding)
+    original = 0
+    compressed = 0
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue
+            original += len(chunk)
+            data = compressor.compress(chunk)
+            compressed += len(data)
+            if data:
+                yield data
+        data = compressor.finish()
+        compressed += len(data)
+        yield data
+        _stats.record(endpoint, original, compressed)
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(request, response):
+    """按 Accept-Encoding 压缩响应，不满足条件时原样返回"""
+    if not COMPRESS_ENABLED:
+        return response
+    if response.status_code == 304:
+        # 304 与完整响应的 Vary 一致，缓存才能按编码区分
+        response.vary.add('Accept-Encoding')
+        return response
+    if not _compressible(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request)
+    if encoding is None:
+        return response
+
+    endpoint = request.endpoint or request.path
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding, endpoint)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        compressed = compress_bytes(data, encoding)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+        _stats.record(endpoint, len(data), len(compressed))
+
+    response.headers['Content-Encoding'] = encoding
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        response.set_etag(tag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """注册响应压缩中间件"""
+    @app.after_request
+    def compress_after_request(response):
+        return compress_response(request, response)
+
+    return app
+
+
+def get_compression_stats():
+    """响应压缩统计"""
+    return _stats.get_stats()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工作台统计
+一条条件聚合查询计算进行中、今日创建、本周创建和总数，日期条件使用 created_at 的
+范围比较（不再对每行计算 DATE() / YEARWEEK()），非管理员的可见范围用 EXISTS 判断，
+不再 JOIN template_field_permissions 后 COUNT(DISTINCT)
+
+趋势（*Trend / *Change）读取 card_daily_stats 中最近两周的汇总行（见 card_stats_rollup），
+与今天的实时计数比较，查询成本与历史数据量无关：
+- pending：今天启动减去完成、驳回、取消的净变化，相对今天开始时进行中的数量
+- completed：今日创建与昨日创建比较
+- weekly：本周创建与上周同期（周一到上周的今天）比较
+- total：最近 7 天创建数相对 7 天前的总数
+
+结果按用户可见范围短时间缓存，创建流转卡和流转卡状态变化时失效
+"""
+
+import os
+
+from cache_utils import TTLCache
+from card_stats_rollup import ensure_rollup_thread
+
+# 统计结果缓存秒数
+DASHBOARD_STATS_TTL = float(os.getenv('DASHBOARD_STATS_TTL', 5))
+
+# 使统计失效的事件（创建流转卡、数据或状态修改、流转状态变化）
+INVALIDATING_EVENTS = frozenset(('card-created', 'card-updated', 'flow-advanced'))
+
+_stats_cache = TTLCache(ttl=DASHBOARD_STATS_TTL, maxsize=1024)
+
+
+def _scope_key(user):
+    """
+    缓存键：管理员共享一份；普通用户按（角色，部门）区分，
+    可见范围还包含本人创建的流转卡，所以同时带上用户ID
+    """
+    if user['role'] == 'admin':
+        return ('admin',)
+    return (user['role'], user.get('department_id'), user['id'])
+
+
+def query_dashboard_counts(cursor, user):
+    """一次扫描计算工作台的四个计数"""
+    where_sql = ''
+    params = []
+    if user['role'] != 'admin':
+        # 普通用户只统计有权限访问（本部门有模板字段权限）或本人创建的流转卡
+        where_sql = """
+            WHERE (tc.created_by = %s OR EXISTS (
+                SELECT 1 FROM template_field_permissions tfp
+                WHERE tfp.template_id = tc.template_id AND tfp.department_id = %s
+            ))
+        """
+        params = [user['id'], user.get('department_id')]
+
+    cursor.execute(f"""
+        SELECT
+            COUNT(CASE WHEN tc.status = 'in_progress' THEN 1 END) AS in_progress_count,
+            COUNT(CASE WHEN tc.created_at >= b.today AND tc.created_at < b.tomorrow THEN 1 END)
+                AS today_create_count,
+            COUNT(CASE WHEN tc.created_at >= b.week_start AND tc.created_at < b.next_week THEN 1 END)
+                AS weekly_create_count,
+            COUNT(CASE WHEN tc.status != 'cancelled' THEN 1 END) AS total_count
+        FROM transfer_cards tc
+        CROSS JOIN (
+            SELECT CURDATE() AS today,
+                   CURDATE() + INTERVAL 1 DAY AS tomorrow,
+                   CURDATE() - INTERVAL WEEKDAY(CURDATE()) DAY AS week_start,
+                   CURDATE() - INTERVAL WEEKDAY(CURDATE()) DAY + INTERVAL 7 DAY AS next_week
+        ) b
+        {where_sql}
+    """, params)
+    row = cursor.fetchone() or {}
+    return {
+        'in_progress': int(row.get('in_progress_count') or 0),
+        'today_created': int(row.get('today_create_count') or 0),
+        'weekly_created': int(row.get('weekly_create_count') or 0),
+        'total': int(row.get('total_count') or 0),
+    }
+
+
+def query_dashboard_trends(cursor, user):
+    """从每日统计汇总表读取计算趋势所需的合计（只扫描上周一到今天的汇总行）"""
+    where_sql = ''
+    params = []
+    if user['role'] != 'admin':
+        # 汇总表按模板统计，普通用户只统计本部门有字段权限的模板
+        where_sql = """
+            AND s.template_id IN (
+                SELECT tfp.template_id FROM template_field_permissions tfp
+                WHERE tfp.department_id = %s
+            )
+        """
+        params = [user.get('department_id')]
+
+    cursor.execute(f"""
+        SELECT
+            SUM(CASE WHEN s.stat_date = b.today THEN
+                    s.started_count - s.completed_count - s.rejected_count - s.cancelled_count END)
+                AS today_net_pending,
+            SUM(CASE WHEN s.stat_date = b.today - INTERVAL 1 DAY THEN s.created_count END)
+                AS yesterday_created,
+            SUM(CASE WHEN s.stat_date >= b.last_week_start AND s.stat_date <= b.today - INTERVAL 7 DAY
+                     THEN s.created_count END) AS last_week_created,
+            SUM(CASE WHEN s.stat_date > b.today - INTERVAL 7 DAY THEN s.created_count END)
+                AS recent_created
+        FROM card_daily_stats s
+        CROSS JOIN (
+            SELECT CURDATE() AS today,
+                   CURDATE() - INTERVAL WEEKDAY(CURDATE()) + 7 DAY AS last_week_start
+        ) b
+        WHERE s.stat_date >= b.last_week_start AND s.stat_date <= b.today
+        {where_sql}
+    """, params)
+    row = cursor.fetchone() or {}
+    return {
+        'today_net_pending': int(row.get('today_net_pending') or 0),
+        'yesterday_created': int(row.get('yesterday_created') or 0),
+        'last_week_created': int(row.get('last_week_created') or 0),
+        'recent_created': int(row.get('recent_created') or 0),
+    }
+
+
+def _change(current, baseline):
+    """相对基准的变化百分比（取整）；基准为 0 时有增长记为 100"""
+    if baseline <= 0:
+        return 100 if current > baseline else 0
+    return round((current - baseline) * 100 / baseline)
+
+
+def build_dashboard_stats(counts, trends):
+    """组装工作台接口返回的统计数据"""
+    in_progress = counts['in_progress']
+    changes = {
+        'pending': _change(in_progress, in_progress - trends['today_net_pending']),
+        'completed': _change(counts['today_created'], trends['yesterday_created']),
+        'weekly': _change(counts['weekly_created'], trends['last_week_created']),
+        'total': _change(counts['total'], counts['total'] - trends['recent_created']),
+    }
+    stats = {
+        'pendingCards': in_progress,                 # 进行中的流转卡个数
+        'completedToday': counts['today_created'],   # 今日创建数量
+        'weeklyTotal': counts['weekly_created'],     # 本周创建数量
+        'totalCards': counts['total'],               # 非取消状态的流转卡总数
+    }
+    for name, change in changes.items():
+        stats[f'{name}Trend'] = 'up' if change >= 0 else 'down'
+        stats[f'{name}Change'] = change
+    return stats
+
+
+def load_dashboard_stats(cursor, user):
+    """
+    获取工作台计数和趋势（带短时间缓存）
+
+    汇总由后台线程执行（ensure_rollup_thread），请求中不执行汇总
+    """
+    ensure_rollup_thread()
+    key = _scope_key(user)
+    stats = _stats_cache.get(key)
+    if stats is None:
+        counts = query_dashboard_counts(cursor, user)
+        try:
+            trends = query_dashboard_trends(cursor, user)
+        except Exception as e:
+            # 汇总表尚未创建（未执行迁移）时趋势按无变化处理
+            print(f"读取每日统计汇总失败: {e}")
+            trends = {'today_net_pending': 0, 'yesterday_created': 0,
+                      'last_week_created': 0, 'recent_created': 0}
+        stats = build_dashboard_stats(counts, trends)
+        _stats_cache.set(key, stats)
+    return dict(stats)
+
+
+def invalidate_dashboard_stats(event=None):
+    """清除统计缓存；作为事件监听器时只响应创建和状态变化事件"""
+    if event is not None and event.type not in INVALIDATING_EVENTS:
+        return
+    _stats_cache.clear()
+
+
+def get_dashboard_cache_stats():
+    """工作台统计缓存统计"""
+    return _stats_cache.get_stats()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库连接池
+进程级共享的 PyMySQL 连接池，供 app.py、flow_api.py 和 FlowManager 共用
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import pymysql
+
+# 连接池相关的配置项（从数据库配置中剔除，不传给 pymysql.connect）
+POOL_OPTION_KEYS = (
+    'connection_pool_size',
+    'pool_max_overflow',
+    'pool_timeout',
+    'pool_recycle',
+    'pool_idle_timeout',
+    'pool_ping_interval',
+)
+
+
+# 可自动重试的 MySQL 错误：死锁、锁等待超时
+RETRYABLE_ERROR_CODES = {
+    1213: 'deadlocks',
+    1205: 'lock_wait_timeouts',
+}
+
+ISOLATION_LEVELS = ('READ UNCOMMITTED', 'READ COMMITTED', 'REPEATABLE READ', 'SERIALIZABLE')
+
+# 事务重试次数与退避时间（秒）
+TRANSACTION_MAX_RETRIES = int(os.getenv('TRANSACTION_MAX_RETRIES', 3))
+TRANSACTION_RETRY_DELAY = float(os.getenv('TRANSACTION_RETRY_DELAY', 0.05))
+TRANSACTION_RETRY_MAX_DELAY = float(os.getenv('TRANSACTION_RETRY_MAX_DELAY', 1.0))
+
+
+class PoolExhaustedError(Exception):
+    """等待空闲连接超时"""
+    pass
+
+
+class PooledConnection:
+    """
+    连接池中借出的连接
+
+    行为与 pymysql 连接一致，区别在于 close() 会把连接归还连接池而不是断开，
+    因此现有处理函数中的 connection.close() / with 语句无需修改。
+    """
+
+    def __init__(self, pool, raw_connection, created_at):
+        self._pool = pool
+        self._raw = raw_connection
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """归还连接到连接池（可重复调用）"""
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._created_at)
+
+
+class ConnectionPool:
+    """
+    线程安全的连接池
+
+    - pool_size: 常驻连接数上限
+    - max_overflow: 高峰期允许额外创建的连接数（归还时直接关闭）
+    - timeout: 连接耗尽时的最长等待秒数
+    - recycle: 连接最长存活秒数，超过后重建
+    - idle_timeout: 空闲超过该秒数的连接被淘汰
+    - ping_interval: 空闲超过该秒数的连接在借出前先做健康检查
+    """
+
+    def __init__(self, db_config, pool_size=10, max_overflow=5, timeout=10,
+                 recycle=3600, idle_timeout=600, ping_interval=30):
+        self.db_config = {k: v for k, v in db_config.items() if k not in POOL_OPTION_KEYS}
+        self.pool_size = max(1, int(pool_size))
+        self.max_overflow = max(0, int(max_overflow))
+        self.timeout = timeout
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+
+        self._lock = threading.Condition()
+        # 空闲连接: (raw_connection, created_at, last_used_at)
+        self._idle = deque()
+        self._total = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._timeouts = 0
+
+    def _connect(self):
+        return pymysql.connect(**self.db_config)
+
+    def _discard(self, raw_connection):
+        try:
+            raw_connection.close()
+        except Exception:
+            pass
+
+    def _is_stale(self, created_at, last_used_at, now):
+        if self.recycle and now - created_at > self.recycle:
+            return True
+        if self.idle_timeout and now - last_used_at > self.idle_timeout:
+            return True
+        return False
+
+    def get_connection(self):
+        """从连接池借出一个连接"""
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+
+        while True:
+            with self._lock:
+                candidate = None
+                while self._idle:
+                    raw, created_at, last_used_at = self._idle.pop()
+                    if self._is_stale(created_at, last_used_at, time.monotonic()):
+                        self._total -= 1
+                        self._recycled += 1
+                        self._discard(raw)
+                        continue
+                    candidate = (raw, created_at, last_used_at)
+                    break
+
+                if candidate is None:
+                    if self._total < self.pool_size + self.max_overflow:
+                        # 先占位，在锁外建立连接
+                        self._total += 1
+                        self._in_use += 1
+                        create_new = True
+                    else:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolExhaustedError(
+                                f"等待数据库连接超时（连接池大小 {self.pool_size}+{self.max_overflow}）")
+                        self._waiting += 1
+                        try:
+                            self._lock.wait(remaining)
+                        finally:
+                            self._waiting -= 1
+                        continue
+                else:
+                    self._in_use += 1
+                    create_new = False
+
+            if create_new:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._total -= 1
+                        self._in_use -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._created += 1
+                return PooledConnection(self, raw, time.monotonic())
+
+            raw, created_at, last_used_at = candidate
+            # 长时间空闲的连接借出前先做健康检查
+            if self.ping_interval is not None and time.monotonic() - last_used_at >= self.ping_interval:
+                try:
+                    raw.ping(reconnect=False)
+                except Exception:
+                    with self._lock:
+                        self._total -= 1
+                        self._in_use -= 1
+                        self._ping_failures += 1
+                        self._recycled += 1
+                        self._lock.notify()
+                    self._discard(raw)
+                    continue
+            return PooledConnection(self, raw, created_at)
+
+    def _release(self, raw_connection, created_at):
+        """归还连接：回滚未提交的事务后放回空闲队列"""
+        reusable = bool(getattr(raw_connection, 'open', False))
+        if reusable:
+            try:
+                raw_connection.rollback()
+            except Exception:
+                reusable = False
+
+        now = time.monotonic()
+        with self._lock:
+            self._in_use -= 1
+            overflow = len(self._idle) >= self.pool_size
+            if reusable and not overflow and not (self.recycle and now - created_at > self.recycle):
+                self._idle.append((raw_connection, created_at, now))
+            else:
+                self._total -= 1
+                if reusable:
+                    self._recycled += 1
+                self._discard(raw_connection)
+            self._lock.notify()
+
+    def evict_idle(self):
+        """主动淘汰过期的空闲连接，返回淘汰数量"""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            kept = deque()
+            for item in self._idle:
+                if self._is_stale(item[1], item[2], now):
+                    evicted.append(item[0])
+                else:
+                    kept.append(item)
+            self._idle = kept
+            self._total -= len(evicted)
+            self._recycled += len(evicted)
+        for raw in evicted:
+            self._discard(raw)
+        return len(evicted)
+
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接归还时按正常流程处理）"""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+        for raw, _, _ in idle:
+            self._discard(raw)
+
+    def get_stats(self):
+        """连接池统计信息，用于容量评估"""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'total': self._total,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'created': self._created,
+                'recycled': self._recycled,
+                'ping_failures': self._ping_failures,
+                'timeouts': self._timeouts,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_pool(db_config):
+    """根据数据库配置初始化进程级连接池（只在首次调用时生效）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                db_config,
+                pool_size=db_config.get('connection_pool_size', 10),
+                max_overflow=db_config.get('pool_max_overflow', 5),
+                timeout=db_config.get('pool_timeout', 10),
+                recycle=db_config.get('pool_recycle', 3600),
+                idle_timeout=db_config.get('pool_idle_timeout', 600),
+                ping_interval=db_config.get('pool_ping_interval', 30),
+            )
+        return _pool
+
+
+def get_pool():
+    """获取进程级连接池，未初始化时使用 config/config.json 中的数据库配置"""
+    if _pool is None:
+        from config.config import get_db_config
+        db_config = get_db_config()
+        db_config['cursorclass'] = pymysql.cursors.DictCursor
+        init_pool(db_config)
+    return _pool
+
+
+def get_connection():
+    """从共享连接池借出连接，使用完毕后调用 close() 归还"""
+    return get_pool().get_connection()
+
+
+def get_pool_stats():
+    """获取共享连接池的统计信息"""
+    return get_pool().get_stats()
+
+
+class TransactionStats:
+    """事务重试统计（进程级）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            'transactions': 0,
+            'retried_transactions': 0,
+            'retries': 0,
+            'deadlocks': 0,
+            'lock_wait_timeouts': 0,
+            'gave_up': 0,
+        }
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['max_retries'] = TRANSACTION_MAX_RETRIES
+        return stats
+
+
+_transaction_stats = TransactionStats()
+
+
+def _retryable_error(error):
+    """返回可重试错误对应的统计项名称，不可重试时返回 None"""
+    if isinstance(error, pymysql.err.OperationalError) and error.args:
+        return RETRYABLE_ERROR_CODES.get(error.args[0])
+    return None
+
+
+def run_in_transaction(connection, work, isolation_level=None, max_retries=None):
+    """
+    在事务中执行 work(cursor)，遇到死锁或锁等待超时时回滚并自动重试
+
+    - isolation_level: 本事务的隔离级别（在 BEGIN 之前设置），None 表示使用会话默认值
+    - max_retries: 最大重试次数，默认 TRANSACTION_MAX_RETRIES
+    work 正常返回后提交事务；抛出异常时回滚，可重试的错误在退避后重新执行整个 work。
+    返回 (work 的返回值, 重试次数)
+    """
+    if isolation_level is not None:
+        isolation_level = isolation_level.upper()
+        if isolation_level not in ISOLATION_LEVELS:
+            raise ValueError(f'不支持的事务隔离级别: {isolation_level}')
+    if max_retries is None:
+        max_retries = TRANSACTION_MAX_RETRIES
+
+    _transaction_stats.incr('transactions')
+    retries = 0
+    while True:
+        try:
+            with connection.cursor() as cursor:
+                if isolation_level is not None:
+                    cursor.execute(f"SET TRANSACTION ISOLATION LEVEL {isolation_level}")
+                connection.begin()
+                result = work(cursor)
+            connection.commit()
+            return result, retries
+        except Exception as e:
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+
+            error_kind = _retryable_error(e)
+            if error_kind is None:
+                raise
+            _transaction_stats.incr(error_kind)
+            if retries >= max_retries:
+                _transaction_stats.incr('gave_up')
+                raise
+
+            if retries == 0:
+                _transaction_stats.incr('retried_transactions')
+            retries += 1
+            _transaction_stats.incr('retries')
+
+            # 指数退避加随机抖动，避免冲突双方同时重试再次冲突
+            delay = min(TRANSACTION_RETRY_MAX_DELAY, TRANSACTION_RETRY_DELAY * (2 ** (retries - 1)))
+            print(f"事务冲突（{e.args[0]}），{delay:.3f}s 后第 {retries} 次重试")
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def get_transaction_stats():
+    """获取事务重试统计"""
+    return _transaction_stats.get_stats()
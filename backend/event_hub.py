@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实时事件推送
+进程内的发布/订阅中心，通过 SSE（/api/stream）把流转卡变更推送给前端，
+替代定时轮询。事件只携带流转卡ID等少量信息，前端收到后再按需刷新数据。
+
+事件类型：
+- card-created: 创建流转卡
+- card-updated: 流转卡数据或状态被修改
+- row-saved: 保存了流转卡数据行
+- flow-advanced: 流转状态变化（启动、提交、完成、驳回、重启）
+
+订阅者按角色和部门过滤：管理员接收全部事件，其他用户接收在流转卡列表中
+对其可见的流转卡（见 card_list.build_visibility_filter）以及流转到本部门的流转卡的事件。
+注意：订阅中心是进程内的，多进程部署时只能收到本进程发布的事件。
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from change_tokens import bump_version
+
+# 单个订阅者的事件队列长度，队列满时丢弃最旧的事件
+SSE_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', 100))
+# 同时在线的订阅数上限
+SSE_MAX_SUBSCRIBERS = int(os.getenv('SSE_MAX_SUBSCRIBERS', 200))
+# 心跳间隔（秒），防止代理断开空闲连接
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', 15))
+# 断线重连时可补发的最近事件数
+SSE_REPLAY_SIZE = int(os.getenv('SSE_REPLAY_SIZE', 256))
+
+
+class TooManySubscribers(Exception):
+    """订阅数已达上限"""
+    pass
+
+
+class Event:
+    """一条待推送的事件及其接收范围"""
+
+    __slots__ = ('id', 'type', 'data', 'departments', 'users')
+
+    def __init__(self, event_id, event_type, data, departments=None, users=None):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+        # None 表示不限部门
+        self.departments = None if departments is None else frozenset(departments)
+        self.users = frozenset(users or ())
+
+    def visible_to(self, user):
+        if user.get('role') == 'admin':
+            return True
+        if self.departments is None:
+            return True
+        if user.get('id') in self.users:
+            return True
+        return user.get('department_id') in self.departments
+
+    def encode(self):
+        payload = json.dumps(self.data, ensure_ascii=False, default=str)
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n"
+
+
+class Subscription:
+    """一个 SSE 连接的订阅"""
+
+    def __init__(self, hub, user):
+        self.hub = hub
+        self.user = user
+        self.queue = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.dropped = 0
+
+    def offer(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    """进程内发布/订阅中心"""
+
+    def __init__(self, max_subscribers=SSE_MAX_SUBSCRIBERS, replay_size=SSE_REPLAY_SIZE):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._listeners = []
+        self._recent = deque(maxlen=replay_size)
+        self._next_id = 1
+        self._published = 0
+        self._delivered = 0
+
+    def subscribe(self, user, last_event_id=None):
+        """注册订阅者；提供 last_event_id 时补发之后的最近事件"""
+        subscription = Subscription(self, user)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers(f'实时推送连接数已达上限（{self.max_subscribers}）')
+            self._subscribers.add(subscription)
+            if last_event_id is not None:
+                for event in self._recent:
+                    if event.id > last_event_id and event.visible_to(user):
+                        subscription.offer(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def add_listener(self, callback):
+        """注册进程内监听器（如缓存失效），每个事件发布后以 callback(event) 调用"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def publish(self, event_type, data, departments=None, users=None):
+        """发布事件（不阻塞，订阅者队列满时丢弃其最旧的事件）"""
+        with self._lock:
+            event = Event(self._next_id, event_type, data, departments, users)
+            self._next_id += 1
+            self._recent.append(event)
+            self._published += 1
+            subscribers = [s for s in self._subscribers if event.visible_to(s.user)]
+            self._delivered += len(subscribers)
+            listeners = list(self._listeners)
+        for subscription in subscribers:
+            subscription.offer(event)
+        for callback in listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"实时事件监听器执行失败: {e}")
+        return event
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'max_subscribers': self.max_subscribers,
+                'published': self._published,
+                'delivered': self._delivered,
+                'dropped': sum(s.dropped for s in self._subscribers),
+                'last_event_id': self._next_id - 1,
+            }
+
+
+_hub = EventHub()
+
+
+def get_hub():
+    return _hub
+
+
+def card_audience(cursor, card_id):
+    """
+    查询流转卡事件的接收范围
+
+    返回 (部门集合, 用户集合)，部门集合为 None 表示所有用户。与流转卡列表的可见范围一致
+    （card_list.build_visibility_filter）：模板未配置字段权限时所有用户可见，否则为有字段权限的部门
+    和创建者；另外加上当前部门和流转步骤中的部门（待处理列表）。
+    状态不参与判断：流转卡变为取消等状态时，列表中原本能看到它的用户也要刷新
+    """
+    cursor.execute("""
+        SELECT tc.created_by, tc.current_department_id, COALESCE(ts.template_id, t.id) AS template_id
+        FROM transfer_cards tc
+        LEFT JOIN template_snapshots ts ON tc.snapshot_id = ts.snapshot_id
+        LEFT JOIN templates t ON tc.template_id = t.id
+        WHERE tc.id = %s
+    """, (card_id,))
+    card = cursor.fetchone()
+    if not card:
+        return set(), set()
+
+    permission_departments = set()
+    if card['template_id'] is not None:
+        cursor.execute("""
+            SELECT DISTINCT department_id FROM template_field_permissions
+            WHERE template_id = %s
+        """, (card['template_id'],))
+        permission_departments = {row['department_id'] for row in cursor.fetchall()}
+    if not permission_departments:
+        return None, {card['created_by']}
+
+    cursor.execute("SELECT department_id FROM card_flow_status WHERE card_id = %s", (card_id,))
+    departments = permission_departments | {row['department_id'] for row in cursor.fetchall()}
+    if card['current_department_id'] is not None:
+        departments.add(card['current_department_id'])
+    return departments, {card['created_by']}
+
+
+def publish_card_event(connection, event_type, card_id, **data):
+    """
+    发布与流转卡相关的事件（在事务提交之后调用）
+
+    同时递增变更令牌（见 change_tokens.bump_version）。推送失败不影响业务请求
+    """
+    bump_version(connection)
+    try:
+        with connection.cursor() as cursor:
+            departments, users = card_audience(cursor, card_id)
+        data['card_id'] = card_id
+        data['timestamp'] = time.time()
+        _hub.publish(event_type, data, departments=departments, users=users)
+    except Exception as e:
+        print(f"发布实时事件失败: {e}")
+
+
+def stream_events(subscription, heartbeat=SSE_HEARTBEAT_INTERVAL):
+    """生成 SSE 数据流，连接断开时自动取消订阅"""
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            event = subscription.get(timeout=heartbeat)
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield event.encode()
+    finally:
+        subscription.close()
+
+
+def get_event_hub_stats():
+    """实时推送统计"""
+    return _hub.get_stats()
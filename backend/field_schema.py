@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流转卡字段结构缓存
+按（流转卡，部门）编译字段配置：有序列名、可读/可写位图和字段类型，
+首次访问时查询一次并解析 GROUP_CONCAT 权限，之后直接使用编译结果
+
+- 共享模板快照（template_snapshot_fields / template_snapshot_permissions，见 template_snapshots）
+  不可变，按（快照，部门）缓存，引用同一快照的流转卡共用编译结果
+- 旧流转卡的逐卡快照（card_template_fields / card_field_permissions）创建后不再修改，
+  按（流转卡，部门）缓存；两类快照都按 LRU 淘汰，TTL 只用于兜底库外修改
+- 没有快照的旧流转卡回退到模板配置，按（模板，部门）缓存，
+  模板字段和权限接口修改后主动失效
+"""
+
+import os
+
+from cache_utils import TTLCache
+from card_values import CARD_VALUE_STORAGE, value_select
+from permission_cache import load_field_types
+
+# 缓存条目数上限（超出时淘汰最久未使用的条目）
+FIELD_SCHEMA_CACHE_SIZE = int(os.getenv('FIELD_SCHEMA_CACHE_SIZE', 2048))
+# 流转卡快照字段结构缓存秒数
+FIELD_SCHEMA_CARD_TTL = int(os.getenv('FIELD_SCHEMA_CARD_TTL', 3600))
+# 模板字段结构缓存秒数
+FIELD_SCHEMA_TEMPLATE_TTL = int(os.getenv('FIELD_SCHEMA_TEMPLATE_TTL', 60))
+
+# 流转卡没有快照、需回退到模板时在流转卡缓存中记录的标记
+_USE_TEMPLATE = 'template'
+# 共享快照没有字段内容（旧数据中只记录了名称的快照）时在快照缓存中记录的标记
+_EMPTY_SNAPSHOT = 'empty'
+
+# 读取 card_data 时始终选取的系统列（字段值列按用户可读字段投影）
+CARD_DATA_META_COLUMNS = (
+    'row_number', 'department_id', 'status', 'submitted_by', 'submitted_at',
+    'version', 'last_updated_by', 'last_updated_at',
+)
+
+_card_schema_cache = TTLCache(ttl=FIELD_SCHEMA_CARD_TTL, maxsize=FIELD_SCHEMA_CACHE_SIZE)
+_snapshot_schema_cache = TTLCache(ttl=FIELD_SCHEMA_CARD_TTL, maxsize=FIELD_SCHEMA_CACHE_SIZE)
+_template_schema_cache = TTLCache(ttl=FIELD_SCHEMA_TEMPLATE_TTL, maxsize=FIELD_SCHEMA_CACHE_SIZE)
+_card_data_columns_cache = TTLCache(ttl=FIELD_SCHEMA_CARD_TTL, maxsize=1)
+
+
+def _any_flag(value):
+    """GROUP_CONCAT 得到的 '0,1' 形式转换为布尔值"""
+    if not value:
+        return False
+    return any(item.strip() == '1' for item in str(value).split(','))
+
+
+def _department_ids(value):
+    if not value:
+        return None
+    return [int(item.strip()) for item in str(value).split(',') if item.strip().isdigit()]
+
+
+class FieldSchema:
+    """编译后的字段结构（只读，多个请求共享）"""
+
+    __slots__ = ('fields', 'columns', 'types', 'read_mask', 'write_mask', 'source')
+
+    def __init__(self, rows, source):
+        fields = []
+        read_mask = 0
+        write_mask = 0
+        for index, row in enumerate(rows):
+            field = dict(row)
+            # 重命名字段以匹配前端期望的格式
+            if 'field_name' in field and 'name' not in field:
+                field['name'] = field['field_name']
+            if 'field_display_name' in field and 'display_name' not in field:
+                field['display_name'] = field['field_display_name']
+            field['can_read'] = _any_flag(field.get('can_read'))
+            field['can_write'] = _any_flag(field.get('can_write'))
+            field['perm_dept_id'] = _department_ids(field.get('perm_dept_id'))
+            if field['can_read']:
+                read_mask |= 1 << index
+            if field['can_write']:
+                write_mask |= 1 << index
+            fields.append(field)
+
+        self.fields = tuple(fields)
+        self.columns = tuple(field['field_name'] for field in fields)
+        self.types = tuple(field.get('field_type') or 'text' for field in fields)
+        self.read_mask = read_mask
+        self.write_mask = write_mask
+        # 'snapshot' 表示共享快照，'card' 表示逐卡快照，'template' 表示回退到模板
+        self.source = source
+
+    def can_read(self, index):
+        return bool(self.read_mask >> index & 1)
+
+    def can_write(self, index):
+        return bool(self.write_mask >> index & 1)
+
+    def field_list(self):
+        """返回字段配置的副本（用于响应）"""
+        return [dict(field) for field in self.fields]
+
+    def readable_columns(self, user):
+        """当前用户可读的列（管理员可读全部）"""
+        if user['role'] == 'admin':
+            return self.columns
+        return tuple(column for index, column in enumerate(self.columns) if self.can_read(index))
+
+
+def _department_key(user):
+    return 'admin' if user['role'] == 'admin' else user.get('department_id')
+
+
+def _query_card_fields(cursor, card_id, department_key):
+    if department_key == 'admin':
+        # 管理员可以看到快照的所有字段
+        cursor.execute("""
+            SELECT ctf.*,
+                   GROUP_CONCAT(DISTINCT cfp.can_read) as can_read,
+                   GROUP_CONCAT(DISTINCT cfp.can_write) as can_write,
+                   GROUP_CONCAT(DISTINCT cfp.department_id) as perm_dept_id
+            FROM card_template_fields ctf
+            LEFT JOIN card_field_permissions cfp ON ctf.field_name = cfp.field_name
+                                                  AND cfp.card_id = %s
+            WHERE ctf.card_id = %s
+            GROUP BY ctf.id
+            ORDER BY ctf.field_order
+        """, (card_id, card_id))
+    else:
+        # 普通用户只看本部门的权限
+        cursor.execute("""
+            SELECT ctf.*,
+                   GROUP_CONCAT(DISTINCT cfp.can_read) as can_read,
+                   GROUP_CONCAT(DISTINCT cfp.can_write) as can_write,
+                   GROUP_CONCAT(DISTINCT cfp.department_id) as perm_dept_id
+            FROM card_template_fields ctf
+            LEFT JOIN card_field_permissions cfp ON ctf.field_name = cfp.field_name
+                                                  AND cfp.card_id = %s
+                                                  AND cfp.department_id = %s
+            WHERE ctf.card_id = %s
+            GROUP BY ctf.id
+            ORDER BY ctf.field_order
+        """, (card_id, department_key, card_id))
+    return cursor.fetchall()
+
+
+def _query_snapshot_fields(cursor, snapshot_id, department_key):
+    if department_key == 'admin':
+        cursor.execute("""
+            SELECT tsf.*,
+                   GROUP_CONCAT(DISTINCT tsp.can_read) as can_read,
+                   GROUP_CONCAT(DISTINCT tsp.can_write) as can_write,
+                   GROUP_CONCAT(DISTINCT tsp.department_id) as perm_dept_id
+            FROM template_snapshot_fields tsf
+            LEFT JOIN template_snapshot_permissions tsp ON tsf.field_name = tsp.field_name
+                                                         AND tsp.snapshot_id = %s
+            WHERE tsf.snapshot_id = %s
+            GROUP BY tsf.id
+            ORDER BY tsf.field_order
+        """, (snapshot_id, snapshot_id))
+    else:
+        cursor.execute("""
+            SELECT tsf.*,
+                   GROUP_CONCAT(DISTINCT tsp.can_read) as can_read,
+                   GROUP_CONCAT(DISTINCT tsp.can_write) as can_write,
+                   GROUP_CONCAT(DISTINCT tsp.department_id) as perm_dept_id
+            FROM template_snapshot_fields tsf
+            LEFT JOIN template_snapshot_permissions tsp ON tsf.field_name = tsp.field_name
+                                                         AND tsp.snapshot_id = %s
+                                                         AND tsp.department_id = %s
+            WHERE tsf.snapshot_id = %s
+            GROUP BY tsf.id
+            ORDER BY tsf.field_order
+        """, (snapshot_id, department_key, snapshot_id))
+    return cursor.fetchall()
+
+
+def _query_template_fields(cursor, template_id, department_key):
+    if department_key == 'admin':
+        cursor.execute("""
+            SELECT tf.*, f.department_name, f.department_id as field_dept_id,
+                   GROUP_CONCAT(DISTINCT tfp.can_read) as can_read,
+                   GROUP_CONCAT(DISTINCT tfp.can_write) as can_write,
+                   GROUP_CONCAT(DISTINCT tfp.department_id) as perm_dept_id
+            FROM template_fields tf
+            LEFT JOIN fields f ON tf.field_id = f.id
+            LEFT JOIN template_field_permissions tfp ON tf.field_name = tfp.field_name
+                                                      AND tfp.template_id = %s
+            WHERE tf.template_id = %s
+            GROUP BY tf.id
+            ORDER BY tf.field_order
+        """, (template_id, template_id))
+    else:
+        cursor.execute("""
+            SELECT tf.*, f.department_name, f.department_id as field_dept_id,
+                   GROUP_CONCAT(DISTINCT tfp.can_read) as can_read,
+                   GROUP_CONCAT(DISTINCT tfp.can_write) as can_write,
+                   GROUP_CONCAT(DISTINCT tfp.department_id) as perm_dept_id
+            FROM template_fields tf
+            LEFT JOIN fields f ON tf.field_id = f.id
+            LEFT JOIN template_field_permissions tfp ON tf.field_name = tfp.field_name
+                                                      AND tfp.template_id = %s
+                                                      AND tfp.department_id = %s
+            WHERE tf.template_id = %s
+            GROUP BY tf.id
+            ORDER BY tf.field_order
+        """, (template_id, department_key, template_id))
+    return cursor.fetchall()
+
+
+def load_template_field_schema(cursor, template_id, user):
+    """获取模板对当前用户部门的字段结构"""
+    department_key = _department_key(user)
+    key = (str(template_id), str(department_key))
+    schema = _template_schema_cache.get(key)
+    if schema is None:
+        schema = FieldSchema(_query_template_fields(cursor, template_id, department_key), 'template')
+        _template_schema_cache.set(key, schema)
+    return schema
+
+
+def load_snapshot_field_schema(cursor, snapshot_id, user):
+    """获取共享快照对当前用户部门的字段结构，快照没有字段内容时返回 None"""
+    department_key = _department_key(user)
+    key = (snapshot_id, str(department_key))
+    schema = _snapshot_schema_cache.get(key)
+    if schema is None:
+        rows = _query_snapshot_fields(cursor, snapshot_id, department_key)
+        schema = FieldSchema(rows, 'snapshot') if rows else _EMPTY_SNAPSHOT
+        _snapshot_schema_cache.set(key, schema)
+    return None if schema is _EMPTY_SNAPSHOT else schema
+
+
+def load_card_field_schema(cursor, card_id, template_id, user, snapshot_id=None):
+    """
+    获取流转卡对当前用户部门的字段结构
+
+    优先使用共享快照，其次是旧流转卡的逐卡快照，都为空时回退到模板（兼容旧数据）
+    """
+    if snapshot_id:
+        schema = load_snapshot_field_schema(cursor, snapshot_id, user)
+        if schema is not None:
+            return schema
+
+    department_key = _department_key(user)
+    key = (int(card_id), str(department_key))
+    schema = _card_schema_cache.get(key)
+    if schema is None:
+        rows = _query_card_fields(cursor, card_id, department_key)
+        schema = FieldSchema(rows, 'card') if rows else _USE_TEMPLATE
+        _card_schema_cache.set(key, schema)
+
+    if schema is _USE_TEMPLATE:
+        if not template_id:
+            return FieldSchema((), 'template')
+        return load_template_field_schema(cursor, template_id, user)
+    return schema
+
+
+def load_card_data_columns(cursor):
+    """card_data 表的实际列名集合（字段配置中可能存在表里没有的列）"""
+    columns = _card_data_columns_cache.get('all')
+    if columns is None:
+        cursor.execute("SHOW COLUMNS FROM card_data")
+        columns = frozenset(row['Field'] for row in cursor.fetchall())
+        _card_data_columns_cache.set('all', columns)
+    return columns
+
+
+def load_value_columns(cursor):
+    """
+    可以保存字段值的字段名集合
+
+    wide 布局为 card_data 的实际列名（字段配置中可能存在表里没有的列），
+    eav / json 布局为 fields 表中定义的字段名（见 card_values）
+    """
+    if CARD_VALUE_STORAGE == 'wide':
+        return load_card_data_columns(cursor)
+    return frozenset(load_field_types(cursor))
+
+
+def build_row_projection(cursor, columns, alias='cd'):
+    """
+    生成读取 card_data 的 SELECT 列表：系统列加上给定的字段值列
+
+    不可读的字段不会从数据库读出，不存在的字段直接忽略（按空值处理）；
+    字段值按 CARD_VALUE_STORAGE 布局读取，列名与宽列相同
+    """
+    existing = load_card_data_columns(cursor)
+    value_columns = load_value_columns(cursor)
+    selected = [f"{alias}.`{column}`" for column in CARD_DATA_META_COLUMNS if column in existing]
+    selected += [value_select(column, alias) for column in dict.fromkeys(columns)
+                 if column in value_columns and column not in CARD_DATA_META_COLUMNS]
+    return ', '.join(selected)
+
+
+def invalidate_template_field_schemas(template_id=None):
+    """模板字段或权限变更后清除模板字段结构缓存（不传模板ID时清空全部）"""
+    if template_id is None:
+        _template_schema_cache.clear()
+    else:
+        _template_schema_cache.invalidate_where(lambda key, _: key[0] == str(template_id))
+
+
+def invalidate_card_field_schemas(card_id):
+    """流转卡删除后清除其字段结构缓存"""
+    _card_schema_cache.invalidate_where(lambda key, _: key[0] == int(card_id))
+
+
+def get_field_schema_cache_stats():
+    """字段结构缓存统计"""
+    return {
+        'snapshots': _snapshot_schema_cache.get_stats(),
+        'cards': _card_schema_cache.get_stats(),
+        'templates': _template_schema_cache.get_stats(),
+    }
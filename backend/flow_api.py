@@ -6,61 +6,34 @@
 """
 
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 import sys
 import os
 from datetime import datetime, timedelta
-import pymysql
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config.config import get_db_config
 from refactor_flow_logic import FlowManager
-
-# 获取数据库配置
-db_config = get_db_config()
-db_config['cursorclass'] = pymysql.cursors.DictCursor
+import db_pool
+from user_context import get_current_user_info
+from flow_cache import invalidate_template_flows
+from change_tokens import conditional_get
+from event_hub import publish_card_event
+from log_pagination import (parse_log_page_args, build_window_clause, build_keyset_clause, build_page_clause,
+                            created_at_nullable, count_logs, paginate_logs)
 
 # 创建蓝图
 flow_bp = Blueprint('flow', __name__, url_prefix='/api/flow')
 
 def get_db_connection():
-    """获取数据库连接"""
+    """获取数据库连接（从共享连接池借出）"""
     try:
-        import pymysql
-        return pymysql.connect(**db_config)
+        return db_pool.get_connection()
     except Exception as e:
         print(f"数据库连接失败: {e}")
         return None
 
-def get_current_user_info():
-    """获取当前用户完整信息"""
-    try:
-        user_id = get_jwt_identity()
-        if not user_id:
-            return None
-            
-        connection = get_db_connection()
-        if not connection:
-            return None
-        
-        with connection.cursor() as cursor:
-            sql = """
-            SELECT u.*, d.name as department_name 
-            FROM users u 
-            LEFT JOIN departments d ON u.department_id = d.id 
-            WHERE u.id = %s AND u.is_active = 1
-            """
-            cursor.execute(sql, (user_id,))
-            return cursor.fetchone()
-    except Exception as e:
-        print(f"获取用户信息失败: {e}")
-        return None
-    finally:
-        if 'connection' in locals():
-            connection.close()
-
 @flow_bp.route('/templates/<int:template_id>/departments', methods=['GET'])
 @jwt_required()
 def get_template_departments(template_id):
@@ -145,6 +118,7 @@ def set_template_departments(template_id):
                     """, (template_id, dept_id, flow_order, is_required, auto_skip, timeout_hours))
                 
                 connection.commit()
+                invalidate_template_flows(template_id)
                 
                 return jsonify({
                     'success': True,
@@ -204,6 +178,8 @@ def start_card_flow(card_id):
                 VALUES (%s, 'start_flow', %s, %s, NOW())
             """, (card_id, current_user['id'], f"启动流转，流转至{flow_steps[0]['department_name']}"))
             connection.commit()
+        publish_card_event(connection, 'flow-advanced', card_id, action='start',
+                           to_department_id=flow_steps[0]['department_id'])
         
         return jsonify({
             'success': True,
@@ -391,20 +367,21 @@ def reject_card_flow(card_id):
                 if result['current_dept_id'] != current_user['department_id']:
                     return jsonify({'success': False, 'message': '只有当前处理部门可以驳回流转'}), 403
                 
-                # 更新流转卡状态为驳回
-                cursor.execute("""
-                    UPDATE transfer_cards 
-                    SET status = 'rejected', flow_completed_at = NOW()
-                    WHERE id = %s
-                """, (card_id,))
-                
                 # 更新当前流转状态
-                cursor.execute("""
+                completed_steps = cursor.execute("""
                     UPDATE card_flow_status 
                     SET status = 'completed', completed_at = NOW(), processed_by = %s, notes = %s
                     WHERE card_id = %s AND department_id = %s AND status = 'processing'
                 """, (current_user['id'], notes, card_id, current_user['department_id']))
                 
+                # 更新流转卡状态为驳回（同步已完成步骤数）
+                cursor.execute("""
+                    UPDATE transfer_cards 
+                    SET status = 'rejected', flow_completed_at = NOW(),
+                        completed_flow_steps = completed_flow_steps + %s
+                    WHERE id = %s
+                """, (completed_steps, card_id))
+                
                 # 记录操作日志
                 cursor.execute("""
                     INSERT INTO flow_operation_logs 
@@ -413,6 +390,8 @@ def reject_card_flow(card_id):
                 """, (card_id, current_user['department_id'], current_user['id'], notes))
                 
                 connection.commit()
+                publish_card_event(connection, 'flow-advanced', card_id, action='reject',
+                                   from_department_id=current_user['department_id'])
                 
                 return jsonify({
                     'success': True,
@@ -488,13 +467,14 @@ def restart_card_flow(card_id):
                     # 默认重启到第一个部门
                     restart_department = flow_steps[0]
                 
-                # 更新流转卡状态为进行中
+                # 更新流转卡状态为进行中（所有步骤重置为待处理，已完成步骤数清零）
                 cursor.execute("""
                     UPDATE transfer_cards 
                     SET status = 'in_progress', 
                         current_department_id = %s, 
                         flow_completed_at = NULL,
-                        flow_started_at = NOW()
+                        flow_started_at = NOW(),
+                        completed_flow_steps = 0
                     WHERE id = %s
                 """, (restart_department['department_id'], card_id))
                 
@@ -525,6 +505,9 @@ def restart_card_flow(card_id):
                       current_user['id'], f'重新启动流转，流转至{restart_department["department_name"]}'))
                 
                 connection.commit()
+                publish_card_event(connection, 'flow-advanced', card_id, action='restart',
+                                   from_department_id=card['current_department_id'],
+                                   to_department_id=restart_department['department_id'])
                 
                 return jsonify({
                     'success': True,
@@ -547,6 +530,7 @@ def restart_card_flow(card_id):
 
 @flow_bp.route('/pending', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_pending_flow_cards():
     """获取当前用户需要处理的流转卡"""
     try:
@@ -566,30 +550,15 @@ def get_pending_flow_cards():
                     d.name as current_department_name,
                     cfs.flow_order as current_step,
                     cfs.started_at as processing_started_at,
-                    tdf.total_steps,
-                    completed.completed_count,
+                    tc.total_flow_steps as total_steps,
+                    tc.completed_flow_steps as completed_count,
                     CASE 
-                        WHEN cfs.flow_order = tdf.total_steps THEN 1 
+                        WHEN cfs.flow_order = tc.total_flow_steps THEN 1 
                         ELSE 0 
                     END as is_last_department
                 FROM transfer_cards tc
                 JOIN card_flow_status cfs ON tc.id = cfs.card_id AND cfs.status = 'processing'
                 JOIN departments d ON cfs.department_id = d.id
-                LEFT JOIN (
-                    SELECT 
-                        template_id,
-                        COUNT(*) as total_steps
-                    FROM template_department_flow
-                    GROUP BY template_id
-                ) tdf ON tc.template_id = tdf.template_id
-                LEFT JOIN (
-                    SELECT 
-                        card_id,
-                        COUNT(*) as completed_count
-                    FROM card_flow_status
-                    WHERE status = 'completed'
-                    GROUP BY card_id
-                ) completed ON tc.id = completed.card_id
                 WHERE cfs.department_id = %s
                 AND tc.status IN ('draft', 'in_progress')
                 ORDER BY cfs.started_at DESC
@@ -616,9 +585,11 @@ def get_flow_history():
         if not current_user:
             return jsonify({'success': False, 'message': '用户信息获取失败'}), 401
         
-        # 获取分页参数
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 20))
+        # 获取分页参数（游标分页，兼容旧的 page 参数）
+        try:
+            page_params = parse_log_page_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         connection = get_db_connection()
         if not connection:
@@ -634,21 +605,22 @@ def get_flow_history():
                 where_conditions.append("(fol.from_department_id = %s OR fol.to_department_id = %s)")
                 params.extend([current_user['department_id'], current_user['department_id']])
             
-            where_clause = f"WHERE {' AND '.join(where_conditions)}" if where_conditions else ""
+            window_conditions, window_params = build_window_clause(page_params, 'fol')
+            where_conditions.extend(window_conditions)
+            params.extend(window_params)
             
-            # 获取总记录数
-            count_sql = f"""
-                SELECT COUNT(*) as total_count 
-                FROM flow_operation_logs fol
-                LEFT JOIN transfer_cards tc ON fol.card_id = tc.id
-                {where_clause}
-            """
-            cursor.execute(count_sql, params)
-            total_result = cursor.fetchone()
-            total_count = total_result['total_count'] if total_result else 0
+            # 总数只在第一页返回（无筛选时为估算值，有筛选时缓存）
+            total = None
+            if page_params['with_total']:
+                total = count_logs(cursor, 'flow_operation_logs', 'fol', where_conditions, params)
+            
+            keyset_conditions, keyset_params = build_keyset_clause(
+                page_params, 'fol', created_at_nullable(cursor, 'flow_operation_logs'))
+            conditions = where_conditions + keyset_conditions
+            where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            page_sql, page_sql_params = build_page_clause(page_params, 'fol')
             
             # 获取分页数据
-            offset = (page - 1) * page_size
             sql = f"""
                 SELECT 
                     fol.*,
@@ -663,11 +635,10 @@ def get_flow_history():
                 LEFT JOIN departments td ON fol.to_department_id = td.id
                 LEFT JOIN users u ON fol.operator_id = u.id
                 {where_clause}
-                ORDER BY fol.created_at DESC
-                LIMIT %s OFFSET %s
+                {page_sql}
             """
-            cursor.execute(sql, params + [page_size, offset])
-            history = cursor.fetchall()
+            cursor.execute(sql, params + keyset_params + page_sql_params)
+            history, pagination = paginate_logs(cursor.fetchall(), page_params, total)
             
             # 格式化数据
             for item in history:
@@ -685,21 +656,11 @@ def get_flow_history():
                 }
                 item['operation_type_text'] = operation_type_map.get(item['operation_type'], item['operation_type'])
             
-            # 计算分页信息
-            total_pages = (total_count + page_size - 1) // page_size
-            has_more = page < total_pages
-            
             return jsonify({
                 'success': True,
                 'data': {
                     'history': history,
-                    'pagination': {
-                        'current_page': page,
-                        'page_size': page_size,
-                        'total_count': total_count,
-                        'total_pages': total_pages,
-                        'has_more': has_more
-                    }
+                    'pagination': pagination
                 }
             })
     
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流转部门批量加载
+列表接口一次性加载整页流转卡的流转部门：先读逐卡流转顺序（card_department_flow，
+旧流转卡和单卡修改过的流转顺序），再读共享模板快照（template_snapshot_flow），
+都为空时回退到模板流转顺序；快照和模板流转顺序分别按快照ID、模板缓存并在流转卡之间共享
+"""
+
+import os
+
+from cache_utils import TTLCache
+
+# 模板流转顺序缓存（秒）；通过接口修改流转顺序或部门时主动失效
+FLOW_CACHE_TTL = int(os.getenv('FLOW_CACHE_TTL', 60))
+
+# 快照流转顺序缓存（秒）；快照不可变，只有部门改名时需要失效
+SNAPSHOT_FLOW_CACHE_TTL = int(os.getenv('SNAPSHOT_FLOW_CACHE_TTL', 3600))
+
+_template_flow_cache = TTLCache(ttl=FLOW_CACHE_TTL, maxsize=1024)
+_snapshot_flow_cache = TTLCache(ttl=SNAPSHOT_FLOW_CACHE_TTL, maxsize=1024)
+
+
+def _group_by(rows, key):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[key], []).append(row)
+    return grouped
+
+
+def load_card_flows(cursor, card_ids):
+    """一次查询加载多张流转卡的流转部门快照，返回 {card_id: [流转步骤]}"""
+    if not card_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(card_ids))
+    cursor.execute(f"""
+        SELECT cdf.*, d.name as department_name
+        FROM card_department_flow cdf
+        LEFT JOIN departments d ON cdf.department_id = d.id
+        WHERE cdf.card_id IN ({placeholders})
+        ORDER BY cdf.card_id, cdf.flow_order
+    """, list(card_ids))
+    return _group_by(cursor.fetchall(), 'card_id')
+
+
+def load_snapshot_flows(cursor, snapshot_ids):
+    """
+    加载多个共享快照的流转顺序，返回 {snapshot_id: (流转步骤, ...)}
+
+    返回的是缓存中的共享数据，调用方修改前需复制
+    """
+    flows = {}
+    missing = []
+    for snapshot_id in set(snapshot_ids):
+        cached = _snapshot_flow_cache.get(snapshot_id)
+        if cached is None:
+            missing.append(snapshot_id)
+        else:
+            flows[snapshot_id] = cached
+
+    if missing:
+        placeholders = ', '.join(['%s'] * len(missing))
+        cursor.execute(f"""
+            SELECT tsf.*, d.name as department_name
+            FROM template_snapshot_flow tsf
+            LEFT JOIN departments d ON tsf.department_id = d.id
+            WHERE tsf.snapshot_id IN ({placeholders})
+            ORDER BY tsf.snapshot_id, tsf.flow_order
+        """, missing)
+        loaded = _group_by(cursor.fetchall(), 'snapshot_id')
+        for snapshot_id in missing:
+            steps = tuple(loaded.get(snapshot_id, ()))
+            _snapshot_flow_cache.set(snapshot_id, steps)
+            flows[snapshot_id] = steps
+
+    return flows
+
+
+def load_template_flows(cursor, template_ids):
+    """
+    加载多个模板的流转顺序，返回 {template_id: [流转步骤]}
+
+    缓存中没有的模板用一条 IN 查询补齐；返回的是缓存中的共享数据，调用方修改前需复制
+    """
+    flows = {}
+    missing = []
+    for template_id in set(template_ids):
+        cached = _template_flow_cache.get(template_id)
+        if cached is None:
+            missing.append(template_id)
+        else:
+            flows[template_id] = cached
+
+    if missing:
+        placeholders = ', '.join(['%s'] * len(missing))
+        cursor.execute(f"""
+            SELECT tdf.*, d.name as department_name
+            FROM template_department_flow tdf
+            LEFT JOIN departments d ON tdf.department_id = d.id
+            WHERE tdf.template_id IN ({placeholders})
+            ORDER BY tdf.template_id, tdf.flow_order
+        """, missing)
+        loaded = _group_by(cursor.fetchall(), 'template_id')
+        for template_id in missing:
+            steps = tuple(loaded.get(template_id, ()))
+            _template_flow_cache.set(template_id, steps)
+            flows[template_id] = steps
+
+    return flows
+
+
+def invalidate_template_flows(template_id=None):
+    """模板流转顺序或部门变更后清除缓存（不传模板ID时清空全部，包括快照流转顺序中的部门名称）"""
+    if template_id is None:
+        _template_flow_cache.clear()
+        _snapshot_flow_cache.clear()
+    else:
+        _template_flow_cache.invalidate(int(template_id))
+
+
+def get_flow_cache_stats():
+    """模板和快照流转顺序缓存统计"""
+    return {
+        'templates': _template_flow_cache.get_stats(),
+        'snapshots': _snapshot_flow_cache.get_stats(),
+    }
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志分页
+/api/dashboard/operations（operation_logs）与 /api/flow/history（flow_operation_logs）共用的游标分页
+
+按 created_at DESC, id DESC 排序，游标与流转卡列表相同（见 card_list），
+翻页条件直接走 idx_created（二级索引隐含主键 id）或按用户筛选时的
+idx_operation_logs_user_created，不再 OFFSET 扫描前面的所有行；
+日志表按月分区（见 log_partitions）时，游标和 days 条件可以裁剪分区
+
+总数不再每页都 COUNT(*)：
+- 只有第一页（没有 cursor）或显式传 total=1 时返回
+- 没有筛选条件时使用 information_schema 中的估算行数（total_approximate 为 true）
+- 有筛选条件时精确计数，结果缓存 LOG_TOTAL_CACHE_TTL 秒
+
+仍兼容旧的 page 参数（没有 cursor 时按 OFFSET 翻页）
+"""
+
+import os
+
+from cache_utils import TTLCache
+from card_list import decode_cursor, encode_cursor
+
+# 单页最大条数
+LOG_PAGE_MAX_SIZE = int(os.getenv('LOG_PAGE_MAX_SIZE', 100))
+# 带筛选条件的总数缓存秒数
+LOG_TOTAL_CACHE_TTL = float(os.getenv('LOG_TOTAL_CACHE_TTL', 60))
+# created_at 是否允许 NULL 的缓存秒数（按月分区迁移后变为 NOT NULL）
+LOG_SCHEMA_CACHE_TTL = float(os.getenv('LOG_SCHEMA_CACHE_TTL', 300))
+
+_total_cache = TTLCache(ttl=LOG_TOTAL_CACHE_TTL, maxsize=1024)
+_nullable_cache = TTLCache(ttl=LOG_SCHEMA_CACHE_TTL, maxsize=16)
+
+
+def _positive_int(value, name):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} 必须是整数')
+    if value <= 0:
+        raise ValueError(f'{name} 必须大于 0')
+    return value
+
+
+def parse_log_page_args(args, default_size=20):
+    """
+    解析日志分页参数，参数不合法时抛出 ValueError
+
+    - page_size（或 per_page）: 每页条数
+    - cursor: 上一页返回的 next_cursor
+    - page: 旧的页码参数，没有 cursor 时使用
+    - days: 只查询最近 N 天的日志（按月分区时只访问这些月份的分区）
+    - total: 1 表示翻页时也返回总数
+    """
+    size = args.get('page_size') or args.get('per_page') or default_size
+    params = {
+        'limit': min(_positive_int(size, 'page_size'), LOG_PAGE_MAX_SIZE),
+        'cursor': None,
+        'page': 1,
+        'days': None,
+    }
+
+    days = args.get('days')
+    if days not in (None, ''):
+        params['days'] = _positive_int(days, 'days')
+
+    cursor = args.get('cursor')
+    if cursor:
+        params['cursor'] = decode_cursor(cursor)
+    else:
+        params['page'] = _positive_int(args.get('page', 1), 'page')
+
+    params['with_total'] = (params['cursor'] is None and params['page'] == 1) \
+        or args.get('total') in ('1', 'true')
+    return params
+
+
+def build_window_clause(params, alias):
+    """时间范围（days）条件，同时用于计数，返回 (条件列表, 参数列表)"""
+    if not params['days']:
+        return [], []
+    return [f"{alias}.created_at >= NOW() - INTERVAL %s DAY"], [params['days']]
+
+
+def created_at_nullable(cursor, table):
+    """日志表的 created_at 是否允许 NULL（未执行按月分区迁移的表允许）"""
+    nullable = _nullable_cache.get(table)
+    if nullable is None:
+        cursor.execute("""
+            SELECT IS_NULLABLE
+            FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'created_at'
+        """, (table,))
+        row = cursor.fetchone()
+        nullable = not row or row['IS_NULLABLE'] == 'YES'
+        _nullable_cache.set(table, nullable)
+    return nullable
+
+
+def build_keyset_clause(params, alias, nullable=True):
+    """
+    游标翻页条件，返回 (条件列表, 参数列表)
+
+    条件以 created_at 的范围比较开头，按月分区时只访问游标之前的分区。
+    created_at DESC 排序时 NULL 排在最后：nullable 为 True（表未分区、created_at 允许 NULL）时
+    附带 created_at IS NULL 的行，否则省略该分支
+    """
+    if params['cursor'] is None:
+        return [], []
+    created_at, row_id = params['cursor']
+    if created_at is None:
+        return [f"({alias}.created_at IS NULL AND {alias}.id < %s)"], [row_id]
+    condition = f"""({alias}.created_at <= %s
+                 AND ({alias}.created_at < %s OR {alias}.id < %s))"""
+    if nullable:
+        condition = f"({condition} OR {alias}.created_at IS NULL)"
+    return [condition], [created_at, created_at, row_id]
+
+
+def build_page_clause(params, alias):
+    """排序和 LIMIT（多取一条用于判断是否还有下一页），返回 (SQL, 参数列表)"""
+    sql = f"ORDER BY {alias}.created_at DESC, {alias}.id DESC LIMIT %s"
+    values = [params['limit'] + 1]
+    if params['cursor'] is None and params['page'] > 1:
+        sql += " OFFSET %s"
+        values.append((params['page'] - 1) * params['limit'])
+    return sql, values
+
+
+def count_logs(cursor, table, alias, where_conditions, where_params):
+    """
+    日志总数，返回 (总数, 是否为估算值)
+
+    没有筛选条件时读取表的估算行数，有筛选条件时精确计数并缓存
+    """
+    if not where_conditions:
+        cursor.execute("""
+            SELECT TABLE_ROWS AS total_count
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,))
+        row = cursor.fetchone()
+        return int(row['total_count'] or 0) if row else 0, True
+
+    key = (table, tuple(where_conditions), tuple(where_params))
+    total = _total_cache.get(key)
+    if total is None:
+        cursor.execute(f"""
+            SELECT COUNT(*) AS total_count
+            FROM {table} {alias}
+            WHERE {' AND '.join(where_conditions)}
+        """, where_params)
+        row = cursor.fetchone()
+        total = int(row['total_count']) if row else 0
+        _total_cache.set(key, total)
+    return total, False
+
+
+def paginate_logs(rows, params, total=None):
+    """截取一页数据，返回 (rows, pagination)"""
+    limit = params['limit']
+    has_more = len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+
+    pagination = {
+        'page_size': limit,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(rows[-1]) if has_more and rows else None,
+    }
+    if params['cursor'] is None:
+        pagination['current_page'] = params['page']
+    if total is not None:
+        total_count, approximate = total
+        pagination['total_count'] = total_count
+        pagination['total_approximate'] = approximate
+        pagination['total_pages'] = (total_count + limit - 1) // limit
+    return rows, pagination
+
+
+def get_log_pagination_cache_stats():
+    """日志总数缓存统计"""
+    return _total_cache.get_stats()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志表按月分区与保留期维护
+operation_logs 和 flow_operation_logs 按 created_at 按月 RANGE 分区
+（PARTITION BY RANGE (UNIX_TIMESTAMP(created_at))），分区名为 pYYYYMM，
+最后一个分区 p_future 接收尚未创建分区的月份。
+
+- 按 created_at 范围查询（日志分页的游标条件）只访问相关月份的分区
+- 过期数据整月 DROP PARTITION（或 EXCHANGE 到归档表后再删除分区），
+  不再长时间执行 DELETE 锁表
+
+先执行 database/migration_log_partitioning.sql（去掉外键、created_at 加入主键），然后：
+
+    python log_partitions.py init       # 把现有日志表转换为按月分区（只需执行一次）
+    python log_partitions.py maintain   # 创建未来的分区，删除或归档过期分区（建议每天由 cron 执行）
+    python log_partitions.py status     # 查看各分区的行数
+    python log_partitions.py maintain --dry-run   # 只打印将要执行的 DDL
+
+删除的日志不再参与 card_stats_rollup --backfill，已汇总的每日统计不受影响
+"""
+
+import argparse
+import os
+import sys
+from datetime import date
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import db_pool
+
+# 按月分区的日志表
+LOG_PARTITION_TABLES = ('operation_logs', 'flow_operation_logs')
+# 日志保留月数（不含当月）；0 表示不清理
+LOG_RETENTION_MONTHS = int(os.getenv('LOG_RETENTION_MONTHS', 12))
+# 提前创建的未来月份分区数
+LOG_PARTITION_PREMAKE_MONTHS = int(os.getenv('LOG_PARTITION_PREMAKE_MONTHS', 3))
+# 过期分区的处理方式：drop 直接删除；archive 先交换到 <表名>_archive_pYYYYMM 表再删除分区
+LOG_EXPIRE_MODE = os.getenv('LOG_EXPIRE_MODE', 'drop').lower()
+
+FUTURE_PARTITION = 'p_future'
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def _partition_definition(month):
+    upper = _add_months(month, 1)
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (UNIX_TIMESTAMP('{upper:%Y-%m-%d} 00:00:00'))"
+
+
+def _future_definition():
+    return f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE"
+
+
+def _parse_month(name):
+    """pYYYYMM -> 该月第一天；不是按月分区时返回 None"""
+    if len(name) != 7 or not name.startswith('p') or not name[1:].isdigit():
+        return None
+    return date(int(name[1:5]), int(name[5:7]), 1)
+
+
+def list_partitions(cursor, table):
+    """返回分区列表 [{'name', 'month', 'rows'}]，表未分区时返回空列表"""
+    cursor.execute("""
+        SELECT PARTITION_NAME AS name, TABLE_ROWS AS table_rows
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (table,))
+    return [
+        {'name': row['name'], 'month': _parse_month(row['name']), 'rows': int(row['table_rows'] or 0)}
+        for row in cursor.fetchall()
+    ]
+
+
+def plan_init(cursor, table, today=None):
+    """把未分区的表转换为按月分区的 DDL（从最早一条日志所在月份到未来 N 个月）"""
+    today = today or date.today()
+    cursor.execute(f"SELECT MIN(created_at) AS first_at FROM {table}")
+    row = cursor.fetchone()
+    first = _month_start(row['first_at'].date()) if row and row['first_at'] else _month_start(today)
+    last = _add_months(_month_start(today), LOG_PARTITION_PREMAKE_MONTHS)
+
+    definitions = []
+    month = first
+    while month <= last:
+        definitions.append(_partition_definition(month))
+        month = _add_months(month, 1)
+    definitions.append(_future_definition())
+    return [f"ALTER TABLE {table} PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) (\n    "
+            + ',\n    '.join(definitions) + "\n)"]
+
+
+def plan_future_partitions(partitions, table, today=None):
+    """从 p_future 中拆出未来 N 个月的分区（p_future 为空，拆分只修改元数据）"""
+    today = today or date.today()
+    months = {p['month'] for p in partitions if p['month']}
+    if not months:
+        return []
+    last = _add_months(_month_start(today), LOG_PARTITION_PREMAKE_MONTHS)
+    month = _add_months(max(months), 1)
+    definitions = []
+    while month <= last:
+        definitions.append(_partition_definition(month))
+        month = _add_months(month, 1)
+    if not definitions:
+        return []
+    definitions.append(_future_definition())
+    return [f"ALTER TABLE {table} REORGANIZE PARTITION {FUTURE_PARTITION} INTO (\n    "
+            + ',\n    '.join(definitions) + "\n)"]
+
+
+def plan_expire_partitions(partitions, table, today=None):
+    """删除（或先归档）整月早于保留期的分区"""
+    if LOG_RETENTION_MONTHS <= 0:
+        return []
+    today = today or date.today()
+    cutoff = _add_months(_month_start(today), -LOG_RETENTION_MONTHS)
+    statements = []
+    for partition in partitions:
+        if partition['month'] is None or partition['month'] >= cutoff:
+            continue
+        name = partition['name']
+        if LOG_EXPIRE_MODE == 'archive':
+            archive = f"{table}_archive_{name}"
+            # EXCHANGE PARTITION 只交换表空间，不复制数据
+            statements.extend([
+                f"CREATE TABLE IF NOT EXISTS {archive} LIKE {table}",
+                f"ALTER TABLE {archive} REMOVE PARTITIONING",
+                f"ALTER TABLE {table} EXCHANGE PARTITION {name} WITH TABLE {archive}",
+            ])
+        statements.append(f"ALTER TABLE {table} DROP PARTITION {name}")
+    return statements
+
+
+def plan_maintenance(partitions, table, today=None):
+    if not partitions:
+        raise ValueError(f'{table} 尚未分区，请先执行 init')
+    return plan_future_partitions(partitions, table, today) + plan_expire_partitions(partitions, table, today)
+
+
+def _execute(cursor, statements, dry_run):
+    for sql in statements:
+        print(sql + ';')
+        if not dry_run:
+            cursor.execute(sql)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='日志表按月分区维护')
+    parser.add_argument('command', choices=('status', 'init', 'maintain'))
+    parser.add_argument('--table', choices=LOG_PARTITION_TABLES, help='只处理指定的表')
+    parser.add_argument('--dry-run', action='store_true', help='只打印 DDL，不执行')
+    args = parser.parse_args(argv)
+
+    tables = (args.table,) if args.table else LOG_PARTITION_TABLES
+    connection = db_pool.get_connection()
+    try:
+        with connection.cursor() as cursor:
+            for table in tables:
+                partitions = list_partitions(cursor, table)
+                if args.command == 'status':
+                    print(f"{table}: {'未分区' if not partitions else f'{len(partitions)} 个分区'}")
+                    for partition in partitions:
+                        print(f"  {partition['name']}: {partition['rows']} 行（估算）")
+                elif args.command == 'init':
+                    if partitions:
+                        print(f"{table} 已分区，跳过")
+                        continue
+                    _execute(cursor, plan_init(cursor, table), args.dry_run)
+                else:
+                    _execute(cursor, plan_maintenance(partitions, table), args.dry_run)
+        return 0
+    except Exception as e:
+        print(f"日志分区维护失败: {e}")
+        return 1
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字段权限缓存
+按（模板，部门）编译可写字段集合，保存数据时一次加载、内存校验，
+避免对每个单元格单独查询 template_field_permissions
+"""
+
+import os
+
+from cache_utils import TTLCache
+
+# 权限缓存有效期（秒）；通过接口修改模板时会主动失效，TTL 用于兜底库外修改
+PERMISSION_CACHE_TTL = int(os.getenv('PERMISSION_CACHE_TTL', 60))
+
+_writable_fields_cache = TTLCache(ttl=PERMISSION_CACHE_TTL, maxsize=4096)
+_field_types_cache = TTLCache(ttl=PERMISSION_CACHE_TTL, maxsize=1)
+
+
+def load_writable_fields(cursor, template_id, department_id):
+    """
+    获取部门在模板中可写的字段集合
+
+    返回 frozenset(field_name)，同一（模板，部门）在缓存有效期内只查询一次
+    """
+    key = (str(template_id), str(department_id))
+    writable = _writable_fields_cache.get(key)
+    if writable is not None:
+        return writable
+
+    cursor.execute("""
+        SELECT field_name, can_write FROM template_field_permissions
+        WHERE template_id = %s AND department_id = %s
+    """, (template_id, department_id))
+    writable = frozenset(row['field_name'] for row in cursor.fetchall() if row['can_write'])
+    _writable_fields_cache.set(key, writable)
+    return writable
+
+
+def load_field_types(cursor):
+    """获取字段名到字段类型的映射（fields 表）"""
+    field_types = _field_types_cache.get('all')
+    if field_types is not None:
+        return field_types
+
+    cursor.execute("SELECT name, field_type FROM fields")
+    field_types = {row['name']: row['field_type'] for row in cursor.fetchall()}
+    _field_types_cache.set('all', field_types)
+    return field_types
+
+
+def invalidate_template_permissions(template_id=None):
+    """模板权限变更后清除缓存（不传模板ID时清空全部）"""
+    if template_id is None:
+        _writable_fields_cache.clear()
+    else:
+        _writable_fields_cache.invalidate_where(lambda key, _: key[0] == str(template_id))
+
+
+def invalidate_field_types():
+    """字段定义变更后清除字段类型缓存"""
+    _field_types_cache.clear()
+
+
+def get_permission_cache_stats():
+    """权限缓存统计"""
+    return {
+        'writable_fields': _writable_fields_cache.get_stats(),
+        'field_types': _field_types_cache.get_stats(),
+    }
@@ -6,23 +6,23 @@
 本方案彻底重构流转逻辑，确保流转顺序清晰、状态管理准确、无恶性bug。
 """
 
-import pymysql
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from config.config import get_db_config
+import db_pool
+from event_hub import publish_card_event
+from audit_log import enqueue_flow_log
+
+# 提交和完成流转的日志是否改为提交事务后放入异步队列批量写入（不再与流转状态在同一事务中）
+FLOW_LOG_ASYNC = os.getenv('FLOW_LOG_ASYNC', 'false').lower() in ('1', 'true', 'yes')
 
 class FlowManager:
     """流转管理器 - 单一职责，管理流转逻辑"""
     
-    def __init__(self):
-        self.db_config = get_db_config()
-        self.db_config['cursorclass'] = pymysql.cursors.DictCursor
-    
     def get_connection(self):
-        """获取数据库连接"""
-        return pymysql.connect(**self.db_config)
+        """获取数据库连接（从共享连接池借出，with 语句结束时归还）"""
+        return db_pool.get_connection()
     
     def get_template_flow_steps(self, template_id):
         """
@@ -194,10 +194,15 @@ class FlowManager:
                     """, (card_id,))
                     
                     # 记录操作日志
-                    self._log_flow_operation(conn, card_id, None, None, 
-                                            'complete', user_id, notes)
+                    deferred_log = self._log_flow_operation(conn, card_id, None, None, 
+                                                            'complete', user_id, notes,
+                                                            deferred=FLOW_LOG_ASYNC)
                     
                     conn.commit()
+                    enqueue_flow_log(deferred_log)
+                    publish_card_event(conn, 'flow-advanced', card_id, action='complete',
+                                       from_department_id=current_step['department_id'],
+                                       to_department_id=None)
                     return {
                         'success': True,
                         'message': '流转已完成',
@@ -239,12 +244,17 @@ class FlowManager:
                     """, (next_step['department_id'], card_id))
                     
                     # 记录操作日志
-                    self._log_flow_operation(conn, card_id, 
-                                           current_step['department_id'],
-                                           next_step['department_id'],
-                                           'submit_to_next', user_id, notes)
+                    deferred_log = self._log_flow_operation(conn, card_id, 
+                                                            current_step['department_id'],
+                                                            next_step['department_id'],
+                                                            'submit_to_next', user_id, notes,
+                                                            deferred=FLOW_LOG_ASYNC)
                     
                     conn.commit()
+                    enqueue_flow_log(deferred_log)
+                    publish_card_event(conn, 'flow-advanced', card_id, action='submit',
+                                       from_department_id=current_step['department_id'],
+                                       to_department_id=next_step['department_id'])
                     return {
                         'success': True,
                         'message': f'已提交到 {next_step["department_name"]}',
@@ -253,8 +263,22 @@ class FlowManager:
                     }
     
     def _log_flow_operation(self, conn, card_id, from_dept_id, to_dept_id, 
-                           operation_type, operator_id, notes):
-        """记录流转操作日志"""
+                           operation_type, operator_id, notes, deferred=False):
+        """
+        记录流转操作日志
+
+        deferred=True 时不在当前事务中写入，返回日志行，由调用方提交事务后
+        交给 enqueue_flow_log 异步写入（事务回滚时不会留下日志）
+        """
+        if deferred:
+            return {
+                'card_id': card_id,
+                'from_department_id': from_dept_id,
+                'to_department_id': to_dept_id,
+                'operation_type': operation_type,
+                'operator_id': operator_id,
+                'notes': notes,
+            }
         with conn.cursor() as cursor:
             cursor.execute("""
                 INSERT INTO flow_operation_logs
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按内容寻址的模板快照
+创建流转卡时不再把模板的字段配置、字段权限和部门流转顺序逐卡复制到
+card_template_fields / card_field_permissions / card_department_flow，
+而是对快照内容（规范化 JSON）计算 SHA-256 作为快照ID，相同版本的模板只保存一份：
+
+- template_snapshots: 快照（模板ID、模板名称）
+- template_snapshot_fields / template_snapshot_permissions / template_snapshot_flow: 快照内容
+- transfer_cards.snapshot_id 引用快照
+
+快照写入后不再修改，读取按快照ID缓存（见 field_schema、flow_cache）。
+逐卡表只保留旧流转卡的副本和单卡修改的流转顺序（POST /api/cards/<id>/flow），
+读取流转顺序时逐卡表优先于快照。
+
+    python template_snapshots.py status      # 快照和逐卡副本的行数
+    python template_snapshots.py migrate     # 把旧流转卡的逐卡副本合并为共享快照并删除副本
+    python template_snapshots.py gc          # 删除没有流转卡引用的快照
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import db_pool
+
+# 快照ID长度（SHA-256 十六进制的前缀，snapshot_id 列为 varchar(50)）
+SNAPSHOT_ID_LENGTH = 40
+# migrate 每个事务处理的流转卡数
+SNAPSHOT_MIGRATE_BATCH = int(os.getenv('SNAPSHOT_MIGRATE_BATCH', 200))
+# gc 只删除创建超过该天数的快照，避免删除刚写入、流转卡尚未提交的快照
+SNAPSHOT_GC_MIN_AGE_DAYS = int(os.getenv('SNAPSHOT_GC_MIN_AGE_DAYS', 1))
+
+FIELD_COLUMNS = ('field_name', 'field_display_name', 'field_type', 'field_order', 'is_required',
+                 'default_value', 'options', 'department_id', 'department_name')
+PERMISSION_COLUMNS = ('field_name', 'department_id', 'can_read', 'can_write')
+FLOW_COLUMNS = ('department_id', 'flow_order', 'is_required', 'auto_skip', 'timeout_hours')
+
+
+def _flag(value):
+    return 1 if value else 0
+
+
+def _field_row(field):
+    return (
+        field.get('field_name'),
+        field.get('field_display_name') or field.get('field_name'),
+        field.get('field_type') or 'text',
+        field.get('field_order') or 1,
+        _flag(field.get('is_required')),
+        field.get('default_value') or '',
+        field.get('options') or '',
+        field.get('department_id'),
+        field.get('department_name'),
+    )
+
+
+def _permission_row(permission):
+    return (permission['field_name'], permission['department_id'],
+            _flag(permission.get('can_read', 1)), _flag(permission.get('can_write', 1)))
+
+
+def _flow_row(step):
+    return (step['department_id'], step['flow_order'], _flag(step.get('is_required', 1)),
+            _flag(step.get('auto_skip')),
+            step.get('timeout_hours') if step.get('timeout_hours') is not None else 24)
+
+
+def build_snapshot(template, fields, permissions, flow):
+    """
+    规范化快照内容并计算快照ID
+
+    template: {'id', 'template_name', 'department_id'}
+    返回 {'snapshot_id', 'template_id', 'template_name', 'department_id', 'fields', 'permissions', 'flow'}
+    """
+    field_rows = sorted((_field_row(field) for field in fields), key=lambda row: (row[3], row[0] or ''))
+    # 权限按（字段，部门）、流转按部门去重，与逐卡表的唯一键一致
+    permission_rows = sorted({row[:2]: row for row in map(_permission_row, permissions)}.values(),
+                             key=lambda row: (row[0], row[1]))
+    flow_rows = sorted({row[0]: row for row in map(_flow_row, flow)}.values(),
+                       key=lambda row: (row[1], row[0]))
+
+    snapshot = {
+        'template_id': template.get('id'),
+        'template_name': template.get('template_name') or '',
+        'department_id': template.get('department_id'),
+        'fields': field_rows,
+        'permissions': permission_rows,
+        'flow': flow_rows,
+    }
+    canonical = json.dumps(snapshot, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    snapshot['snapshot_id'] = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:SNAPSHOT_ID_LENGTH]
+    return snapshot
+
+
+def load_template_snapshot(cursor, template, fields):
+    """按模板当前的字段权限和流转顺序生成快照（fields 为创建流转卡时使用的字段配置）"""
+    cursor.execute("""
+        SELECT field_name, department_id, can_read, can_write
+        FROM template_field_permissions
+        WHERE template_id = %s
+    """, (template['id'],))
+    permissions = cursor.fetchall()
+    cursor.execute("""
+        SELECT department_id, flow_order, is_required, auto_skip, timeout_hours
+        FROM template_department_flow
+        WHERE template_id = %s
+    """, (template['id'],))
+    flow = cursor.fetchall()
+    return build_snapshot(template, fields, permissions, flow)
+
+
+def ensure_snapshot(cursor, snapshot):
+    """
+    在当前事务中确保快照已保存，返回快照ID
+
+    先 INSERT IGNORE：并发写入同一快照时在唯一键上等待，只有插入成功的事务写入内容。
+    不先用 LOCK IN SHARE MODE 探测是否存在——快照不存在时探测加的是间隙锁，
+    两个事务各自持有间隙锁后再插入会互相等待而死锁。
+    快照已存在时再加共享锁，防止 gc 在流转卡提交前删除
+    """
+    snapshot_id = snapshot['snapshot_id']
+    inserted = cursor.execute("""
+        INSERT IGNORE INTO template_snapshots (template_id, snapshot_id, template_name, department_id)
+        VALUES (%s, %s, %s, %s)
+    """, (snapshot['template_id'], snapshot_id, snapshot['template_name'], snapshot['department_id']))
+    if not inserted:
+        cursor.execute("SELECT id FROM template_snapshots WHERE snapshot_id = %s LOCK IN SHARE MODE",
+                       (snapshot_id,))
+        cursor.fetchone()
+        return snapshot_id
+
+    for table, columns, rows in (
+        ('template_snapshot_fields', FIELD_COLUMNS, snapshot['fields']),
+        ('template_snapshot_permissions', PERMISSION_COLUMNS, snapshot['permissions']),
+        ('template_snapshot_flow', FLOW_COLUMNS, snapshot['flow']),
+    ):
+        if rows:
+            placeholders = ', '.join(['%s'] * (len(columns) + 1))
+            cursor.executemany(f"""
+                INSERT INTO {table} (snapshot_id, {', '.join(columns)})
+                VALUES ({placeholders})
+            """, [(snapshot_id, *row) for row in rows])
+    return snapshot_id
+
+
+def _load_by_card(cursor, table, columns, card_ids):
+    placeholders = ', '.join(['%s'] * len(card_ids))
+    cursor.execute(f"""
+        SELECT card_id, {', '.join(columns)}
+        FROM {table}
+        WHERE card_id IN ({placeholders})
+    """, card_ids)
+    grouped = {}
+    for row in cursor.fetchall():
+        grouped.setdefault(row['card_id'], []).append(row)
+    return grouped
+
+
+def migrate_card_copies(cursor, card_ids):
+    """
+    把指定旧流转卡的逐卡副本合并为共享快照：引用快照后删除逐卡副本
+
+    逐卡流转顺序为空的流转卡，快照中的流转顺序也为空（读取时仍回退到模板）。返回处理的流转卡数
+    """
+    if not card_ids:
+        return 0
+    placeholders = ', '.join(['%s'] * len(card_ids))
+    cursor.execute(f"""
+        SELECT tc.id, tc.template_id, t.department_id,
+               COALESCE(t.template_name, ts.template_name, '') AS template_name
+        FROM transfer_cards tc
+        LEFT JOIN templates t ON tc.template_id = t.id
+        LEFT JOIN template_snapshots ts ON tc.snapshot_id = ts.snapshot_id
+        WHERE tc.id IN ({placeholders})
+    """, card_ids)
+    cards = cursor.fetchall()
+
+    fields = _load_by_card(cursor, 'card_template_fields', FIELD_COLUMNS, card_ids)
+    permissions = _load_by_card(cursor, 'card_field_permissions', PERMISSION_COLUMNS, card_ids)
+    flow = _load_by_card(cursor, 'card_department_flow', FLOW_COLUMNS, card_ids)
+
+    cards_by_snapshot = {}
+    for card in cards:
+        template = {'id': card['template_id'], 'template_name': card['template_name'],
+                    'department_id': card['department_id']}
+        snapshot = build_snapshot(template, fields.get(card['id'], ()), permissions.get(card['id'], ()),
+                                  flow.get(card['id'], ()))
+        ensure_snapshot(cursor, snapshot)
+        cards_by_snapshot.setdefault(snapshot['snapshot_id'], []).append(card['id'])
+
+    for snapshot_id, ids in cards_by_snapshot.items():
+        cursor.execute(f"""
+            UPDATE transfer_cards
+            SET snapshot_id = %s, updated_at = updated_at
+            WHERE id IN ({', '.join(['%s'] * len(ids))})
+        """, [snapshot_id] + ids)
+
+    migrated = [card['id'] for card in cards]
+    if migrated:
+        ids_sql = ', '.join(['%s'] * len(migrated))
+        for table in ('card_template_fields', 'card_field_permissions', 'card_department_flow'):
+            cursor.execute(f"DELETE FROM {table} WHERE card_id IN ({ids_sql})", migrated)
+    return len(migrated)
+
+
+def migrate(connection):
+    """分批迁移所有带逐卡字段副本的旧流转卡，每批一个事务"""
+    total = 0
+    last_id = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT card_id FROM card_template_fields
+                WHERE card_id > %s
+                ORDER BY card_id
+                LIMIT %s
+            """, (last_id, SNAPSHOT_MIGRATE_BATCH))
+            card_ids = [row['card_id'] for row in cursor.fetchall()]
+            if not card_ids:
+                return total
+            total += migrate_card_copies(cursor, card_ids)
+        connection.commit()
+        last_id = card_ids[-1]
+        print(f"已迁移 {total} 张流转卡（至ID {last_id}）")
+
+
+def collect_garbage(cursor):
+    """删除没有流转卡引用的快照（快照内容随外键级联删除），返回删除的快照数"""
+    return cursor.execute("""
+        DELETE ts FROM template_snapshots ts
+        LEFT JOIN transfer_cards tc ON tc.snapshot_id = ts.snapshot_id
+        WHERE tc.id IS NULL
+          AND ts.created_at < NOW() - INTERVAL %s DAY
+    """, (SNAPSHOT_GC_MIN_AGE_DAYS,))
+
+
+def _count(cursor, table):
+    cursor.execute(f"SELECT COUNT(*) AS total FROM {table}")
+    return cursor.fetchone()['total']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='模板快照维护')
+    parser.add_argument('command', choices=('status', 'migrate', 'gc'))
+    args = parser.parse_args(argv)
+
+    connection = db_pool.get_connection()
+    try:
+        with connection.cursor() as cursor:
+            if args.command == 'status':
+                for table in ('template_snapshots', 'template_snapshot_fields',
+                              'template_snapshot_permissions', 'template_snapshot_flow',
+                              'card_template_fields', 'card_field_permissions', 'card_department_flow'):
+                    print(f"{table}: {_count(cursor, table)} 行")
+            elif args.command == 'gc':
+                deleted = collect_garbage(cursor)
+                connection.commit()
+                print(f"已删除 {deleted} 个未引用的快照")
+        if args.command == 'migrate':
+            print(f"共迁移 {migrate(connection)} 张流转卡")
+        return 0
+    except Exception as e:
+        connection.rollback()
+        print(f"模板快照维护失败: {e}")
+        return 1
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+当前用户上下文
+每个请求只解析一次当前用户并保存在请求上下文中，
+同时使用按用户ID索引的进程级 TTL 缓存，避免每个请求都查询 users 表
+
+可选的令牌声明模式（JWT_EMBED_USER_CLAIMS=1）：登录/刷新时把角色和部门信息
+签入访问令牌，请求时直接信任令牌中的声明，不再访问 users 表；
+用户或部门被修改后，通过进程内的撤销列表让旧令牌回退到数据库查询
+"""
+
+import os
+import threading
+import time
+from datetime import timedelta
+
+from flask import g, has_request_context, current_app
+from flask_jwt_extended import get_jwt_identity, get_jwt
+
+import db_pool
+from cache_utils import TTLCache
+
+# 用户信息缓存（秒），设为 0 可关闭进程级缓存
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 30))
+
+_user_cache = TTLCache(ttl=USER_CACHE_TTL, maxsize=2048)
+
+# 是否把用户声明签入访问令牌
+JWT_EMBED_USER_CLAIMS = os.getenv('JWT_EMBED_USER_CLAIMS', '0').lower() in ('1', 'true', 'yes')
+
+# 签入令牌的用户字段
+USER_CLAIM_KEYS = ('username', 'role', 'department_id', 'department_name')
+
+
+class ClaimsDenyList:
+    """
+    令牌声明撤销列表
+
+    只记录「用户/部门 -> 撤销时间」，签发时间早于撤销时间的令牌声明不再可信。
+    条目在超过令牌有效期后自动清理，因此大小只与有效期内的变更次数有关。
+    注意：撤销列表是进程内的，多进程部署时各进程独立维护。
+    """
+
+    def __init__(self, max_age=timedelta(hours=24)):
+        self.max_age = max_age
+        self._users = {}
+        self._departments = {}
+        self._lock = threading.Lock()
+
+    def _max_age_seconds(self):
+        max_age = self.max_age
+        if has_request_context():
+            max_age = current_app.config.get('JWT_ACCESS_TOKEN_EXPIRES', max_age)
+        return max_age.total_seconds() if isinstance(max_age, timedelta) else float(max_age)
+
+    def _prune(self, now):
+        cutoff = now - self._max_age_seconds()
+        for entries in (self._users, self._departments):
+            for key in [k for k, revoked_at in entries.items() if revoked_at < cutoff]:
+                del entries[key]
+
+    def revoke_user(self, user_id):
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._users[str(user_id)] = now
+
+    def revoke_department(self, dept_id):
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._departments[str(dept_id)] = now
+
+    def is_revoked(self, user_id, dept_id, issued_at):
+        with self._lock:
+            user_revoked_at = self._users.get(str(user_id))
+            dept_revoked_at = self._departments.get(str(dept_id))
+        if user_revoked_at is not None and issued_at <= user_revoked_at:
+            return True
+        if dept_revoked_at is not None and issued_at <= dept_revoked_at:
+            return True
+        return False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._users) + len(self._departments)
+
+
+_claims_deny_list = ClaimsDenyList()
+
+
+def build_user_claims(user):
+    """生成要签入访问令牌的用户声明（未开启声明模式时为空）"""
+    if not JWT_EMBED_USER_CLAIMS or not user:
+        return {}
+    return {key: user.get(key) for key in USER_CLAIM_KEYS}
+
+
+def _user_from_claims(user_id):
+    """从令牌声明构建用户信息，声明缺失或已被撤销时返回 None"""
+    claims = get_jwt()
+    if not all(key in claims for key in USER_CLAIM_KEYS):
+        return None
+    if _claims_deny_list.is_revoked(user_id, claims.get('department_id'), claims.get('iat', 0)):
+        return None
+    user = {key: claims.get(key) for key in USER_CLAIM_KEYS}
+    user['id'] = int(user_id) if str(user_id).isdigit() else user_id
+    user['is_active'] = 1
+    user['from_token_claims'] = True
+    return user
+
+
+def _load_user(user_id):
+    """从数据库加载用户完整信息"""
+    connection = db_pool.get_connection()
+    try:
+        with connection.cursor() as cursor:
+            sql = """
+            SELECT u.*, d.name as department_name
+            FROM users u
+            LEFT JOIN departments d ON u.department_id = d.id
+            WHERE u.id = %s AND u.is_active = 1
+            """
+            cursor.execute(sql, (user_id,))
+            return cursor.fetchone()
+    finally:
+        connection.close()
+
+
+def get_current_user_info(require_full=False):
+    """
+    获取当前用户信息（同一请求内只解析一次）
+
+    开启声明模式时默认直接使用令牌声明（只包含 id、username、role、
+    department_id、department_name）；需要完整用户记录时传 require_full=True
+    """
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return None
+
+        # 请求级缓存
+        if has_request_context():
+            cached = g.get('_current_user')
+            if cached is not None and cached[0] == user_id:
+                if not (require_full and cached[1].get('from_token_claims')):
+                    return cached[1]
+
+        if JWT_EMBED_USER_CLAIMS and not require_full:
+            user = _user_from_claims(user_id)
+            if user is not None:
+                if has_request_context():
+                    g._current_user = (user_id, user)
+                return user
+
+        user = None
+        if USER_CACHE_TTL > 0:
+            user = _user_cache.get(str(user_id))
+
+        if user is None:
+            user = _load_user(user_id)
+            if user and USER_CACHE_TTL > 0:
+                _user_cache.set(str(user_id), user)
+
+        if user is not None:
+            # 每个请求持有独立副本，避免处理函数修改共享缓存
+            user = dict(user)
+            if has_request_context():
+                g._current_user = (user_id, user)
+
+        return user
+    except Exception as e:
+        print(f"获取用户信息失败: {e}")
+        return None
+
+
+def invalidate_user(user_id):
+    """用户信息变更（修改、删除）后清除缓存并撤销旧令牌中的声明"""
+    _user_cache.invalidate(str(user_id))
+    _claims_deny_list.revoke_user(user_id)
+
+
+def invalidate_department(dept_id):
+    """部门信息变更后清除该部门所有用户的缓存并撤销旧令牌中的声明"""
+    _user_cache.invalidate_where(
+        lambda _, user: str(user.get('department_id')) == str(dept_id))
+    _claims_deny_list.revoke_department(dept_id)
+
+
+def get_user_cache_stats():
+    """用户信息缓存统计"""
+    stats = _user_cache.get_stats()
+    stats['token_claims_enabled'] = JWT_EMBED_USER_CLAIMS
+    stats['claims_deny_list_size'] = len(_claims_deny_list)
+    return stats
@@ -0,0 +1,32 @@
+-- Card cancellation time migration script
+-- Execute this script to record when a card was cancelled. The daily
+-- statistics rollup counts cancellations by cancelled_at instead of
+-- updated_at, so editing a card that was cancelled earlier no longer counts
+-- it again on the day of the edit. Existing cancelled cards are backfilled
+-- from updated_at (the best available estimate); then run
+--     python backend/card_stats_rollup.py --backfill
+-- once to recount the history.
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Add cancellation time
+-- ========================================
+
+ALTER TABLE `transfer_cards`
+  ADD COLUMN `cancelled_at` timestamp NULL DEFAULT NULL COMMENT '取消时间（状态变为取消的时间）',
+  ADD KEY `idx_transfer_cards_cancelled_at` (`cancelled_at`);
+
+-- ========================================
+-- Step 2: Backfill existing cancelled cards
+-- ========================================
+
+UPDATE `transfer_cards`
+SET `cancelled_at` = `updated_at`, `updated_at` = `updated_at`
+WHERE `status` = 'cancelled' AND `cancelled_at` IS NULL;
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Card cancellation time migration completed!' AS message;
@@ -0,0 +1,50 @@
+-- Card counters migration script
+-- Execute this script to materialize per-card counters on transfer_cards
+-- (data_row_count, completed_flow_steps, total_flow_steps).
+-- Afterwards the counters are maintained by the application; run
+-- `python backend/card_counters.py --repair` to verify/repair them later.
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Add data row counter
+-- ========================================
+
+ALTER TABLE `transfer_cards`
+ADD COLUMN `data_row_count` int NOT NULL DEFAULT 0 COMMENT '数据行数' AFTER `completed_flow_steps`;
+
+-- ========================================
+-- Step 2: Backfill counters
+-- ========================================
+
+UPDATE `transfer_cards` tc
+LEFT JOIN (
+  SELECT card_id, COUNT(*) AS row_count
+  FROM card_data
+  GROUP BY card_id
+) rc ON rc.card_id = tc.id
+LEFT JOIN (
+  SELECT card_id, COUNT(*) AS total_steps, SUM(status = 'completed') AS completed_steps
+  FROM card_flow_status
+  GROUP BY card_id
+) fs ON fs.card_id = tc.id
+LEFT JOIN (
+  SELECT card_id, COUNT(*) AS total_steps
+  FROM card_department_flow
+  GROUP BY card_id
+) cdf ON cdf.card_id = tc.id
+LEFT JOIN (
+  SELECT template_id, COUNT(*) AS total_steps
+  FROM template_department_flow
+  GROUP BY template_id
+) tdf ON tdf.template_id = tc.template_id
+SET tc.data_row_count = COALESCE(rc.row_count, 0),
+    tc.completed_flow_steps = COALESCE(fs.completed_steps, 0),
+    tc.total_flow_steps = COALESCE(fs.total_steps, cdf.total_steps, tdf.total_steps, 0),
+    tc.updated_at = tc.updated_at;
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Card counters migration completed!' AS message;
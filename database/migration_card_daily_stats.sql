@@ -0,0 +1,42 @@
+-- Daily card statistics rollup migration script
+-- Execute this script to create the pre-aggregated daily statistics table
+-- used by the dashboard trends, then run
+--     python backend/card_stats_rollup.py --backfill
+-- once to aggregate existing history. Afterwards the rollup is kept up to
+-- date incrementally (on dashboard requests, or from cron without --backfill).
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Create daily statistics and watermark tables
+-- ========================================
+
+CREATE TABLE IF NOT EXISTS `card_daily_stats` (
+  `stat_date` date NOT NULL COMMENT '统计日期',
+  `department_id` int NOT NULL DEFAULT 0 COMMENT '部门ID（0表示未知）',
+  `template_id` int NOT NULL DEFAULT 0 COMMENT '模板ID（0表示未知）',
+  `created_count` int NOT NULL DEFAULT 0 COMMENT '创建数',
+  `started_count` int NOT NULL DEFAULT 0 COMMENT '启动流转数',
+  `completed_count` int NOT NULL DEFAULT 0 COMMENT '完成流转数',
+  `rejected_count` int NOT NULL DEFAULT 0 COMMENT '驳回数',
+  `cancelled_count` int NOT NULL DEFAULT 0 COMMENT '取消数',
+  `step_completed_count` int NOT NULL DEFAULT 0 COMMENT '完成的流转步骤数',
+  `step_duration_seconds` bigint NOT NULL DEFAULT 0 COMMENT '流转步骤处理总时长（秒）',
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`stat_date`,`department_id`,`template_id`),
+  KEY `idx_template_date` (`template_id`,`stat_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡每日统计汇总表';
+
+CREATE TABLE IF NOT EXISTS `card_stats_rollup_state` (
+  `id` int NOT NULL COMMENT '固定为1',
+  `last_card_id` int NOT NULL DEFAULT 0 COMMENT '已汇总的最大流转卡ID',
+  `last_flow_log_id` int NOT NULL DEFAULT 0 COMMENT '已汇总的最大流转日志ID',
+  `rolled_up_at` timestamp NULL DEFAULT NULL COMMENT '最近汇总时间',
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='每日统计汇总水位线表';
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Daily card statistics rollup migration completed!' AS message;
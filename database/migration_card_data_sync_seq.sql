@@ -0,0 +1,43 @@
+-- Card data sync sequence migration script
+-- Execute this script to make GET /api/cards/<id>/data?since=<sync_token>
+-- commit-ordered. Every transaction that writes card_data takes a sequence
+-- number from card_data_sync_leases in its own short transaction (no card row
+-- lock is held) and stamps the rows and tombstones it writes with it. The
+-- lease is deleted when the writer commits; sync tokens never move past the
+-- lowest outstanding lease, so delta sync returns rows with sync_seq > token
+-- instead of comparing updated_at with an overlap window.
+-- Existing rows keep sync_seq = 0. Tokens issued before this migration are
+-- answered with a full response.
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Sequence leases for in-flight writers
+-- ========================================
+
+CREATE TABLE IF NOT EXISTS `card_data_sync_leases` (
+  `seq` bigint NOT NULL AUTO_INCREMENT COMMENT '同步序号',
+  `card_id` int NOT NULL COMMENT '流转卡ID',
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '分配时间',
+  PRIMARY KEY (`seq`),
+  KEY `idx_card_seq` (`card_id`,`seq`),
+  KEY `idx_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡数据同步序号租约表';
+
+-- ========================================
+-- Step 2: Stamp card_data rows and tombstones with the sequence
+-- ========================================
+
+ALTER TABLE `card_data`
+  ADD COLUMN `sync_seq` bigint NOT NULL DEFAULT 0 COMMENT '最后写入时的流转卡数据变更序号',
+  ADD KEY `idx_card_data_sync_seq` (`card_id`,`sync_seq`);
+
+ALTER TABLE `card_data_tombstones`
+  ADD COLUMN `sync_seq` bigint NOT NULL DEFAULT 0 COMMENT '删除时的流转卡数据变更序号' AFTER `row_number`,
+  ADD KEY `idx_card_sync_seq` (`card_id`,`sync_seq`);
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Card data sync sequence migration completed!' AS message;
@@ -0,0 +1,27 @@
+-- Card data delta sync migration script
+-- Execute this script to record deleted card_data rows, so that
+-- GET /api/cards/<id>/data?since=<sync_token> can return tombstones.
+-- Tombstones older than CARD_DATA_TOMBSTONE_RETENTION_DAYS (default 7)
+-- are pruned by the application.
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Create tombstone table
+-- ========================================
+
+CREATE TABLE IF NOT EXISTS `card_data_tombstones` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `card_id` int NOT NULL COMMENT '流转卡ID',
+  `row_number` int NOT NULL COMMENT '被删除的行号',
+  `deleted_by` int DEFAULT NULL COMMENT '删除人ID',
+  `deleted_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP COMMENT '删除时间',
+  PRIMARY KEY (`id`),
+  KEY `idx_card_deleted_at` (`card_id`,`deleted_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡数据行删除记录表';
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Card data tombstones migration completed!' AS message;
@@ -0,0 +1,18 @@
+-- Card list pagination migration script
+-- Execute this script to add the keyset pagination index used by
+-- /api/cards and /api/template-cards (ORDER BY created_at DESC, id DESC)
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Add keyset pagination index
+-- ========================================
+
+ALTER TABLE `transfer_cards`
+ADD KEY `idx_transfer_cards_created_id` (`created_at`,`id`);
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Card list index migration completed!' AS message;
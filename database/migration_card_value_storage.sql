@@ -0,0 +1,38 @@
+-- Card value storage layout migration script
+-- Execute this script to add the narrow (EAV) and JSON layouts for card
+-- field values next to the existing wide field_XX columns of card_data.
+-- The layout is selected per deployment with CARD_VALUE_STORAGE
+-- (wide / eav / json). To switch, stop writes and run e.g.
+--     python backend/card_values.py migrate --to eav
+-- then restart the backend with CARD_VALUE_STORAGE=eav. Compare the
+-- layouts on real data with
+--     python backend/card_values.py status
+--     python backend/card_values.py bench --cards 50
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Add JSON column for the json layout
+-- ========================================
+
+ALTER TABLE `card_data`
+  ADD COLUMN `field_values` json DEFAULT NULL COMMENT '字段值（CARD_VALUE_STORAGE=json 时使用，只保存非空字段）';
+
+-- ========================================
+-- Step 2: Create narrow value table for the eav layout
+-- ========================================
+
+CREATE TABLE IF NOT EXISTS `card_data_values` (
+  `card_id` int NOT NULL COMMENT '流转卡ID',
+  `row_number` int NOT NULL COMMENT '行号',
+  `field_name` varchar(100) NOT NULL COMMENT '字段名称',
+  `value` text COMMENT '字段值',
+  PRIMARY KEY (`card_id`,`row_number`,`field_name`),
+  CONSTRAINT `card_data_values_ibfk_1` FOREIGN KEY (`card_id`, `row_number`) REFERENCES `card_data` (`card_id`, `row_number`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡字段值窄表';
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Card value storage migration completed!' AS message;
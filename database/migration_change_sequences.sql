@@ -0,0 +1,29 @@
+-- Change sequence migration script
+-- Execute this script to replace the MAX(updated_at) / COUNT(*) / MAX(id)
+-- marker of the list and dashboard change tokens with a single sequence row.
+-- Handlers that change list-visible card state (card events, flow actions,
+-- card deletions, template changes) increment change_sequences.seq on their
+-- own connection after they commit, so counter changes produce a new token
+-- in every backend process. Reading the marker is a primary key
+-- lookup instead of a scan of transfer_cards.
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Create change sequence table
+-- ========================================
+
+CREATE TABLE IF NOT EXISTS `change_sequences` (
+  `name` varchar(50) NOT NULL COMMENT '序号名称',
+  `seq` bigint NOT NULL DEFAULT 0 COMMENT '变更序号',
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='变更序号表';
+
+INSERT IGNORE INTO `change_sequences` (`name`, `seq`) VALUES ('cards', 0);
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Change sequence migration completed!' AS message;
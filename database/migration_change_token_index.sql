@@ -0,0 +1,18 @@
+-- Change token migration script
+-- Execute this script to add the index used to compute list/dashboard
+-- change tokens (MAX(updated_at) on transfer_cards) without a table scan
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Add updated_at index
+-- ========================================
+
+ALTER TABLE `transfer_cards`
+ADD KEY `idx_transfer_cards_updated_at` (`updated_at`);
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Change token index migration completed!' AS message;
@@ -0,0 +1,49 @@
+-- Log partitioning migration script
+-- Execute this script to prepare operation_logs and flow_operation_logs for
+-- monthly range partitioning on created_at, then convert and maintain them:
+--     python backend/log_partitions.py init
+--     python backend/log_partitions.py maintain    (daily, e.g. from cron)
+--
+-- MySQL requires the partitioning column in every unique key and does not
+-- support foreign keys on partitioned InnoDB tables, so this script drops the
+-- log foreign keys and adds created_at to the primary key. Log rows are no
+-- longer removed by ON DELETE CASCADE when a user is deleted; they expire with
+-- their partition (LOG_RETENTION_MONTHS). Flow logs of a deleted card are
+-- deleted by the application.
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Drop log foreign keys
+-- ========================================
+
+ALTER TABLE `operation_logs` DROP FOREIGN KEY `operation_logs_ibfk_1`;
+
+ALTER TABLE `flow_operation_logs`
+DROP FOREIGN KEY `flow_operation_logs_ibfk_1`,
+DROP FOREIGN KEY `flow_operation_logs_ibfk_2`,
+DROP FOREIGN KEY `flow_operation_logs_ibfk_3`,
+DROP FOREIGN KEY `flow_operation_logs_ibfk_4`;
+
+-- ========================================
+-- Step 2: Make created_at part of the primary key
+-- ========================================
+
+UPDATE `operation_logs` SET `created_at` = CURRENT_TIMESTAMP WHERE `created_at` IS NULL;
+UPDATE `flow_operation_logs` SET `created_at` = CURRENT_TIMESTAMP WHERE `created_at` IS NULL;
+
+ALTER TABLE `operation_logs`
+MODIFY `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+DROP PRIMARY KEY,
+ADD PRIMARY KEY (`id`,`created_at`);
+
+ALTER TABLE `flow_operation_logs`
+MODIFY `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+DROP PRIMARY KEY,
+ADD PRIMARY KEY (`id`,`created_at`);
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Log partitioning migration completed! Run log_partitions.py init next.' AS message;
@@ -0,0 +1,75 @@
+-- Shared template snapshot migration script
+-- Execute this script to store template snapshots once per template version
+-- (content-addressed by snapshot_id) instead of copying fields, permissions
+-- and flow into card_template_fields / card_field_permissions /
+-- card_department_flow for every card. Then run
+--     python backend/template_snapshots.py migrate
+-- once to fold the per-card copies of existing cards into shared snapshots,
+-- and periodically
+--     python backend/template_snapshots.py gc
+-- to remove snapshots that are no longer referenced by any card.
+
+USE `transfer_card_system`;
+
+-- ========================================
+-- Step 1: Allow snapshots of templates without a department
+-- ========================================
+
+ALTER TABLE `template_snapshots`
+  MODIFY COLUMN `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID（快照内容的SHA-256）',
+  MODIFY COLUMN `department_id` int DEFAULT NULL COMMENT '部门ID';
+
+-- ========================================
+-- Step 2: Create shared snapshot content tables
+-- ========================================
+
+CREATE TABLE IF NOT EXISTS `template_snapshot_fields` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID',
+  `field_name` varchar(100) NOT NULL COMMENT '字段名称',
+  `field_display_name` varchar(100) NOT NULL COMMENT '字段显示名称',
+  `field_type` enum('text','number','date','select','boolean') DEFAULT 'text' COMMENT '字段类型',
+  `field_order` int DEFAULT 1 COMMENT '字段排序',
+  `is_required` tinyint(1) DEFAULT 0 COMMENT '是否必填',
+  `default_value` text COMMENT '默认值',
+  `options` text COMMENT '选项(JSON格式)',
+  `department_id` int DEFAULT NULL COMMENT '负责部门ID',
+  `department_name` varchar(100) DEFAULT NULL COMMENT '负责部门名称',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_snapshot_field_order` (`snapshot_id`,`field_order`),
+  CONSTRAINT `template_snapshot_fields_ibfk_1` FOREIGN KEY (`snapshot_id`) REFERENCES `template_snapshots` (`snapshot_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='模板快照字段表';
+
+CREATE TABLE IF NOT EXISTS `template_snapshot_permissions` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID',
+  `field_name` varchar(100) NOT NULL COMMENT '字段名称',
+  `department_id` int NOT NULL COMMENT '部门ID',
+  `can_read` tinyint(1) DEFAULT 1 COMMENT '是否可读',
+  `can_write` tinyint(1) DEFAULT 1 COMMENT '是否可写',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_snapshot_field_dept` (`snapshot_id`,`field_name`,`department_id`),
+  CONSTRAINT `template_snapshot_permissions_ibfk_1` FOREIGN KEY (`snapshot_id`) REFERENCES `template_snapshots` (`snapshot_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='模板快照字段权限表';
+
+CREATE TABLE IF NOT EXISTS `template_snapshot_flow` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID',
+  `department_id` int NOT NULL COMMENT '部门ID',
+  `flow_order` int NOT NULL COMMENT '流转顺序',
+  `is_required` tinyint(1) DEFAULT 1 COMMENT '是否必须部门',
+  `auto_skip` tinyint(1) DEFAULT 0 COMMENT '是否自动跳过(无数据时)',
+  `timeout_hours` int DEFAULT 24 COMMENT '超时时间(小时)',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_snapshot_department` (`snapshot_id`,`department_id`),
+  KEY `idx_snapshot_flow_order` (`snapshot_id`,`flow_order`),
+  KEY `idx_department` (`department_id`),
+  CONSTRAINT `template_snapshot_flow_ibfk_1` FOREIGN KEY (`snapshot_id`) REFERENCES `template_snapshots` (`snapshot_id`) ON DELETE CASCADE,
+  CONSTRAINT `template_snapshot_flow_ibfk_2` FOREIGN KEY (`department_id`) REFERENCES `departments` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='模板快照部门流转顺序表';
+
+-- ========================================
+-- Complete
+-- ========================================
+
+SELECT 'Shared template snapshot migration completed!' AS message;
@@ -98,9 +98,9 @@ CREATE TABLE `templates` (
 CREATE TABLE `template_snapshots` (
   `id` int NOT NULL AUTO_INCREMENT,
   `template_id` int DEFAULT NULL COMMENT '模板ID',
-  `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID（自动生成唯一值）',
+  `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID（快照内容的SHA-256）',
   `template_name` varchar(100) NOT NULL COMMENT '模板名称（快照时保存）',
-  `department_id` int NOT NULL COMMENT '部门ID',
+  `department_id` int DEFAULT NULL COMMENT '部门ID',
   `is_active` tinyint(1) DEFAULT 1 COMMENT '是否激活',
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
   PRIMARY KEY (`id`),
@@ -126,6 +126,8 @@ CREATE TABLE `transfer_cards` (
   `flow_completed_at` timestamp NULL DEFAULT NULL COMMENT '流转完成时间',
   `total_flow_steps` int DEFAULT 0 COMMENT '总流转步骤数',
   `completed_flow_steps` int DEFAULT 0 COMMENT '已完成流转步骤数',
+  `data_row_count` int NOT NULL DEFAULT 0 COMMENT '数据行数',
+  `cancelled_at` timestamp NULL DEFAULT NULL COMMENT '取消时间（状态变为取消的时间）',
   PRIMARY KEY (`id`),
   UNIQUE KEY `card_number` (`card_number`),
   KEY `idx_number` (`card_number`),
@@ -134,7 +136,10 @@ CREATE TABLE `transfer_cards` (
   KEY `idx_template` (`template_id`),
   KEY `idx_snapshot` (`snapshot_id`),
   KEY `idx_current_department` (`current_department_id`),
-  KEY `idx_transfer_cards_status_dept` (`status`,`current_department_id`)
+  KEY `idx_transfer_cards_status_dept` (`status`,`current_department_id`),
+  KEY `idx_transfer_cards_created_id` (`created_at`,`id`),
+  KEY `idx_transfer_cards_updated_at` (`updated_at`),
+  KEY `idx_transfer_cards_cancelled_at` (`cancelled_at`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡主表';
 
 -- 7. card_data 流转卡数据表
@@ -205,6 +210,8 @@ CREATE TABLE `card_data` (
   `last_updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '最后修改时间',
   `flow_step_id` int DEFAULT NULL COMMENT '流转步骤ID',
   `approval_notes` text COMMENT '审批备注',
+  `field_values` json DEFAULT NULL COMMENT '字段值（CARD_VALUE_STORAGE=json 时使用，只保存非空字段）',
+  `sync_seq` bigint NOT NULL DEFAULT 0 COMMENT '最后写入时的流转卡数据变更序号',
   PRIMARY KEY (`id`),
   UNIQUE KEY `uk_card_row` (`card_id`,`row_number`),
   KEY `idx_card_id` (`card_id`),
@@ -214,7 +221,8 @@ CREATE TABLE `card_data` (
   KEY `fk_data_submitted_by` (`submitted_by`),
   KEY `fk_data_approved_by` (`approved_by`),
   KEY `fk_data_last_updated_by` (`last_updated_by`),
-  KEY `idx_card_data_card_status` (`card_id`,`status`)
+  KEY `idx_card_data_card_status` (`card_id`,`status`),
+  KEY `idx_card_data_sync_seq` (`card_id`,`sync_seq`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡数据表';
 
 -- 8. card_field_values 流转卡字段值表
@@ -424,11 +432,121 @@ CREATE TABLE `card_field_permissions` (
   KEY `idx_department` (`department_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡模板快照字段权限表';
 
+-- 19. card_data_tombstones 流转卡数据行删除记录表（增量同步）
+CREATE TABLE `card_data_tombstones` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `card_id` int NOT NULL COMMENT '流转卡ID',
+  `row_number` int NOT NULL COMMENT '被删除的行号',
+  `sync_seq` bigint NOT NULL DEFAULT 0 COMMENT '删除时的流转卡数据变更序号',
+  `deleted_by` int DEFAULT NULL COMMENT '删除人ID',
+  `deleted_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP COMMENT '删除时间',
+  PRIMARY KEY (`id`),
+  KEY `idx_card_deleted_at` (`card_id`,`deleted_at`),
+  KEY `idx_card_sync_seq` (`card_id`,`sync_seq`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡数据行删除记录表';
+
+-- 20. card_daily_stats 流转卡每日统计汇总表
+CREATE TABLE `card_daily_stats` (
+  `stat_date` date NOT NULL COMMENT '统计日期',
+  `department_id` int NOT NULL DEFAULT 0 COMMENT '部门ID（0表示未知）',
+  `template_id` int NOT NULL DEFAULT 0 COMMENT '模板ID（0表示未知）',
+  `created_count` int NOT NULL DEFAULT 0 COMMENT '创建数',
+  `started_count` int NOT NULL DEFAULT 0 COMMENT '启动流转数',
+  `completed_count` int NOT NULL DEFAULT 0 COMMENT '完成流转数',
+  `rejected_count` int NOT NULL DEFAULT 0 COMMENT '驳回数',
+  `cancelled_count` int NOT NULL DEFAULT 0 COMMENT '取消数',
+  `step_completed_count` int NOT NULL DEFAULT 0 COMMENT '完成的流转步骤数',
+  `step_duration_seconds` bigint NOT NULL DEFAULT 0 COMMENT '流转步骤处理总时长（秒）',
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`stat_date`,`department_id`,`template_id`),
+  KEY `idx_template_date` (`template_id`,`stat_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡每日统计汇总表';
+
+-- 21. card_stats_rollup_state 每日统计汇总水位线表
+CREATE TABLE `card_stats_rollup_state` (
+  `id` int NOT NULL COMMENT '固定为1',
+  `last_card_id` int NOT NULL DEFAULT 0 COMMENT '已汇总的最大流转卡ID',
+  `last_flow_log_id` int NOT NULL DEFAULT 0 COMMENT '已汇总的最大流转日志ID',
+  `rolled_up_at` timestamp NULL DEFAULT NULL COMMENT '最近汇总时间',
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='每日统计汇总水位线表';
+
+-- 22. template_snapshot_fields 模板快照字段表（按快照共享）
+CREATE TABLE `template_snapshot_fields` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID',
+  `field_name` varchar(100) NOT NULL COMMENT '字段名称',
+  `field_display_name` varchar(100) NOT NULL COMMENT '字段显示名称',
+  `field_type` enum('text','number','date','select','boolean') DEFAULT 'text' COMMENT '字段类型',
+  `field_order` int DEFAULT 1 COMMENT '字段排序',
+  `is_required` tinyint(1) DEFAULT 0 COMMENT '是否必填',
+  `default_value` text COMMENT '默认值',
+  `options` text COMMENT '选项(JSON格式)',
+  `department_id` int DEFAULT NULL COMMENT '负责部门ID',
+  `department_name` varchar(100) DEFAULT NULL COMMENT '负责部门名称',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_snapshot_field_order` (`snapshot_id`,`field_order`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='模板快照字段表';
+
+-- 23. template_snapshot_permissions 模板快照字段权限表（按快照共享）
+CREATE TABLE `template_snapshot_permissions` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID',
+  `field_name` varchar(100) NOT NULL COMMENT '字段名称',
+  `department_id` int NOT NULL COMMENT '部门ID',
+  `can_read` tinyint(1) DEFAULT 1 COMMENT '是否可读',
+  `can_write` tinyint(1) DEFAULT 1 COMMENT '是否可写',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_snapshot_field_dept` (`snapshot_id`,`field_name`,`department_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='模板快照字段权限表';
+
+-- 24. template_snapshot_flow 模板快照部门流转顺序表（按快照共享）
+CREATE TABLE `template_snapshot_flow` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `snapshot_id` varchar(50) NOT NULL COMMENT '快照ID',
+  `department_id` int NOT NULL COMMENT '部门ID',
+  `flow_order` int NOT NULL COMMENT '流转顺序',
+  `is_required` tinyint(1) DEFAULT 1 COMMENT '是否必须部门',
+  `auto_skip` tinyint(1) DEFAULT 0 COMMENT '是否自动跳过(无数据时)',
+  `timeout_hours` int DEFAULT 24 COMMENT '超时时间(小时)',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_snapshot_department` (`snapshot_id`,`department_id`),
+  KEY `idx_snapshot_flow_order` (`snapshot_id`,`flow_order`),
+  KEY `idx_department` (`department_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='模板快照部门流转顺序表';
+
+-- 25. card_data_values 流转卡字段值窄表（CARD_VALUE_STORAGE=eav 时使用）
+CREATE TABLE `card_data_values` (
+  `card_id` int NOT NULL COMMENT '流转卡ID',
+  `row_number` int NOT NULL COMMENT '行号',
+  `field_name` varchar(100) NOT NULL COMMENT '字段名称',
+  `value` text COMMENT '字段值',
+  PRIMARY KEY (`card_id`,`row_number`,`field_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡字段值窄表';
+
+-- 26. change_sequences 变更序号表（列表和工作台接口的变更令牌）
+CREATE TABLE `change_sequences` (
+  `name` varchar(50) NOT NULL COMMENT '序号名称',
+  `seq` bigint NOT NULL DEFAULT 0 COMMENT '变更序号',
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='变更序号表';
+
+-- 27. card_data_sync_leases 流转卡数据同步序号租约表（未提交的写入）
+CREATE TABLE `card_data_sync_leases` (
+  `seq` bigint NOT NULL AUTO_INCREMENT COMMENT '同步序号',
+  `card_id` int NOT NULL COMMENT '流转卡ID',
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '分配时间',
+  PRIMARY KEY (`seq`),
+  KEY `idx_card_seq` (`card_id`,`seq`),
+  KEY `idx_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='流转卡数据同步序号租约表';
+
 -- ========================================
 -- 第四步：创建视图
 -- ========================================
 
--- 19. card_flow_history 流转卡流转历史视图
+-- 28. card_flow_history 流转卡流转历史视图
 CREATE VIEW `card_flow_history` AS
 SELECT 
   `tc`.`id` AS `card_id`,
@@ -602,6 +720,26 @@ ADD CONSTRAINT `card_field_permissions_ibfk_1` FOREIGN KEY (`card_id`) REFERENCE
 ALTER TABLE `card_field_permissions` 
 ADD CONSTRAINT `card_field_permissions_ibfk_2` FOREIGN KEY (`department_id`) REFERENCES `departments` (`id`) ON DELETE CASCADE;
 
+-- 添加外键：card_data_values.(card_id, row_number) -> card_data.(card_id, row_number)
+ALTER TABLE `card_data_values` 
+ADD CONSTRAINT `card_data_values_ibfk_1` FOREIGN KEY (`card_id`, `row_number`) REFERENCES `card_data` (`card_id`, `row_number`) ON DELETE CASCADE;
+
+-- 添加外键：template_snapshot_fields.snapshot_id -> template_snapshots.snapshot_id
+ALTER TABLE `template_snapshot_fields` 
+ADD CONSTRAINT `template_snapshot_fields_ibfk_1` FOREIGN KEY (`snapshot_id`) REFERENCES `template_snapshots` (`snapshot_id`) ON DELETE CASCADE;
+
+-- 添加外键：template_snapshot_permissions.snapshot_id -> template_snapshots.snapshot_id
+ALTER TABLE `template_snapshot_permissions` 
+ADD CONSTRAINT `template_snapshot_permissions_ibfk_1` FOREIGN KEY (`snapshot_id`) REFERENCES `template_snapshots` (`snapshot_id`) ON DELETE CASCADE;
+
+-- 添加外键：template_snapshot_flow.snapshot_id -> template_snapshots.snapshot_id
+ALTER TABLE `template_snapshot_flow` 
+ADD CONSTRAINT `template_snapshot_flow_ibfk_1` FOREIGN KEY (`snapshot_id`) REFERENCES `template_snapshots` (`snapshot_id`) ON DELETE CASCADE;
+
+-- 添加外键：template_snapshot_flow.department_id -> departments.id
+ALTER TABLE `template_snapshot_flow` 
+ADD CONSTRAINT `template_snapshot_flow_ibfk_2` FOREIGN KEY (`department_id`) REFERENCES `departments` (`id`) ON DELETE CASCADE;
+
 -- ========================================
 -- 完成
 -- ========================================
@@ -21,6 +21,26 @@ function clearAuthToken() {
     localStorage.removeItem('authToken');
 }
 
+// 把列式格式的数据行（columns + rows）展开为 table_data 对象数组
+function expandColumnarRows(data) {
+    if (!data || data.format !== 'columnar') {
+        return data;
+    }
+    const { columns, rows, field_offset: fieldOffset } = data;
+    data.table_data = (rows || []).map(values => {
+        const row = { values: {} };
+        columns.forEach((name, index) => {
+            row[name] = values[index];
+            if (index >= fieldOffset) {
+                row.values[name] = values[index];
+            }
+        });
+        return row;
+    });
+    delete data.rows;
+    return data;
+}
+
 // 创建axios实例
 const api = axios.create({
     baseURL: API_BASE_URL,
@@ -253,8 +273,18 @@ const cardAPI = {
     },
     
     // 获取流转卡数据（表格格式）
-    getCardData: (id) => {
-        return api.get(`/cards/${id}/data`);
+    // since 为上次返回的 sync_token，传入时只返回增量（table_data + deleted_rows）
+    // 使用列式格式传输（列名只传一次），收到后展开为 table_data
+    getCardData: async (id, since = null) => {
+        const params = { format: 'columnar' };
+        if (since) {
+            params.since = since;
+        }
+        const response = await api.get(`/cards/${id}/data`, { params });
+        if (response && response.success) {
+            expandColumnarRows(response.data);
+        }
+        return response;
     },
     
     // 批量保存流转卡数据
@@ -348,6 +378,11 @@ const templateAPI = {
     // 创建表格格式的模板流转卡
     createTemplateCardWithTableData: (cardData) => {
         return api.post('/template-cards/table-format', cardData);
+    },
+    
+    // 基于同一模板批量创建流转卡（cards 列表，或 count + card_number_prefix）
+    createTemplateCardsBulk: (bulkData) => {
+        return api.post('/template-cards/bulk', bulkData);
     }
 };
 
@@ -520,5 +555,6 @@ window.TransferCardAPI = {
     utils: utils,
     setAuthToken,
     clearAuthToken,
-    getAuthToken
+    getAuthToken,
+    baseURL: API_BASE_URL
 };
@@ -274,11 +274,17 @@ new Vue({
             // 静默数据更新（用户无感知）
             updateInterval: 30000, // 30秒更新一次
             realTimeUpdateTimer: null,
+            eventSource: null,         // 实时推送连接（SSE）
+            streamConnected: false,    // 推送连接正常时降低轮询频率
+            streamPollEvery: 4,        // 推送连接正常时每隔几个更新周期仍轮询一次（兜底多进程部署和漏推的事件）
+            streamPollTicks: 0,
+            streamRefreshTimer: null,
             previousData: null,
             recentOperations: [],
             loadingOperations: false,
             operationFilter: '',
             hasMoreOperations: true,
+            operationsCursor: null,
             currentPage: 1,
             
             // 流转卡数据
@@ -735,6 +741,7 @@ new Vue({
             } catch (error) {
                 console.error('退出登录失败', error);
             } finally {
+                this.disconnectEventStream();
                 TransferCardAPI.clearAuthToken();
                 this.isLoggedIn = false;
                 this.currentUser = null;
@@ -2517,11 +2524,12 @@ new Vue({
             try {
                 console.log(' 加载最近操作记录，页面:', this.currentPage);
                 
-                // 调用后端API获取操作记录
-                const response = await TransferCardAPI.dashboard.getOperations({
-                    page: this.currentPage,
-                    per_page: 10
-                });
+                // 调用后端API获取操作记录（第一页之后按上一页返回的游标翻页）
+                const params = { page_size: 10 };
+                if (this.currentPage > 1 && this.operationsCursor) {
+                    params.cursor = this.operationsCursor;
+                }
+                const response = await TransferCardAPI.dashboard.getOperations(params);
                 
                 console.log('📡 操作记录API响应:', response);
                 
@@ -2536,9 +2544,9 @@ new Vue({
                     }
                     
                     // 检查是否还有更多数据
-                    this.hasMoreOperations = operations.length === 10 && 
-                                          (response.data.total === undefined || 
-                                           this.recentOperations.length < response.data.total);
+                    const pagination = response.data.pagination || {};
+                    this.operationsCursor = pagination.next_cursor || null;
+                    this.hasMoreOperations = !!pagination.has_more;
                     
                     console.log(' 操作记录加载成功，当前数量:', this.recentOperations.length);
                 } else {
@@ -2684,12 +2692,23 @@ new Vue({
 
             console.log(' 启动自动数据更新，间隔:', this.updateInterval / 1000, '秒');
 
-            // 立即执行一次更新
+            // 立即执行一次更新并连接实时推送
             this.performRealTimeUpdate();
+            if (this.isLoggedIn) {
+                this.connectEventStream();
+            }
 
-            // 设置定时更新
+            // 设置定时更新（推送连接正常时降低频率，轮询请求带 ETag，未变化时服务端返回 304）
+            this.streamPollTicks = 0;
             this.realTimeUpdateTimer = setInterval(() => {
-                this.performRealTimeUpdate();
+                if (this.isLoggedIn && !this.eventSource) {
+                    this.connectEventStream();
+                }
+                this.streamPollTicks += 1;
+                if (!this.streamConnected || this.streamPollTicks >= this.streamPollEvery) {
+                    this.streamPollTicks = 0;
+                    this.performRealTimeUpdate();
+                }
             }, this.updateInterval);
         },
 
@@ -2700,6 +2719,60 @@ new Vue({
                 this.realTimeUpdateTimer = null;
                 console.log('⏹️ 停止实时数据更新');
             }
+            this.disconnectEventStream();
+        },
+
+        // 连接实时推送（SSE），收到流转卡变更事件后刷新数据
+        connectEventStream() {
+            const token = TransferCardAPI.getAuthToken();
+            if (!window.EventSource || this.eventSource || !token) {
+                return;
+            }
+
+            // EventSource 无法设置请求头，令牌通过查询参数传递
+            const url = `${TransferCardAPI.baseURL}/stream?jwt=${encodeURIComponent(token)}`;
+            const source = new EventSource(url);
+
+            source.onopen = () => {
+                this.streamConnected = true;
+                console.log(' 实时推送已连接');
+            };
+
+            // 断线时浏览器会自动重连，期间恢复定时轮询
+            source.onerror = () => {
+                this.streamConnected = false;
+            };
+
+            ['card-created', 'card-updated', 'row-saved', 'flow-advanced'].forEach(type => {
+                source.addEventListener(type, (event) => this.handleStreamEvent(type, event));
+            });
+
+            this.eventSource = source;
+        },
+
+        // 断开实时推送
+        disconnectEventStream() {
+            if (this.eventSource) {
+                this.eventSource.close();
+                this.eventSource = null;
+            }
+            this.streamConnected = false;
+            if (this.streamRefreshTimer) {
+                clearTimeout(this.streamRefreshTimer);
+                this.streamRefreshTimer = null;
+            }
+        },
+
+        // 处理推送事件（短时间内的多个事件合并为一次刷新）
+        handleStreamEvent(type, event) {
+            console.log(' 收到实时事件:', type, event.data);
+            if (this.streamRefreshTimer) {
+                clearTimeout(this.streamRefreshTimer);
+            }
+            this.streamRefreshTimer = setTimeout(() => {
+                this.streamRefreshTimer = null;
+                this.performRealTimeUpdate();
+            }, 500);
         },
 
         // 执行实时数据更新